@@ -0,0 +1,269 @@
+from decimal import Decimal
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from botocore.exceptions import ClientError
+
+# In-process stand-ins for the DynamoDB resource and the Mongo database, implementing just
+# what the adapters call. They keep the data shapes of the real services (Decimals from
+# DynamoDB, paginated scans) so the adapters' own work is what gets measured.
+
+SCAN_PAGE_SIZE = 100
+
+def _client_error(code: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+def _to_dynamo(value: Any) -> Any:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _to_dynamo(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_dynamo(v) for v in value]
+    return value
+
+class FakeDynamoTable:
+    def __init__(self, name: str):
+        self.name = name
+        self.items: Dict[str, Dict] = {}
+
+    def _key(self, key: Dict) -> str:
+        return "|".join(str(v) for v in key.values())
+
+    async def get_item(self, Key: Dict, **kwargs) -> Dict:
+        item = self.items.get(self._key(Key))
+        return {"Item": dict(item)} if item else {}
+
+    async def put_item(self, Item: Dict, **kwargs):
+        self.items[self._key({"canvas_id": Item["canvas_id"]})] = _to_dynamo(Item)
+
+    async def delete_item(self, Key: Dict, **kwargs):
+        self.items.pop(self._key(Key), None)
+
+    async def update_item(self, Key: Dict, UpdateExpression: str, ExpressionAttributeNames: Dict, ExpressionAttributeValues: Dict, ConditionExpression: Optional[str] = None, **kwargs):
+        item = self.items.get(self._key(Key))
+        if ConditionExpression:
+            match = re.fullmatch(r"attribute_not_exists\((#\w+)\)", ConditionExpression)
+            if not match:
+                raise NotImplementedError(ConditionExpression)
+            if item and ExpressionAttributeNames[match.group(1)] in item:
+                raise _client_error("ConditionalCheckFailedException", "UpdateItem")
+
+        if item is None:
+            item = dict(Key)
+        else:
+            item = dict(item)
+
+        clauses = re.split(r"\b(SET|ADD)\s+", UpdateExpression)
+        assert clauses[0].strip() == ""
+        for action, body in zip(clauses[1::2], clauses[2::2]):
+            for part in body.split(","):
+                if action == "ADD":
+                    name, placeholder = part.split()
+                    current = item.get(ExpressionAttributeNames[name], Decimal(0))
+                    item[ExpressionAttributeNames[name]] = current + _to_dynamo(ExpressionAttributeValues[placeholder])
+                    continue
+
+                path, placeholder = (s.strip() for s in part.split("="))
+                names = [ExpressionAttributeNames[n] for n in path.split(".")]
+                value = _to_dynamo(ExpressionAttributeValues[placeholder])
+
+                target = item
+                for name in names[:-1]:
+                    if name not in target:
+                        raise _client_error("ValidationException", "UpdateItem")
+                    target[name] = dict(target[name])
+                    target = target[name]
+                target[names[-1]] = value
+
+        self.items[self._key(Key)] = item
+        return {"Attributes": dict(item)}
+
+    async def scan(self, FilterExpression=None, ProjectionExpression: Optional[str] = None, ExclusiveStartKey: Optional[Dict] = None, **kwargs) -> Dict:
+        prefix = None
+        if FilterExpression is not None:
+            expression = FilterExpression.get_expression()
+            if expression["operator"] != "begins_with":
+                raise NotImplementedError(expression["operator"])
+            prefix = expression["values"][1]
+
+        keys = sorted(self.items)
+        start = keys.index(self._key(ExclusiveStartKey)) + 1 if ExclusiveStartKey else 0
+        page = keys[start : start + SCAN_PAGE_SIZE]
+
+        projection = [p.strip() for p in ProjectionExpression.split(",")] if ProjectionExpression else None
+        items = []
+        for key in page:
+            item = self.items[key]
+            if prefix and not str(item.get("canvas_id", "")).startswith(prefix):
+                continue
+            items.append({k: item[k] for k in projection if k in item} if projection else dict(item))
+
+        response: Dict[str, Any] = {"Items": items}
+        if start + SCAN_PAGE_SIZE < len(keys):
+            response["LastEvaluatedKey"] = {"canvas_id": self.items[page[-1]]["canvas_id"]}
+        return response
+
+class FakeDynamoResource:
+    def __init__(self):
+        self.tables: Dict[str, FakeDynamoTable] = {}
+
+    def _table(self, name: str) -> FakeDynamoTable:
+        if name not in self.tables:
+            self.tables[name] = FakeDynamoTable(name)
+        return self.tables[name]
+
+    async def Table(self, name: str) -> FakeDynamoTable:
+        return self._table(name)
+
+    async def batch_get_item(self, RequestItems: Dict) -> Dict:
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self._table(name)
+            found = []
+            for key in request["Keys"]:
+                item = table.items.get(table._key(key))
+                if item:
+                    found.append(dict(item))
+            responses[name] = found
+        return {"Responses": responses}
+
+def _get_path(doc: Dict, path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def _matches(doc: Dict, query: Dict) -> bool:
+    for field, condition in query.items():
+        value = _get_path(doc, field)
+        if isinstance(condition, dict):
+            for op, arg in condition.items():
+                if op == "$in" and value not in arg:
+                    return False
+                elif op == "$regex" and (value is None or not re.search(arg, value)):
+                    return False
+                elif op == "$lt" and not (value is not None and value < arg):
+                    return False
+                elif op == "$lte" and not (value is not None and value <= arg):
+                    return False
+                elif op == "$gte" and not (value is not None and value >= arg):
+                    return False
+                elif op not in ("$in", "$regex", "$lt", "$lte", "$gte"):
+                    raise NotImplementedError(op)
+        elif value != condition:
+            return False
+    return True
+
+def _project(doc: Dict, projection: Optional[Dict]) -> Dict:
+    if not projection:
+        return dict(doc)
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        return {k: doc[k] for k in included if k in doc}
+    return {k: v for k, v in doc.items() if k not in projection}
+
+class FakeMongoCursor:
+    def __init__(self, docs: List[Dict]):
+        self._docs = docs
+
+    def sort(self, key, direction: int = 1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: _get_path(d, field), reverse=order < 0)
+        return self
+
+    def skip(self, n: int):
+        self._docs = self._docs[n:]
+        return self
+
+    def limit(self, n: int):
+        self._docs = self._docs[:n]
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield doc
+
+class FakeMongoCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self.docs: List[Dict] = []
+        # Stands in for the unique canvas_id index so per-tile updates aren't dominated by the fake
+        self._by_canvas_id: Dict[str, Dict] = {}
+
+    def _index(self):
+        self._by_canvas_id = {d["canvas_id"]: d for d in self.docs if "canvas_id" in d}
+
+    def find(self, query: Optional[Dict] = None, projection: Optional[Dict] = None) -> FakeMongoCursor:
+        return FakeMongoCursor([_project(d, projection) for d in self.docs if _matches(d, query or {})])
+
+    async def find_one(self, query: Optional[Dict] = None, projection: Optional[Dict] = None, sort=None) -> Optional[Dict]:
+        cursor = self.find(query, projection)
+        if sort:
+            cursor.sort(sort)
+        return next(iter(cursor._docs), None)
+
+    async def update_one(self, query: Dict, update: Dict, upsert: bool = False):
+        if list(query) == ["canvas_id"] and isinstance(query["canvas_id"], str):
+            doc = self._by_canvas_id.get(query["canvas_id"])
+        else:
+            doc = next((d for d in self.docs if _matches(d, query)), None)
+        if doc is None:
+            if not upsert:
+                return
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            self.docs.append(doc)
+            self._index()
+
+        for path, value in update.get("$set", {}).items():
+            parts = path.split(".")
+            target = doc
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+        for field, value in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + value
+        for field, value in update.get("$max", {}).items():
+            doc[field] = max(doc.get(field, value), value)
+        return doc
+
+    async def find_one_and_update(self, query: Dict, update: Dict, upsert: bool = False, **kwargs) -> Optional[Dict]:
+        # Always hands back the updated document, as the adapters ask for
+        doc = await self.update_one(query, update, upsert)
+        return dict(doc) if doc is not None else None
+
+    async def insert_one(self, doc: Dict):
+        self.docs.append(dict(doc))
+        self._index()
+
+    async def insert_many(self, docs: Iterable[Dict], ordered: bool = True):
+        self.docs.extend(dict(d) for d in docs)
+        self._index()
+
+    async def delete_many(self, query: Dict):
+        self.docs = [d for d in self.docs if not _matches(d, query)]
+        self._index()
+
+    async def count_documents(self, query: Dict) -> int:
+        return sum(1 for d in self.docs if _matches(d, query))
+
+class FakeMongoDatabase:
+    def __init__(self):
+        self._collections: Dict[str, FakeMongoCollection] = {}
+
+    def __getattr__(self, name: str) -> FakeMongoCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in self._collections:
+            self._collections[name] = FakeMongoCollection(name)
+        return self._collections[name]
+
+    __getitem__ = __getattr__
@@ -0,0 +1,222 @@
+# Replays traffic recorded with TRAFFIC_RECORD_DIR against a running backend.
+#
+#   python benchmarks/replay.py recording.jsonl.gz --target http://localhost:8000 --speed 10
+#   python benchmarks/replay.py a.jsonl.gz b.jsonl.gz --speed 0 --users 20 --output replay.json
+#
+# --speed 1 keeps the recorded timing, 10 plays it ten times faster and 0 sends as fast as the
+# concurrency limit allows. Requests are issued in recorded order and recorded clients are mapped
+# onto replay users by first appearance, so every run against the same backend sends the same traffic.
+
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import websockets
+
+FORMAT = "canvas-traffic"
+PASSWORD = "Replay-password-1"
+
+def load(paths: List[str]) -> Tuple[List[Dict], List[Dict]]:
+    # Recordings from several instances are merged on their wall-clock start times
+    headers = []
+    recordings = []
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        if not lines or lines[0].get("format") != FORMAT:
+            raise ValueError(f"{path} is not a traffic recording")
+        headers.append(lines[0])
+        recordings.append((lines[0]["started_at"], lines[1:]))
+
+    origin = min(started_at for started_at, _ in recordings)
+    events = []
+    for started_at, recorded in recordings:
+        for event in recorded:
+            events.append({**event, "t": event["t"] + started_at - origin})
+    events.sort(key=lambda e: e["t"])
+    return headers, events
+
+async def create_users(client: httpx.AsyncClient, count: int) -> List[str]:
+    # Works against the local and memory environments, which accept any verification code
+    tokens = []
+    for i in range(count):
+        email = f"replay-{i}@example.com"
+        await client.post("/api/auth/register", json={"email": email, "username": f"replay{i}", "password": PASSWORD})
+        await client.post("/api/auth/verify", json={"email": email, "code": "000000"})
+        response = await client.post("/api/auth/login", json={"email": email, "password": PASSWORD})
+        response.raise_for_status()
+        tokens.append(response.json()["token"]["access_token"])
+    return tokens
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.mismatched: Dict[str, int] = {}
+        self.skipped = 0
+        self.messages = 0
+        self.max_lag = 0.0
+
+    def add(self, kind: str, latency: float, status: int, recorded: int):
+        self.latencies.setdefault(kind, []).append(latency)
+        counts = self.statuses.setdefault(kind, {})
+        counts[str(status)] = counts.get(str(status), 0) + 1
+        # Compared by class; a recorded 200 that now fails is what matters, not 200 vs 201
+        if recorded and status // 100 != recorded // 100:
+            self.mismatched[kind] = self.mismatched.get(kind, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict:
+        kinds = {}
+        for kind, values in self.latencies.items():
+            ordered = sorted(values)
+            kinds[kind] = {
+                "count": len(ordered),
+                "p50": statistics.median(ordered),
+                "p90": ordered[int(0.9 * (len(ordered) - 1))],
+                "p99": ordered[int(0.99 * (len(ordered) - 1))],
+                "max": ordered[-1],
+                "statuses": self.statuses[kind],
+                "status_mismatches": self.mismatched.get(kind, 0),
+            }
+        return {
+            "elapsed": elapsed,
+            "skipped": self.skipped,
+            "ws_messages": self.messages,
+            "max_schedule_lag": self.max_lag,
+            "kinds": kinds,
+        }
+
+class Replayer:
+    def __init__(self, args, tokens: List[str]):
+        self.args = args
+        self.tokens = tokens
+        self.clients: Dict[str, Optional[str]] = {}
+        self.stats = Stats()
+
+    def _token(self, client_id: str) -> Optional[str]:
+        if not client_id or not self.tokens:
+            return None
+        if client_id not in self.clients:
+            self.clients[client_id] = self.tokens[len(self.clients) % len(self.tokens)]
+        return self.clients[client_id]
+
+    async def _request(self, http: httpx.AsyncClient, event: Dict):
+        headers = {}
+        token = self._token(event.get("c", ""))
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        content = None
+        if "b" in event:
+            content = base64.b64decode(event["b"])
+            headers["Content-Type"] = event.get("ct") or "application/octet-stream"
+
+        url = event["p"] + (f"?{event['q']}" if event.get("q") else "")
+        started = time.perf_counter()
+        try:
+            response = await http.request(event["m"], url, content=content, headers=headers)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+        self.stats.add(event["k"], time.perf_counter() - started, status, event.get("s", 0))
+
+    async def _connect(self, event: Dict, hold: float):
+        url = self.args.target.replace("http", "ws", 1) + event["p"]
+        started = time.perf_counter()
+        try:
+            async with websockets.connect(url, open_timeout=self.args.timeout) as ws:
+                self.stats.add("connect", time.perf_counter() - started, 101, event.get("s", 0))
+                deadline = time.monotonic() + hold
+                while (remaining := deadline - time.monotonic()) > 0:
+                    try:
+                        await asyncio.wait_for(ws.recv(), timeout=remaining)
+                        self.stats.messages += 1
+                    except asyncio.TimeoutError:
+                        break
+        except (OSError, websockets.WebSocketException, asyncio.TimeoutError):
+            self.stats.add("connect", time.perf_counter() - started, 0, event.get("s", 0))
+
+    async def run(self, events: List[Dict]) -> Dict:
+        speed = self.args.speed
+        sem = asyncio.Semaphore(self.args.concurrency)
+        tasks = set()
+
+        def _spawn(coro, release: bool):
+            task = asyncio.create_task(coro)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            if release:
+                task.add_done_callback(lambda _: sem.release())
+
+        limits = httpx.Limits(max_connections=self.args.concurrency)
+        async with httpx.AsyncClient(base_url=self.args.target, timeout=self.args.timeout, limits=limits) as http:
+            start = time.monotonic()
+            for event in events:
+                if speed > 0:
+                    due = start + event["t"] / speed
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        self.stats.max_lag = max(self.stats.max_lag, -delay)
+
+                if event.get("n") == -1:
+                    self.stats.skipped += 1
+                elif event["k"] == "connect":
+                    # Sockets are held for their recorded lifetime and don't count against the limit
+                    _spawn(self._connect(event, event.get("d", 0) / speed if speed > 0 else 0), release=False)
+                else:
+                    await sem.acquire()
+                    _spawn(self._request(http, event), release=True)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+            return self.stats.summary(time.monotonic() - start)
+
+def _print(summary: Dict):
+    print(f"Replayed in {summary['elapsed']:.2f}s, max schedule lag {summary['max_schedule_lag'] * 1000:.0f}ms, "
+          f"{summary['skipped']} skipped, {summary['ws_messages']} socket messages")
+    for kind, s in sorted(summary["kinds"].items()):
+        statuses = ", ".join(f"{code}x{n}" for code, n in sorted(s["statuses"].items()))
+        print(f"  {kind:<10} {s['count']:>7}  p50 {s['p50'] * 1000:8.1f}ms  p90 {s['p90'] * 1000:8.1f}ms  "
+              f"p99 {s['p99'] * 1000:8.1f}ms  max {s['max'] * 1000:8.1f}ms  [{statuses}]  mismatches {s['status_mismatches']}")
+
+async def main(args) -> int:
+    headers, events = load(args.recordings)
+    width, height = headers[0].get("canvas_width"), headers[0].get("canvas_height")
+    print(f"{len(events)} events over {events[-1]['t'] if events else 0:.1f}s, recorded on a {width}x{height} canvas")
+
+    tokens = list(args.token or [])
+    if args.users:
+        async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout) as http:
+            tokens += await create_users(http, args.users)
+    if not tokens and any(e.get("c") for e in events):
+        print("No --token or --users given; authenticated requests will be sent anonymously")
+
+    summary = await Replayer(args, tokens).run(events)
+    _print(summary)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"recordings": headers, "speed": args.speed, "target": args.target, **summary}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded canvas traffic")
+    parser.add_argument("recordings", nargs="+", help="Files written by the traffic recorder")
+    parser.add_argument("--target", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time compression; 0 sends as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum HTTP requests in flight")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--token", action="append", help="Access token to replay as (repeatable)")
+    parser.add_argument("--users", type=int, default=0, help="Register and log in this many replay users")
+    parser.add_argument("--output", help="Write the summary as JSON to this path")
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,337 @@
+# Offline micro-benchmarks for the canvas hot paths.
+#
+#   python benchmarks/run.py --output before.json
+#   python benchmarks/run.py --output after.json --compare before.json
+#
+# Everything runs in-process against the fakes in benchmarks/fakes.py, so results are
+# comparable between commits on the same machine without AWS, Mongo or Valkey.
+
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+sys.path.insert(0, BENCH_DIR)
+
+from fastapi.encoders import jsonable_encoder
+from PIL import Image
+
+from adapters.db import DBAdapter, MemoryDBAdapter, empty_canvas_version
+from adapters.dynamodb import DynamoDBAdapter
+from adapters.mongo import MongoDBAdapter
+from config import config
+from fakes import FakeDynamoResource, FakeMongoDatabase
+from models import PixelData
+from services.canvas import CanvasService
+
+DEFAULT_SIZES = [100, 250, 500]
+DEFAULT_TILE_SIZES = [16, 32, 64]
+FILL_RATIO = 0.5
+# Simultaneous page loads in the coalesced read case
+BURST = 32
+PALETTE = ["#000000", "#ffffff", "#ff4500", "#ffa800", "#ffd635", "#00a368", "#3690ea", "#811e9f"]
+
+# A case prepares its state once and returns the operation to time
+Setup = Callable[[], Awaitable[Callable[[], Awaitable[object]]]]
+
+class Case:
+    def __init__(self, name: str, params: Dict, setup: Setup):
+        self.name = name
+        self.params = params
+        self.setup = setup
+
+    @property
+    def id(self) -> str:
+        params = ",".join(f"{k}={v}" for k, v in self.params.items())
+        return f"{self.name}[{params}]"
+
+def _configure(size: int, tile_size: int = 32):
+    config.canvas_width = size
+    config.canvas_height = size
+    config.tile_size = tile_size
+
+def _make_pixels(size: int) -> List[PixelData]:
+    # Seeded so every run and every commit measures the same canvas
+    rng = random.Random(size)
+    count = int(size * size * FILL_RATIO)
+    coords = rng.sample(range(size * size), count)
+    return [
+        PixelData(x=c % size, y=c // size, color=rng.choice(PALETTE), userId=f"user-{c % 97}", timestamp=1700000000 + c)
+        for c in coords
+    ]
+
+def _colors(pixels: List[PixelData]) -> Dict[str, str]:
+    return {f"{p.x}_{p.y}": p.color for p in pixels}
+
+def _service(db: Optional[DBAdapter] = None) -> CanvasService:
+    return CanvasService(db, None)
+
+class _StaticColors:
+    def __init__(self, colors: Dict[str, str]):
+        self.colors = colors
+
+    async def get_canvas_colors(self, canvas_id: str) -> Dict[str, str]:
+        return self.colors
+
+    async def get_canvas_version(self, canvas_id: str) -> Dict[str, int]:
+        return empty_canvas_version()
+
+def _dynamo_adapter() -> DynamoDBAdapter:
+    return DynamoDBAdapter(FakeDynamoResource())
+
+def _mongo_adapter() -> MongoDBAdapter:
+    # The adapter only indexes the client by database name
+    return MongoDBAdapter({config.mongo_db: FakeMongoDatabase()})
+
+ADAPTERS: Dict[str, Callable[[], DBAdapter]] = {
+    "dynamodb": _dynamo_adapter,
+    "mongo": _mongo_adapter,
+    "memory": MemoryDBAdapter,
+}
+
+def service_cases(sizes: List[int], tile_sizes: List[int]) -> List[Case]:
+    cases = []
+    for size in sizes:
+        def create_image(size=size):
+            async def setup():
+                _configure(size)
+                service = _service()
+                colors = _colors(_make_pixels(size))
+
+                async def run():
+                    return service._create_canvas_image(colors, size, size)
+                return run
+            return setup
+
+        def image_to_pixels(size=size):
+            async def setup():
+                _configure(size)
+                service = _service()
+                rng = random.Random(size)
+                img = Image.frombytes("RGB", (size, size), bytes(rng.getrandbits(8) for _ in range(size * size * 3)))
+
+                async def run():
+                    return service.image_to_pixels(img)
+                return run
+            return setup
+
+        def canvas_state(size=size):
+            async def setup():
+                _configure(size)
+                service = _service(_StaticColors(_colors(_make_pixels(size))))
+
+                # What the route hands back to FastAPI, encoded the way the response would be
+                async def run():
+                    return json.dumps(jsonable_encoder(await service.get_canvas_state()))
+                return run
+            return setup
+
+        def canvas_state_burst(size=size):
+            async def setup():
+                _configure(size)
+                service = _service(_StaticColors(_colors(_make_pixels(size))))
+                # Only concurrent reads share; a cached body would make every round after the first free
+                service.resident.state.max_age = 0
+
+                async def run():
+                    return await asyncio.gather(*(service.get_canvas_state_body() for _ in range(BURST)))
+                return run
+            return setup
+
+        cases.append(Case("service.create_canvas_image", {"size": size}, create_image()))
+        cases.append(Case("service.image_to_pixels", {"size": size}, image_to_pixels()))
+        cases.append(Case("service.get_canvas_state", {"size": size}, canvas_state()))
+        cases.append(Case("service.get_canvas_state_body", {"size": size, "burst": BURST}, canvas_state_burst()))
+
+        for tile_size in tile_sizes:
+            def snapshot_tiles(size=size, tile_size=tile_size):
+                async def setup():
+                    _configure(size, tile_size)
+                    service = _service()
+                    pixels_map = {f"{p.x}_{p.y}": p for p in _make_pixels(size)}
+
+                    async def run():
+                        return service._snapshot_tiles(pixels_map)
+                    return run
+                return setup
+
+            cases.append(Case("service.snapshot_tiles", {"size": size, "tile": tile_size}, snapshot_tiles()))
+    return cases
+
+def adapter_cases(sizes: List[int], tile_sizes: List[int]) -> List[Case]:
+    cases = []
+    for backend, factory in ADAPTERS.items():
+        for size in sizes:
+            for tile_size in tile_sizes:
+                def seeded(size=size, tile_size=tile_size, factory=factory) -> Callable[[], Awaitable[Tuple[DBAdapter, List[PixelData]]]]:
+                    async def make():
+                        _configure(size, tile_size)
+                        db = factory()
+                        pixels = _make_pixels(size)
+                        await db.bulk_overwrite_canvas(config.default_canvas_id, pixels)
+                        return db, pixels
+                    return make
+
+                def read(operation: str, seed=seeded()):
+                    async def setup():
+                        db, _ = await seed()
+                        if operation == "get_canvas_tiles":
+                            # A viewport's worth of tiles, as the client requests them
+                            tiles_across = max(1, min(8, config.canvas_width // config.tile_size))
+                            tile_ids = [f"{tx}_{ty}" for tx in range(tiles_across) for ty in range(tiles_across)]
+                            return lambda: db.get_canvas_tiles(config.default_canvas_id, tile_ids)
+                        return lambda: getattr(db, operation)(config.default_canvas_id)
+                    return setup
+
+                def bulk_update(seed=seeded(), size=size):
+                    async def setup():
+                        db, _ = await seed()
+                        # A large stroke: one row in ten across the whole canvas
+                        rng = random.Random(size + 1)
+                        stroke = [
+                            PixelData(x=x, y=y, color=rng.choice(PALETTE), userId="bench", timestamp=1800000000)
+                            for y in range(0, size, 10) for x in range(size)
+                        ]
+                        return lambda: db.bulk_update_canvas(config.default_canvas_id, stroke)
+                    return setup
+
+                def bulk_overwrite(seed=seeded()):
+                    async def setup():
+                        db, pixels = await seed()
+                        return lambda: db.bulk_overwrite_canvas(config.default_canvas_id, pixels)
+                    return setup
+
+                params = {"size": size, "tile": tile_size}
+                for operation in ("get_canvas_state", "get_canvas_colors", "get_canvas_tiles"):
+                    cases.append(Case(f"{backend}.{operation}", params, read(operation)))
+                cases.append(Case(f"{backend}.bulk_update_canvas", params, bulk_update()))
+                cases.append(Case(f"{backend}.bulk_overwrite_canvas", params, bulk_overwrite()))
+    return cases
+
+async def _time(fn: Callable[[], Awaitable[object]], number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        await fn()
+    return (time.perf_counter() - start) / number
+
+async def measure(case: Case, repeat: int, min_time: float) -> Dict:
+    fn = await case.setup()
+
+    # Calibrate so each round runs long enough for the timer to be meaningful
+    number = 1
+    while True:
+        elapsed = await _time(fn, number) * number
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    rounds = [await _time(fn, number) for _ in range(repeat)]
+    return {
+        "name": case.name,
+        "params": case.params,
+        "number": number,
+        "repeat": repeat,
+        "min": min(rounds),
+        "median": statistics.median(rounds),
+        "mean": statistics.fmean(rounds),
+        "stdev": statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+    }
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _meta() -> Dict:
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+def _format_seconds(value: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if value >= scale:
+            return f"{value / scale:.2f}{unit}"
+    return f"{value / 1e-9:.0f}ns"
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> int:
+    # Medians against medians; min is steadier but hides contention the app would see
+    regressions = 0
+    for case_id, result in results.items():
+        before = baseline.get(case_id)
+        if not before:
+            print(f"{'new':>10}  {case_id}")
+            continue
+        change = result["median"] / before["median"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  improved"
+        print(f"{change:>+10.1%}  {case_id}  {_format_seconds(before['median'])} -> {_format_seconds(result['median'])}{flag}")
+    return regressions
+
+async def main(args) -> int:
+    cases = service_cases(args.sizes, args.tile_sizes) + adapter_cases(args.sizes, args.tile_sizes)
+    if args.filter:
+        cases = [c for c in cases if any(f in c.id for f in args.filter)]
+
+    results: Dict[str, Dict] = {}
+    for case in cases:
+        result = await measure(case, args.repeat, args.min_time)
+        results[case.id] = result
+        print(f"{case.id:<60} {_format_seconds(result['median']):>10}  (±{_format_seconds(result['stdev'])}, n={result['number']})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": _meta(), "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {baseline['meta'].get('commit') or args.compare}:")
+        regressions = compare(results, baseline["results"], args.threshold)
+        if regressions:
+            print(f"{regressions} case(s) slower by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Canvas hot path micro-benchmarks")
+    parser.add_argument("--sizes", type=_ints, default=DEFAULT_SIZES, help="Canvas edge lengths, comma separated")
+    parser.add_argument("--tile-sizes", type=_ints, default=DEFAULT_TILE_SIZES, help="Tile edge lengths, comma separated")
+    parser.add_argument("--filter", action="append", help="Only run cases whose id contains this (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per timed round")
+    parser.add_argument("--quick", action="store_true", help="Smallest sizes and fewer rounds, for a smoke run")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--compare", help="Baseline JSON from a previous run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes = args.sizes[:1]
+        args.tile_sizes = args.tile_sizes[:1]
+        args.repeat = 3
+        args.min_time = 0.05
+
+    sys.exit(asyncio.run(main(args)))
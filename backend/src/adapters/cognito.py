@@ -0,0 +1,305 @@
+import asyncio
+import base64
+from datetime import datetime
+import hashlib
+import hmac
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from adapters.auth import AuthAdapter, AuthToken, TokenSession, User
+from config import config
+from utils.cache import TTLCache
+from utils.cognito import CognitoTokenVerifier, JWKSUnavailableError, load_jwks, token_expiry
+
+class CognitoAuthAdapter(AuthAdapter):
+    def __init__(self, cognito_client):
+        self.cognito = cognito_client
+        self.user_pool_id = config.cognito_user_pool_id
+        self.client_id = config.cognito_client_id
+        self.client_secret = config.cognito_client_secret
+
+        self.verifier: Optional[CognitoTokenVerifier] = None
+        if config.cognito_local_verification:
+            self.verifier = CognitoTokenVerifier(
+                config.aws_region,
+                self.user_pool_id,
+                self.client_id,
+                fetch_jwks=load_jwks(config.cognito_jwks_path) if config.cognito_jwks_path else None,
+            )
+        # Access tokens only carry the sub, so profile attributes are remembered per user
+        self._profiles: TTLCache[User] = TTLCache(config.auth_cache_size, config.auth_profile_cache_ttl)
+    
+    def _get_secret_hash(self, username: str) -> str:
+        message = username + self.client_id
+        digest = hmac.new(
+            str(self.client_secret).encode("utf-8"),
+            msg=str(message).encode("utf-8"),
+            digestmod=hashlib.sha256
+        ).digest()
+        return base64.b64encode(digest).decode()
+
+    async def username_exists(self, username: str) -> bool:
+        try:
+            response = await self.cognito.list_users(
+                UserPoolId=self.user_pool_id,
+                Filter=f'preferred_username = "{username}"'
+            )
+            return len(response.get("Users", [])) > 0
+        except ClientError as e:
+            print(f"Error checking username: {e}")
+            return False
+        
+    async def register(self, email: str, username: str, password: str) -> Dict:
+        if await self.username_exists(username):
+            raise ValueError("Username already taken")
+        
+        try:
+            response = await self.cognito.sign_up(
+                ClientId=self.client_id,
+                SecretHash=self._get_secret_hash(email),
+                Username=email,
+                Password=password,
+                UserAttributes=[
+                    {"Name": "email", "Value": email},
+                    {"Name": "preferred_username", "Value": username}
+                ]
+            )
+
+            return {
+                "requires_verification": True,
+                "user_id": response["UserSub"]
+            }
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code == "UsernameExistsException":
+                raise ValueError("Email already registered")
+            elif error_code == "InvalidPasswordException":
+                raise ValueError("Password does not meet requirements")
+            else:
+                raise ValueError(f"Registration failed: {e.response["Error"]["Message"]}")
+    
+    async def verify_email(self, email: str, code: str) -> User:
+        try:
+            await self.cognito.confirm_sign_up(
+                ClientId=self.client_id,
+                SecretHash=self._get_secret_hash(email),
+                Username=email,
+                ConfirmationCode=code
+            )
+            
+            response = await self.cognito.admin_get_user(
+                UserPoolId=self.user_pool_id,
+                Username=email
+            )
+            
+            username = email
+            user_id = None
+            created_at = response.get("UserCreateDate", datetime.now())
+            
+            for attr in response.get("UserAttributes", []):
+                if attr["Name"] == "preferred_username":
+                    username = attr["Value"]
+                elif attr["Name"] == "sub":
+                    user_id = attr["Value"]
+            
+            return User(
+                user_id=user_id or response["Username"],
+                email=email,
+                username=username,
+                email_verified=True,
+                created_at=created_at
+            )
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code == "CodeMismatchException":
+                raise ValueError("Invalid verification code")
+            elif error_code == "ExpiredCodeException":
+                raise ValueError("Verification code has expired")
+            else:
+                raise ValueError(f"Verification failed: {e.response["Error"]["Message"]}")
+    
+    async def login(self, email: str, password: str) -> tuple[User, AuthToken]:
+        try:
+            response = await self.cognito.initiate_auth(
+                ClientId=self.client_id,
+                AuthFlow="USER_PASSWORD_AUTH",
+                AuthParameters={
+                    "USERNAME": email,
+                    "PASSWORD": password,
+                    "SECRET_HASH": self._get_secret_hash(email),
+                }
+            )
+            
+            auth_result = response["AuthenticationResult"]
+            access_token = auth_result["AccessToken"]
+            refresh_token = auth_result.get("RefreshToken")
+            
+            user_response = await self.cognito.get_user(AccessToken=access_token)
+            
+            username = email
+            user_id = None
+            email_verified = False
+            
+            for attr in user_response.get("UserAttributes", []):
+                if attr["Name"] == "preferred_username":
+                    username = attr["Value"]
+                elif attr["Name"] == "sub":
+                    user_id = attr["Value"]
+                elif attr["Name"] == "email_verified":
+                    email_verified = attr["Value"].lower() == "true"
+            
+            user = User(
+                user_id=user_id or user_response["Username"],
+                email=email,
+                username=username,
+                email_verified=email_verified,
+                created_at=datetime.now()
+            )
+            
+            token = AuthToken(
+                access_token=access_token,
+                refresh_token=refresh_token,
+                expires_in=auth_result.get("ExpiresIn", 3600)
+            )
+            
+            return user, token
+        except ClientError as e:
+            error_code = e.response["Error"]["Code"]
+            if error_code == "NotAuthorizedException":
+                raise ValueError("Invalid credentials")
+            elif error_code == "UserNotConfirmedException":
+                raise ValueError("Email not verified")
+            else:
+                raise ValueError(f"Login failed: {e.response["Error"]["Message"]}")
+    
+    async def refresh_token(self, email: str, refresh_token: str) -> tuple[User, AuthToken]:
+        try:
+            response = await self.cognito.initiate_auth(
+                ClientId=self.client_id,
+                AuthFlow="REFRESH_TOKEN_AUTH",
+                AuthParameters={
+                    "REFRESH_TOKEN": refresh_token,
+                    "SECRET_HASH": self._get_secret_hash(email),
+                }
+            )
+
+            auth_result = response["AuthenticationResult"]
+            access_token = auth_result["AccessToken"]
+            new_refresh_token = auth_result.get("RefreshToken") # Cognito may rotate the token or not
+
+            session = await self.get_session_from_token(access_token)
+            if not session:
+                raise ValueError("Failed to retrieve user info from refreshed token")
+            user = session.user
+            
+            token = AuthToken(
+                access_token=access_token,
+                refresh_token=new_refresh_token,
+                expires_in=auth_result.get("ExpiredIn", 3600)
+            )
+
+            return user, token
+        except ClientError as e:
+            raise ValueError(f"Token refresh failed: {e.response["Error"]["Message"]}")
+
+    async def logout(self, access_token: str) -> bool:
+        try:
+            await self.cognito.global_sign_out(AccessToken=access_token)
+            return True
+        except ClientError as e:
+            print(f"Logout error: {e}")
+            return False
+            
+    async def get_session_from_token(self, access_token: str) -> Optional[TokenSession]:
+        if self.verifier:
+            try:
+                claims = await self.verifier.verify(access_token)
+            except JWKSUnavailableError as e:
+                print(f"Local token verification unavailable, asking Cognito: {e}")
+            else:
+                if not claims:
+                    return None
+                user = self._profiles.get(claims["sub"])
+                if user:
+                    return TokenSession(user, datetime.fromtimestamp(claims["exp"]))
+
+        user = await self._fetch_user_from_token(access_token)
+        if not user:
+            return None
+        self._profiles.set(user.user_id, user)
+        return TokenSession(user, token_expiry(access_token))
+
+    async def _fetch_user_from_token(self, access_token: str) -> Optional[User]:
+        try:
+            response = await self.cognito.get_user(AccessToken=access_token)
+            
+            username = None
+            user_id = None
+            email = None
+            email_verified = False
+            
+            for attr in response.get("UserAttributes", []):
+                if attr["Name"] == "preferred_username":
+                    username = attr["Value"]
+                elif attr["Name"] == "sub":
+                    user_id = attr["Value"]
+                elif attr["Name"] == "email":
+                    email = attr["Value"]
+                elif attr["Name"] == "email_verified":
+                    email_verified = attr["Value"].lower() == "true"
+            
+            return User(
+                user_id=user_id or response["Username"],
+                email=email or response["Username"],
+                username=username or email or response["Username"],
+                email_verified=email_verified,
+                created_at=datetime.now()
+            )
+        except ClientError as e:
+            print(f"Token validation error: {e}")
+            return None
+
+    async def get_user_by_id(self, user_id: str) -> Optional[User]:
+        try:
+            response = await self.cognito.list_users(
+                UserPoolId=self.user_pool_id,
+                Filter=f'sub = "{user_id}"'
+            )
+            
+            users = response.get("Users", [])
+            if not users:
+                return None
+            
+            user_data = users[0]
+            username = user_id
+            email = user_data.get("Username", "")
+            created_at = user_data.get("UserCreateDate", datetime.now())
+            
+            for attr in user_data.get("Attributes", []):
+                if attr["Name"] == "preferred_username":
+                    username = attr["Value"]
+                elif attr["Name"] == "email":
+                    email = attr["Value"]
+            
+            return User(
+                user_id=user_id,
+                email=email,
+                username=username,
+                email_verified=True,
+                created_at=created_at
+            )
+        except ClientError as e:
+            print(f"Error getting user by id: {e}")
+            return None
+
+    async def get_users_by_ids(self, user_ids: List[str]) -> Dict[str, User]:
+        # ListUsers filters match a single value, so fan out with a bounded concurrency
+        sem = asyncio.Semaphore(config.cognito_lookup_concurrency)
+
+        async def _get(user_id: str) -> Optional[User]:
+            async with sem:
+                return await self.get_user_by_id(user_id)
+
+        users = await asyncio.gather(*[_get(user_id) for user_id in user_ids])
+        return {user.user_id: user for user in users if user}
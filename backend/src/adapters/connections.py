@@ -0,0 +1,216 @@
+from contextlib import AsyncExitStack
+import time
+from typing import Any, Dict, List, Optional
+
+from config import config
+from utils.metrics import Counter, Gauge, Histogram, registry
+
+pool_size = registry.register(Gauge(
+    "connection_pool_max", "Configured size of each shared connection pool", ("pool",),
+))
+pool_open = registry.register(Gauge(
+    "connection_pool_open", "Connections currently open in each pool", ("pool",),
+))
+pool_in_use = registry.register(Gauge(
+    "connection_pool_in_use", "Connections currently checked out of each pool", ("pool",),
+))
+pool_waiting = registry.register(Gauge(
+    "connection_pool_waiting", "Callers waiting for a free connection", ("pool",),
+))
+pool_wait = registry.register(Histogram(
+    "connection_pool_wait_seconds", "Time spent waiting to check out a connection", ("pool",),
+))
+pool_timeouts = registry.register(Counter(
+    "connection_pool_timeouts_total", "Checkouts that gave up waiting for a free connection", ("pool",),
+))
+
+# Seconds between saturation warnings for the same pool
+SATURATION_LOG_INTERVAL = 60
+
+class PoolStats:
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.peak_in_use = 0
+        self.timeouts = 0
+        self.saturated_at: Optional[float] = None
+        self._last_warning = 0.0
+        pool_size.set(size, pool=name)
+
+    def opened(self):
+        self.open += 1
+        pool_open.set(self.open, pool=self.name)
+
+    def closed(self):
+        self.open = max(0, self.open - 1)
+        pool_open.set(self.open, pool=self.name)
+
+    def checkout_started(self):
+        self.waiting += 1
+        pool_waiting.set(self.waiting, pool=self.name)
+
+    def checked_out(self, waited: Optional[float] = None):
+        if waited is not None:
+            self.waiting = max(0, self.waiting - 1)
+            pool_waiting.set(self.waiting, pool=self.name)
+            pool_wait.observe(waited, pool=self.name)
+
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        pool_in_use.set(self.in_use, pool=self.name)
+        if self.in_use >= self.size:
+            self._saturated()
+
+    def checkout_failed(self, timed_out: bool):
+        self.waiting = max(0, self.waiting - 1)
+        pool_waiting.set(self.waiting, pool=self.name)
+        if timed_out:
+            self.timeouts += 1
+            pool_timeouts.inc(pool=self.name)
+            self._saturated()
+
+    def checked_in(self):
+        self.in_use = max(0, self.in_use - 1)
+        pool_in_use.set(self.in_use, pool=self.name)
+
+    def _saturated(self):
+        now = time.time()
+        self.saturated_at = now
+        if now - self._last_warning >= SATURATION_LOG_INTERVAL:
+            self._last_warning = now
+            print(f"Connection pool {self.name} is saturated: {self.in_use}/{self.size} in use, {self.waiting} waiting")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "pool": self.name,
+            "size": self.size,
+            "open": self.open,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "peak_in_use": self.peak_in_use,
+            "timeouts": self.timeouts,
+            "last_saturated_at": self.saturated_at,
+        }
+
+class Connections:
+    # Owns every network client for the lifetime of the app, so adapters that talk to the
+    # same service share one pool. Backend libraries are imported on first use.
+    def __init__(self):
+        self.pools: Dict[str, PoolStats] = {}
+        self._reset()
+
+    def _reset(self):
+        self._stack = AsyncExitStack()
+        self._mongo = None
+        self._aws_session = None
+        self._valkey: Dict[str, Any] = {}
+
+    async def __aenter__(self) -> "Connections":
+        await self._stack.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self._stack.__aexit__(*exc_info)
+        finally:
+            self._reset()
+
+    def _pool(self, name: str, size: int) -> PoolStats:
+        if name not in self.pools:
+            self.pools[name] = PoolStats(name, size)
+        return self.pools[name]
+
+    def pool_stats(self) -> List[Dict[str, Any]]:
+        return [stats.snapshot() for stats in self.pools.values()]
+
+    def mongo(self):
+        if self._mongo is None:
+            from pymongo import AsyncMongoClient
+            from utils.mongo import PoolListener
+
+            self._mongo = AsyncMongoClient(
+                config.mongo_uri,
+                maxPoolSize=config.mongo_max_pool_size,
+                minPoolSize=config.mongo_min_pool_size,
+                maxIdleTimeMS=int(config.mongo_max_idle_time * 1000),
+                connectTimeoutMS=int(config.mongo_connect_timeout * 1000),
+                waitQueueTimeoutMS=int(config.mongo_wait_queue_timeout * 1000),
+                event_listeners=[PoolListener(self._pool("mongo", config.mongo_max_pool_size))],
+            )
+            self._stack.push_async_callback(self._mongo.close)
+        return self._mongo
+
+    def _aws_config(self):
+        from aiobotocore.config import AioConfig
+
+        return AioConfig(
+            max_pool_connections=config.aws_max_pool_connections,
+            connect_timeout=config.aws_connect_timeout,
+            read_timeout=config.aws_read_timeout,
+            tcp_keepalive=True,
+            retries={"max_attempts": config.aws_max_attempts, "mode": "standard"},
+            connector_args={"keepalive_timeout": config.aws_keepalive_timeout},
+        )
+
+    def _session(self):
+        if self._aws_session is None:
+            import aioboto3
+
+            self._aws_session = aioboto3.Session()
+        return self._aws_session
+
+    def _meter_aws(self, service: str, client):
+        # aiohttp doesn't expose its connector queue; calls in flight against the pool size is the signal
+        stats = self._pool(service, config.aws_max_pool_connections)
+
+        def _started(context, **kwargs):
+            context["pool_checked_out"] = True
+            stats.checked_out()
+
+        def _finished(context, **kwargs):
+            if context.pop("pool_checked_out", False):
+                stats.checked_in()
+
+        client.meta.events.register("before-call", _started)
+        client.meta.events.register("after-call", _finished)
+        client.meta.events.register("after-call-error", _finished)
+
+    async def aws_resource(self, service: str):
+        resource = await self._stack.enter_async_context(
+            self._session().resource(service, region_name=config.aws_region, config=self._aws_config())
+        )
+        self._meter_aws(service, resource.meta.client)
+        return resource
+
+    async def aws_client(self, service: str):
+        client = await self._stack.enter_async_context(
+            self._session().client(service, region_name=config.aws_region, config=self._aws_config())
+        )
+        self._meter_aws(service, client)
+        return client
+
+    def valkey_publisher(self):
+        if "publisher" not in self._valkey:
+            from adapters.valkey import create_publisher
+
+            client = create_publisher(self._pool("valkey", config.valkey_max_connections))
+            # A client never closes a pool it was handed
+            self._stack.push_async_callback(client.connection_pool.aclose)
+            self._stack.push_async_callback(client.aclose)
+            self._valkey["publisher"] = client
+        return self._valkey["publisher"]
+
+    def valkey_subscriber(self):
+        # Subscriptions hold their connection for good, so they never come out of the shared pool
+        if "subscriber" not in self._valkey:
+            from adapters.valkey import create_subscriber
+
+            client = create_subscriber()
+            self._stack.push_async_callback(client.aclose)
+            self._valkey["subscriber"] = client
+        return self._valkey["subscriber"]
+
+connections = Connections()
@@ -1,36 +1,87 @@
 from abc import ABC, abstractmethod
-import asyncio
+from array import array
+import bisect
 from collections import defaultdict
 from datetime import datetime
-from decimal import Decimal
-from typing import Any, Dict, List, Optional, Tuple
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from boto3.dynamodb.conditions import Attr, Key
-from botocore.exceptions import ClientError
-from pymongo import AsyncMongoClient
-
-from models import PixelData
+from models import HistoryEntry, PixelData
 from config import config
 
+# Canvas ids end up in tile keys ("{canvas_id}#{tile_id}"), URLs and storage paths
+CANVAS_ID_PATTERN = re.compile(r"[a-z0-9][a-z0-9-]{0,62}")
+
+def is_known_canvas(canvas_id: str) -> bool:
+    # Only configured canvases exist; any other id would otherwise create a canvas on its first write
+    return canvas_id in config.canvas_ids and CANVAS_ID_PATTERN.fullmatch(canvas_id) is not None
+
+Region = Tuple[int, int, int, int]
+
+def canvas_tile_ids(region: Optional[Region] = None) -> List[str]:
+    x, y, w, h = region or (0, 0, config.canvas_width, config.canvas_height)
+    tx0, ty0 = x // config.tile_size, y // config.tile_size
+    tx1 = math.ceil((x + w) / config.tile_size)
+    ty1 = math.ceil((y + h) / config.tile_size)
+    return [f"{tx}_{ty}" for ty in range(ty0, ty1) for tx in range(tx0, tx1)]
+
+def tile_key(canvas_id: str, tile_id: str) -> str:
+    return f"{canvas_id}#{tile_id}"
+
+def empty_canvas_version() -> Dict[str, int]:
+    # A canvas nothing was ever written to. 'version' grows by the number of pixels in every
+    # write (at least 1), so it changes even when two writes land within the same second
+    return {"version": 0, "last_modified": 0}
+
+def snapshot_canvas(snapshot: Dict) -> str:
+    # Snapshots taken before canvases had ids belong to the default one
+    return snapshot.get("canvas_id") or config.default_canvas_id
+
+def history_partition(tile_id: str, timestamp: int) -> str:
+    return f"{tile_id}#{timestamp // config.history_bucket_seconds}"
+
+def history_partitions(since: int, until: int, tile_ids: List[str]) -> List[str]:
+    first = since // config.history_bucket_seconds
+    last = until // config.history_bucket_seconds
+    return [f"{tid}#{bucket}" for tid in tile_ids for bucket in range(first, last + 1)]
+
 class DBAdapter(ABC):
     @abstractmethod
-    async def get_canvas_state(self) -> Dict:
+    async def get_canvas_state(self, canvas_id: str) -> Dict[str, PixelData]:
         pass
 
     @abstractmethod
-    async def update_pixel(self, pixel: PixelData) -> PixelData:
+    async def get_canvas_colors(self, canvas_id: str) -> Dict[str, str]:
         pass
 
     @abstractmethod
-    async def bulk_update_canvas(self, pixels: List[PixelData]) -> int:
+    async def get_canvas_tiles(self, canvas_id: str, tile_ids: List[str]) -> Dict[str, str]:
         pass
 
     @abstractmethod
-    async def bulk_overwrite_canvas(self, pixels: List[PixelData]) -> None:
+    async def get_pixel_details(self, canvas_id: str, pixel_keys: List[str]) -> Dict[str, PixelData]:
         pass
 
+    # Writes return the canvas version they produced
     @abstractmethod
-    async def create_snapshot_metadata(self, snapshot_id: str, image_key: str, thumbnail_key: str) -> Dict:
+    async def update_pixel(self, canvas_id: str, pixel: PixelData) -> int:
+        pass
+
+    @abstractmethod
+    async def bulk_update_canvas(self, canvas_id: str, pixels: List[PixelData]) -> int:
+        pass
+
+    @abstractmethod
+    async def bulk_overwrite_canvas(self, canvas_id: str, pixels: List[PixelData]) -> int:
+        pass
+
+    @abstractmethod
+    async def get_canvas_version(self, canvas_id: str) -> Dict[str, int]:
+        pass
+
+    @abstractmethod
+    async def create_snapshot_metadata(self, canvas_id: str, snapshot_id: str, image_key: str, thumbnail_key: str, canvas_last_modified: Optional[int] = None, canvas_version: Optional[int] = None) -> Dict:
         pass
 
     @abstractmethod
@@ -38,7 +89,7 @@ class DBAdapter(ABC):
         pass
 
     @abstractmethod
-    async def get_snapshots(self, limit: int = 50, offset: int = 0) -> List[Dict]:
+    async def get_snapshots(self, canvas_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
         pass
 
     @abstractmethod
@@ -50,343 +101,202 @@ class DBAdapter(ABC):
         pass
 
     @abstractmethod
-    async def get_snapshot_count(self) -> int:
+    async def get_snapshot_count(self, canvas_id: str) -> int:
         pass
 
-class DynamoDBAdapter(DBAdapter):
-    def __init__(self, dynamo_resource):
-        self.dynamodb = dynamo_resource
-        
-        self.canvas_table_name = config.dynamodb_canvas_table
-        self.snapshots_table_name = config.dynamodb_snapshots_table
-        self.snapshot_tiles_table_name = config.dynamodb_snapshot_tiles_table
+    @abstractmethod
+    async def append_history(self, entries: List[HistoryEntry]) -> None:
+        pass
 
-        self.tile_size = config.tile_size
-        self.chunk_size = config.chunk_size
-        self.chunk_write_concurrency = config.chunk_write_concurrency
-
-    async def _execute_atomic_update(self, key: Dict, update_expr: str, attr_names: Dict, attr_values: Dict):
-        table = await self.dynamodb.Table(self.canvas_table_name)
-        
-        try:
-            await table.update_item(
-                Key=key,
-                UpdateExpression=update_expr,
-                ExpressionAttributeNames=attr_names,
-                ExpressionAttributeValues=attr_values,
-            )
-        except ClientError as e:
-            if e.response.get("Error", {}).get("Code") == "ValidationException":
-                # Atomic initialization of the parent map 'pixels'
-                try:
-                    await table.update_item(
-                        Key=key,
-                        UpdateExpression="SET #pixels = :empty_map",
-                        ConditionExpression="attribute_not_exists(#pixels)",
-                        ExpressionAttributeNames={"#pixels": "pixels"},
-                        ExpressionAttributeValues={":empty_map": {}},
-                    )
-                except ClientError as init_error:
-                    if init_error.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
-                        raise init_error
-
-                # Retry the original operation
-                await table.update_item(
-                    Key=key,
-                    UpdateExpression=update_expr,
-                    ExpressionAttributeNames=attr_names,
-                    ExpressionAttributeValues=attr_values,
-                )
-            else:
-                raise e
-
-    async def get_canvas_state(self) -> Dict[str, PixelData]:
-        pixels_map: Dict[str, PixelData] = {}
-        try:
-            table = await self.dynamodb.Table(self.canvas_table_name)
-            response = await table.scan(
-                FilterExpression=Attr("canvas_id").begins_with("main")
-            )
-            for item in response.get("Items", []):
-                raw_pixels = item.get("pixels", {}) or {}
-                for key, val in raw_pixels.items():
-                    val_fixed = {
-                        k: int(v) if isinstance(v, Decimal) else v 
-                        for k, v in val.items()
-                    }
-                    pixels_map[key] = PixelData(**val_fixed) # type: ignore
-            return pixels_map
-        except ClientError as e:
-            print(f"Error getting canvas state: {e}")
-            return {}
-    
-    async def update_pixel(self, pixel: PixelData) -> PixelData:
-        pixel_key = f"{pixel.x}_{pixel.y}"
-        tx = pixel.x // self.tile_size
-        ty = pixel.y // self.tile_size
-        tile_canvas_id = f"main#{tx}_{ty}"
-
-        await self._execute_atomic_update(
-            key={"canvas_id": tile_canvas_id},
-            update_expr="SET #pixels.#pk = :pixel, #lm = :ts",
-            attr_names={
-                "#pixels": "pixels",
-                "#pk": pixel_key,
-                "#lm": "lastModified",
-            },
-            attr_values={
-                ":pixel": pixel.model_dump(),
-                ":ts": pixel.timestamp,
-            }
-        )
-        return pixel
+    @abstractmethod
+    async def get_history(self, since: int, until: int, tile_ids: List[str]) -> List[HistoryEntry]:
+        pass
 
-    async def bulk_update_canvas(self, pixels: List[PixelData]) -> int:
-        timestamp = int(datetime.now().timestamp())
-        tiles = defaultdict(list)
-        for p in pixels:
-            tx = p.x // self.tile_size
-            ty = p.y // self.tile_size
-            tiles[f"{tx}_{ty}"].append(p)
-
-        sem = asyncio.Semaphore(self.chunk_write_concurrency)
-
-        async def _process_tile_chunk(tile_id: str, chunk: List[PixelData]):
-            async with sem:
-                key = {"canvas_id": f"main#{tile_id}"}
-                update_parts = []
-                attr_names = {"#pixels": "pixels", "#lm": "lastModified"}
-                attr_values: Dict[str, Any] = {":ts": timestamp}
-
-                for idx, p in enumerate(chunk):
-                    p_key = f"{p.x}_{p.y}"
-                    name_ph = f"#pk{idx}"
-                    val_ph = f":pv{idx}"
-                    update_parts.append(f"#pixels.{name_ph} = {val_ph}")
-                    attr_names[name_ph] = p_key
-                    attr_values[val_ph] = p.model_dump()
-
-                update_expr = f"SET {', '.join(update_parts)}, #lm = :ts"
-
-                await self._execute_atomic_update(
-                    key=key,
-                    update_expr=update_expr,
-                    attr_names=attr_names,
-                    attr_values=attr_values
-                )
-
-        tasks = []
-        for tile_id, tile_pixels in tiles.items():
-            for i in range(0, len(tile_pixels), self.chunk_size):
-                chunk = tile_pixels[i : i + self.chunk_size]
-                tasks.append(_process_tile_chunk(tile_id, chunk))
-
-        if tasks:
-            await asyncio.gather(*tasks)
-        return len(pixels)
-
-    async def bulk_overwrite_canvas(self, pixels: List[PixelData]) -> None:
-        table = await self.dynamodb.Table(self.canvas_table_name)
-        
-        tiles = defaultdict(dict)
-        for p in pixels:
-            tx = p.x // self.tile_size
-            ty = p.y // self.tile_size
-            tiles[f"{tx}_{ty}"][f"{p.x}_{p.y}"] = p.model_dump()
-
-        for tile_id, tile_data in tiles.items():
-            await table.put_item(
-                Item={
-                    "canvas_id": f"main#{tile_id}",
-                    "pixels": tile_data,
-                    "lastModified": int(datetime.now().timestamp())
-                }
-            )
+    @abstractmethod
+    async def delete_history(self, before: int) -> int:
+        pass
 
-        try:
-            resp = await table.scan(
-                FilterExpression=Attr("canvas_id").begins_with("main#"),
-                ProjectionExpression="canvas_id"
-            )
-            active_keys = {f"main#{tid}" for tid in tiles.keys()}
-            delete_futures = []
-            for item in resp.get("Items", []):
-                cid = item.get("canvas_id")
-                if cid and cid not in active_keys:
-                    delete_futures.append(table.delete_item(Key={"canvas_id": cid}))
-            if delete_futures:
-                await asyncio.gather(*delete_futures)
-        except Exception as e:
-            print(f"Error cleaning up old tiles: {e}")
-
-    async def create_snapshot_metadata(self, snapshot_id: str, image_key: str, thumbnail_key: str) -> Dict:
-        table = await self.dynamodb.Table(self.snapshots_table_name)
-        meta = {
-            "snapshot_id": snapshot_id,
-            "image_key": image_key,
-            "thumbnail_key": thumbnail_key,
-            "canvas_width": config.canvas_width,
-            "canvas_height": config.canvas_height,
-            "created_at": datetime.now().isoformat(),
-        }
-        await table.put_item(Item=meta)
-        return meta
+    @abstractmethod
+    async def save_history_checkpoint(self, timestamp: int, tiles: Dict[str, Dict[str, Dict]]) -> None:
+        pass
 
-    async def create_snapshot_tiles(self, snapshot_id: str, tiles_data: List[Dict]) -> None:
-        table = await self.dynamodb.Table(self.snapshot_tiles_table_name)
-        sem = asyncio.Semaphore(10)
-        
-        async def _write(tile):
-            async with sem:
-                cid = tile.get("canvas_id", "")
-                tile_id = cid.split("#", 1)[1] if "#" in cid else "0_0"
-                await table.put_item(Item={
-                    "snapshot_id": snapshot_id,
-                    "tile_id": tile_id,
-                    "pixels": tile.get("pixels", {})
-                })
-
-        await asyncio.gather(*[_write(t) for t in tiles_data])
-
-    async def get_snapshots(self, limit: int = 50, offset: int = 0) -> List[Dict]:
-        try:
-            table = await self.dynamodb.Table(self.snapshots_table_name)
-            resp = await table.scan()
-            items = resp.get("Items", [])
-            items.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-            return items[offset : offset + limit]
-        except ClientError:
-            return []
+    @abstractmethod
+    async def get_history_checkpoint(self, at: int, tile_ids: List[str]) -> Optional[Dict]:
+        pass
 
-    async def get_snapshot_by_id(self, snapshot_id: str) -> Optional[Dict]:
-        try:
-            snapshots_table = await self.dynamodb.Table(self.snapshots_table_name)
-            resp = await snapshots_table.get_item(Key={"snapshot_id": snapshot_id})
-            if "Item" not in resp:
-                return None
-            
-            meta = resp["Item"]
-            
-            tiles_table = await self.dynamodb.Table(self.snapshot_tiles_table_name)
-            tiles_resp = await tiles_table.query(
-                KeyConditionExpression=Key("snapshot_id").eq(snapshot_id)
-            )
-            
-            pixels = {}
-            for t in tiles_resp.get("Items", []):
-                for p_key, p_val in t.get("pixels", {}).items():
-                    val_fixed = {
-                        k: int(v) if isinstance(v, Decimal) else v 
-                        for k, v in p_val.items()
-                    }
-                    pixels[p_key] = val_fixed
-            
-            meta["pixels"] = pixels
-            return meta
-        except ClientError:
-            return None
+def tile_colors(doc: Dict) -> Dict[str, str]:
+    # Tiles written before the colour/metadata split keep full pixel records under 'pixels'
+    colors = {k: v["color"] for k, v in (doc.get("pixels") or {}).items()}
+    colors.update(doc.get("colors") or {})
+    return colors
+
+def tile_meta(doc: Dict, meta_doc: Optional[Dict]) -> Dict[str, Dict]:
+    meta = {
+        k: {"userId": v.get("userId"), "timestamp": v.get("timestamp")}
+        for k, v in (doc.get("pixels") or {}).items()
+    }
+    if meta_doc:
+        meta.update(meta_doc.get("meta") or {})
+    return meta
+
+def join_pixels(colors: Dict[str, str], meta: Dict[str, Dict], keys: Optional[List[str]] = None) -> Dict[str, PixelData]:
+    pixels = {}
+    for key in (keys if keys is not None else colors.keys()):
+        if key not in colors:
+            continue
+        x, y = key.split("_")
+        pixel_meta = meta.get(key) or {}
+        pixels[key] = PixelData(
+            x=int(x),
+            y=int(y),
+            color=colors[key],
+            userId=pixel_meta.get("userId") or "",
+            timestamp=int(pixel_meta.get("timestamp") or 0),
+        )
+    return pixels
 
-    async def delete_snapshot(self, snapshot_id: str) -> bool:
-        try:
-            snapshots_table = await self.dynamodb.Table(self.snapshots_table_name)
-            await snapshots_table.delete_item(Key={"snapshot_id": snapshot_id})
-            
-            tiles_table = await self.dynamodb.Table(self.snapshot_tiles_table_name)
-            tiles = await tiles_table.query(
-                KeyConditionExpression=Key("snapshot_id").eq(snapshot_id),
-                ProjectionExpression="tile_id"
-            )
-            
-            fs = []
-            for t in tiles.get("Items", []):
-                fs.append(tiles_table.delete_item(
-                    Key={"snapshot_id": snapshot_id, "tile_id": t["tile_id"]}
-                ))
-            if fs:
-                await asyncio.gather(*fs)
-            return True
-        except ClientError:
-            return False
-
-    async def get_snapshot_count(self) -> int:
-        try:
-            table = await self.dynamodb.Table(self.snapshots_table_name)
-            resp = await table.scan(Select="COUNT")
-            return resp.get("Count", 0)
-        except ClientError:
-            return 0
-
-class MongoDBAdapter(DBAdapter):
+class _MemoryTile:
+    # Flat arrays indexed by the pixel's offset in the tile rather than a dict per pixel;
+    # a full 32x32 tile takes 12KB. Colours are packed RGB, -1 where nothing was placed.
+    __slots__ = ("origin", "colors", "authors", "timestamps", "rendered")
+
+    def __init__(self, origin: Tuple[int, int], size: int):
+        cells = size * size
+        self.origin = origin
+        self.colors = array("i", [-1]) * cells
+        self.authors = array("I", [0]) * cells
+        self.timestamps = array("I", [0]) * cells
+        # The tile's colours as the API returns them, rebuilt on the first read after a write
+        self.rendered: Optional[Dict[str, str]] = None
+
+HISTORY_FIELDS = ("tile_id", "timestamp", "seq", "x", "y", "color", "userId")
+
+class MemoryDBAdapter(DBAdapter):
     def __init__(self):
-        self.client = AsyncMongoClient(config.mongo_uri)
-        self.db = self.client[config.mongo_db]
-        self.canvas_collection = self.db.canvas_state
-        self.snapshots_collection = self.db.snapshots
-        self.snapshot_tiles_collection = self.db.snapshot_tiles
         self.tile_size = config.tile_size
+        self.canvases: Dict[str, Dict[str, _MemoryTile]] = {}
+        self.versions: Dict[str, Dict[str, int]] = {}
+        # Tiles store an index into this list instead of repeating the author's id per pixel
+        self.user_ids: List[str] = [""]
+        self._user_index: Dict[str, int] = {"": 0}
+
+        self.snapshots: Dict[str, Dict] = {}
+        self.snapshot_tiles: Dict[str, Dict[str, Dict]] = {}
+        self.history: Dict[str, List[Tuple]] = defaultdict(list)
+        self.checkpoints: Dict[int, Dict[str, Dict]] = {}
+        self._checkpoint_times: List[int] = []
+
+    def _intern(self, user_id: str) -> int:
+        index = self._user_index.get(user_id)
+        if index is None:
+            index = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self._user_index[user_id] = index
+        return index
+
+    def _locate(self, x: int, y: int) -> Tuple[str, int]:
+        return f"{x // self.tile_size}_{y // self.tile_size}", (y % self.tile_size) * self.tile_size + x % self.tile_size
+
+    def _tiles(self, canvas_id: str) -> Dict[str, _MemoryTile]:
+        return self.canvases.get(canvas_id) or {}
+
+    def _write(self, canvas_id: str, pixel: PixelData) -> None:
+        tiles = self.canvases.setdefault(canvas_id, {})
+        tile_id, offset = self._locate(pixel.x, pixel.y)
+        tile = tiles.get(tile_id)
+        if tile is None:
+            ts = self.tile_size
+            tile = tiles[tile_id] = _MemoryTile((pixel.x // ts * ts, pixel.y // ts * ts), ts)
+        tile.colors[offset] = int(pixel.color[1:], 16)
+        tile.authors[offset] = self._intern(pixel.userId)
+        tile.timestamps[offset] = pixel.timestamp
+        tile.rendered = None
+
+    def _bump_version(self, canvas_id: str, count: int, timestamp: int) -> int:
+        version = self.versions.setdefault(canvas_id, empty_canvas_version())
+        version["version"] += max(1, count)
+        version["last_modified"] = max(version["last_modified"], timestamp)
+        return version["version"]
+
+    def _read(self, tile: _MemoryTile, offset: int) -> PixelData:
+        dy, dx = divmod(offset, self.tile_size)
+        return PixelData(
+            x=tile.origin[0] + dx,
+            y=tile.origin[1] + dy,
+            color=f"#{tile.colors[offset]:06x}",
+            userId=self.user_ids[tile.authors[offset]],
+            timestamp=tile.timestamps[offset],
+        )
 
-    async def get_canvas_state(self) -> Dict[str, PixelData]:
+    def _render(self, tile: _MemoryTile) -> Dict[str, str]:
+        if tile.rendered is None:
+            ox, oy = tile.origin
+            rendered = {}
+            for offset, value in enumerate(tile.colors):
+                if value >= 0:
+                    dy, dx = divmod(offset, self.tile_size)
+                    rendered[f"{ox + dx}_{oy + dy}"] = f"#{value:06x}"
+            tile.rendered = rendered
+        return tile.rendered
+
+    def _collect_colors(self, tiles: Iterable[_MemoryTile]) -> Dict[str, str]:
+        colors: Dict[str, str] = {}
+        for tile in tiles:
+            colors.update(self._render(tile))
+        return colors
+
+    async def get_canvas_state(self, canvas_id: str) -> Dict[str, PixelData]:
         pixels = {}
-        async for doc in self.canvas_collection.find({"canvas_id": {"$regex": r"^main"}}):
-            raw_pixels = doc.get("pixels", {})
-            for k, v in raw_pixels.items():
-                pixels[k] = PixelData(**v)
+        for tile in self._tiles(canvas_id).values():
+            for offset, value in enumerate(tile.colors):
+                if value >= 0:
+                    pixel = self._read(tile, offset)
+                    pixels[f"{pixel.x}_{pixel.y}"] = pixel
         return pixels
 
-    async def update_pixel(self, pixel: PixelData) -> PixelData:
-        pixel_key = f"{pixel.x}_{pixel.y}"
-        tx = pixel.x // self.tile_size
-        ty = pixel.y // self.tile_size
-        
-        await self.canvas_collection.update_one(
-            {"canvas_id": f"main#{tx}_{ty}"},
-            {
-                "$set": {
-                    f"pixels.{pixel_key}": pixel.model_dump(),
-                    "lastModified": pixel.timestamp
-                }
-            },
-            upsert=True
-        )
-        return pixel
+    async def get_canvas_colors(self, canvas_id: str) -> Dict[str, str]:
+        return self._collect_colors(self._tiles(canvas_id).values())
+
+    async def get_canvas_tiles(self, canvas_id: str, tile_ids: List[str]) -> Dict[str, str]:
+        tiles = self._tiles(canvas_id)
+        return self._collect_colors(tiles[tid] for tid in dict.fromkeys(tile_ids) if tid in tiles)
 
-    async def bulk_update_canvas(self, pixels: List[PixelData]) -> int:
-        tiles = defaultdict(dict)
+    async def get_pixel_details(self, canvas_id: str, pixel_keys: List[str]) -> Dict[str, PixelData]:
+        tiles = self._tiles(canvas_id)
+        pixels = {}
+        for key in pixel_keys:
+            x, y = (int(v) for v in key.split("_"))
+            tile_id, offset = self._locate(x, y)
+            tile = tiles.get(tile_id)
+            if tile and tile.colors[offset] >= 0:
+                pixels[key] = self._read(tile, offset)
+        return pixels
+
+    async def update_pixel(self, canvas_id: str, pixel: PixelData) -> int:
+        self._write(canvas_id, pixel)
+        return self._bump_version(canvas_id, 1, pixel.timestamp)
+
+    async def bulk_update_canvas(self, canvas_id: str, pixels: List[PixelData]) -> int:
+        if not pixels:
+            return (await self.get_canvas_version(canvas_id))["version"]
+        timestamp = int(datetime.now().timestamp())
         for p in pixels:
-            tx = p.x // self.tile_size
-            ty = p.y // self.tile_size
-            tiles[f"{tx}_{ty}"][f"{p.x}_{p.y}"] = p.model_dump()
-
-        for tile_id, tile_pixels in tiles.items():
-            await self.canvas_collection.update_one(
-                {"canvas_id": f"main#{tile_id}"},
-                {"$set": {f"pixels.{k}": v for k, v in tile_pixels.items()}},
-                upsert=True
-            )
-        return len(pixels)
+            self._write(canvas_id, p)
+        return self._bump_version(canvas_id, len(pixels), timestamp)
 
-    async def bulk_overwrite_canvas(self, pixels: List[PixelData]) -> None:
-        tiles = defaultdict(dict)
-        ts = int(datetime.now().timestamp())
+    async def bulk_overwrite_canvas(self, canvas_id: str, pixels: List[PixelData]) -> int:
+        self.canvases[canvas_id] = {}
+        timestamp = int(datetime.now().timestamp())
         for p in pixels:
-            tx = p.x // self.tile_size
-            ty = p.y // self.tile_size
-            tiles[f"{tx}_{ty}"][f"{p.x}_{p.y}"] = p.model_dump()
-
-        await self.canvas_collection.delete_many({"canvas_id": {"$regex": r"^main"}})
-        
-        docs = []
-        for tile_id, tile_pixels in tiles.items():
-            docs.append({
-                "canvas_id": f"main#{tile_id}",
-                "pixels": tile_pixels,
-                "lastModified": ts
-            })
-        if docs:
-            await self.canvas_collection.insert_many(docs)
-
-    async def create_snapshot_metadata(self, snapshot_id: str, image_key: str, thumbnail_key: str) -> Dict:
+            self._write(canvas_id, p)
+        return self._bump_version(canvas_id, len(pixels), timestamp)
+
+    async def get_canvas_version(self, canvas_id: str) -> Dict[str, int]:
+        return dict(self.versions.get(canvas_id) or empty_canvas_version())
+
+    async def create_snapshot_metadata(self, canvas_id: str, snapshot_id: str, image_key: str, thumbnail_key: str, canvas_last_modified: Optional[int] = None, canvas_version: Optional[int] = None) -> Dict:
         meta = {
+            "canvas_id": canvas_id,
             "snapshot_id": snapshot_id,
             "image_key": image_key,
             "thumbnail_key": thumbnail_key,
@@ -394,46 +304,98 @@ class MongoDBAdapter(DBAdapter):
             "canvas_height": config.canvas_height,
             "created_at": datetime.now(),
         }
-        await self.snapshots_collection.insert_one(meta)
-        return meta
+        if canvas_last_modified is not None:
+            meta["canvas_last_modified"] = canvas_last_modified
+        if canvas_version is not None:
+            meta["canvas_version"] = canvas_version
+        self.snapshots[snapshot_id] = meta
+        return dict(meta)
 
     async def create_snapshot_tiles(self, snapshot_id: str, tiles_data: List[Dict]) -> None:
-        docs = []
+        tiles = self.snapshot_tiles.setdefault(snapshot_id, {})
         for tile in tiles_data:
             cid = tile.get("canvas_id", "")
             tile_id = cid.split("#", 1)[1] if "#" in cid else "0_0"
-            docs.append({
-                "snapshot_id": snapshot_id,
-                "tile_id": tile_id,
-                "pixels": tile.get("pixels", {})
-            })
-        if docs:
-            await self.snapshot_tiles_collection.insert_many(docs)
-
-    async def get_snapshots(self, limit: int = 50, offset: int = 0) -> List[Dict]:
-        cursor = self.snapshots_collection.find({}, {"pixels": 0}).sort("created_at", -1).skip(offset).limit(limit)
-        return [doc async for doc in cursor]
+            tiles[tile_id] = tile.get("pixels", {})
+
+    async def get_snapshots(self, canvas_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        snapshots = sorted(
+            (s for s in self.snapshots.values() if s["canvas_id"] == canvas_id),
+            key=lambda s: s["created_at"],
+            reverse=True,
+        )
+        return [dict(s) for s in snapshots[offset : offset + limit]]
 
     async def get_snapshot_by_id(self, snapshot_id: str) -> Optional[Dict]:
-        meta = await self.snapshots_collection.find_one({"snapshot_id": snapshot_id})
+        meta = self.snapshots.get(snapshot_id)
         if not meta:
             return None
-        
+
         pixels = {}
-        async for doc in self.snapshot_tiles_collection.find({"snapshot_id": snapshot_id}):
-            pixels.update(doc.get("pixels", {}))
-        
-        meta["pixels"] = pixels
-        return meta
+        for tile_pixels in self.snapshot_tiles.get(snapshot_id, {}).values():
+            pixels.update(tile_pixels)
+        return {**meta, "pixels": pixels}
 
     async def delete_snapshot(self, snapshot_id: str) -> bool:
-        res = await self.snapshots_collection.delete_one({"snapshot_id": snapshot_id})
-        await self.snapshot_tiles_collection.delete_many({"snapshot_id": snapshot_id})
-        return res.deleted_count > 0
+        self.snapshot_tiles.pop(snapshot_id, None)
+        return self.snapshots.pop(snapshot_id, None) is not None
+
+    async def get_snapshot_count(self, canvas_id: str) -> int:
+        return sum(1 for s in self.snapshots.values() if s["canvas_id"] == canvas_id)
+
+    async def append_history(self, entries: List[HistoryEntry]) -> None:
+        for e in entries:
+            self.history[history_partition(e.tile_id, e.timestamp)].append(
+                (e.tile_id, e.timestamp, e.seq, e.x, e.y, e.color, e.userId)
+            )
+
+    async def get_history(self, since: int, until: int, tile_ids: List[str]) -> List[HistoryEntry]:
+        rows = [
+            row
+            for partition in history_partitions(since, until, tile_ids)
+            for row in self.history.get(partition, ())
+            if since <= row[1] <= until
+        ]
+        rows.sort(key=lambda row: (row[1], row[2]))
+        return [HistoryEntry(**dict(zip(HISTORY_FIELDS, row))) for row in rows]
+
+    async def delete_history(self, before: int) -> int:
+        deleted = 0
+        for partition in list(self.history):
+            rows = self.history[partition]
+            kept = [row for row in rows if row[1] >= before]
+            deleted += len(rows) - len(kept)
+            if kept:
+                self.history[partition] = kept
+            else:
+                del self.history[partition]
+
+        cutoff = bisect.bisect_left(self._checkpoint_times, before)
+        for timestamp in self._checkpoint_times[:cutoff]:
+            del self.checkpoints[timestamp]
+        del self._checkpoint_times[:cutoff]
+        return deleted
+
+    async def save_history_checkpoint(self, timestamp: int, tiles: Dict[str, Dict[str, Dict]]) -> None:
+        if not tiles:
+            return
+        if timestamp not in self.checkpoints:
+            bisect.insort(self._checkpoint_times, timestamp)
+            self.checkpoints[timestamp] = {}
+        self.checkpoints[timestamp].update(tiles)
+
+    async def get_history_checkpoint(self, at: int, tile_ids: List[str]) -> Optional[Dict]:
+        index = bisect.bisect_right(self._checkpoint_times, at)
+        if index == 0:
+            return None
+
+        timestamp = self._checkpoint_times[index - 1]
+        tiles = self.checkpoints[timestamp]
+        pixels = {}
+        for tile_id in tile_ids:
+            pixels.update(tiles.get(tile_id, {}))
+        return {"timestamp": timestamp, "pixels": pixels}
 
-    async def get_snapshot_count(self) -> int:
-        return await self.snapshots_collection.count_documents({})
-    
 def get_db_adapter() -> DBAdapter:
     from deps import manager
 
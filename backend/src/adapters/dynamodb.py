@@ -0,0 +1,511 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+from adapters.db import DBAdapter, canvas_tile_ids, empty_canvas_version, history_partition, history_partitions, join_pixels, tile_colors, tile_key, tile_meta
+from models import HistoryEntry, PixelData
+from config import config
+
+class DynamoDBAdapter(DBAdapter):
+    def __init__(self, dynamo_resource):
+        self.dynamodb = dynamo_resource
+        
+        self.canvas_table_name = config.dynamodb_canvas_table
+        self.canvas_meta_table_name = config.dynamodb_canvas_meta_table
+        self.snapshots_table_name = config.dynamodb_snapshots_table
+        self.snapshot_tiles_table_name = config.dynamodb_snapshot_tiles_table
+        self.history_table_name = config.dynamodb_history_table
+
+        self.tile_size = config.tile_size
+        self.chunk_size = config.chunk_size
+        self.chunk_write_concurrency = config.chunk_write_concurrency
+
+    def _fix_decimals(self, item: Dict) -> Dict:
+        return {k: int(v) if isinstance(v, Decimal) else v for k, v in item.items()}
+
+    async def _execute_atomic_update(self, key: Dict, update_expr: str, attr_names: Dict, attr_values: Dict, table_name: Optional[str] = None, map_attr: str = "colors"):
+        table = await self.dynamodb.Table(table_name or self.canvas_table_name)
+        
+        try:
+            await table.update_item(
+                Key=key,
+                UpdateExpression=update_expr,
+                ExpressionAttributeNames=attr_names,
+                ExpressionAttributeValues=attr_values,
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ValidationException":
+                # Atomic initialization of the parent map
+                try:
+                    await table.update_item(
+                        Key=key,
+                        UpdateExpression="SET #map = :empty_map",
+                        ConditionExpression="attribute_not_exists(#map)",
+                        ExpressionAttributeNames={"#map": map_attr},
+                        ExpressionAttributeValues={":empty_map": {}},
+                    )
+                except ClientError as init_error:
+                    if init_error.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                        raise init_error
+
+                # Retry the original operation
+                await table.update_item(
+                    Key=key,
+                    UpdateExpression=update_expr,
+                    ExpressionAttributeNames=attr_names,
+                    ExpressionAttributeValues=attr_values,
+                )
+            else:
+                raise e
+
+    async def _batch_get_tiles(self, table_name: str, canvas_id: str, tile_ids: List[str], projection: Optional[str] = None) -> List[Dict]:
+        keys = [{"canvas_id": tile_key(canvas_id, tid)} for tid in dict.fromkeys(tile_ids)]
+        items = []
+        # BatchGetItem accepts at most 100 keys per call
+        for i in range(0, len(keys), 100):
+            table_request: Dict[str, Any] = {"Keys": keys[i : i + 100]}
+            if projection:
+                table_request["ProjectionExpression"] = projection
+            request = {table_name: table_request}
+            while request:
+                response = await self.dynamodb.batch_get_item(RequestItems=request)
+                items.extend(response.get("Responses", {}).get(table_name, []))
+                request = response.get("UnprocessedKeys") or None
+        return items
+
+    async def _canvas_tiles(self, table_name: str, canvas_id: str, projection: Optional[str] = None) -> List[Dict]:
+        # Tile keys follow from the canvas size, so reading one canvas costs the same no matter
+        # how many others share the table; a scan would read all of them
+        return await self._batch_get_tiles(table_name, canvas_id, canvas_tile_ids(), projection)
+
+    def _version_key(self, canvas_id: str) -> Dict:
+        # Lives beside the tiles, which are only ever read by their "{canvas_id}#{x}_{y}" keys
+        return {"canvas_id": tile_key(canvas_id, "version")}
+
+    async def _bump_version(self, canvas_id: str, count: int, timestamp: int) -> int:
+        table = await self.dynamodb.Table(self.canvas_table_name)
+        response = await table.update_item(
+            Key=self._version_key(canvas_id),
+            UpdateExpression="ADD #v :n SET #lm = :ts",
+            ExpressionAttributeNames={"#v": "version", "#lm": "lastModified"},
+            ExpressionAttributeValues={":n": max(1, count), ":ts": timestamp},
+            ReturnValues="UPDATED_NEW",
+        )
+        return int(response["Attributes"]["version"])
+
+    def _join_items(self, items: List[Dict], meta_items: List[Dict], keys: Optional[List[str]] = None) -> Dict[str, PixelData]:
+        meta_by_id = {item["canvas_id"]: item for item in meta_items}
+        colors: Dict[str, str] = {}
+        meta: Dict[str, Dict] = {}
+        for item in items:
+            colors.update(tile_colors(item))
+            for k, v in tile_meta(item, meta_by_id.get(item["canvas_id"])).items():
+                meta[k] = self._fix_decimals(v)
+        return join_pixels(colors, meta, keys)
+
+    async def get_canvas_state(self, canvas_id: str) -> Dict[str, PixelData]:
+        try:
+            items, meta_items = await asyncio.gather(
+                self._canvas_tiles(self.canvas_table_name, canvas_id),
+                self._canvas_tiles(self.canvas_meta_table_name, canvas_id),
+            )
+            return self._join_items(items, meta_items)
+        except ClientError as e:
+            print(f"Error getting canvas state: {e}")
+            return {}
+
+    async def get_canvas_colors(self, canvas_id: str) -> Dict[str, str]:
+        colors: Dict[str, str] = {}
+        try:
+            for item in await self._canvas_tiles(self.canvas_table_name, canvas_id, "canvas_id, colors, pixels"):
+                colors.update(tile_colors(item))
+            return colors
+        except ClientError as e:
+            print(f"Error getting canvas colors: {e}")
+            return {}
+
+    async def get_canvas_tiles(self, canvas_id: str, tile_ids: List[str]) -> Dict[str, str]:
+        colors: Dict[str, str] = {}
+        try:
+            for item in await self._batch_get_tiles(self.canvas_table_name, canvas_id, tile_ids):
+                colors.update(tile_colors(item))
+            return colors
+        except ClientError as e:
+            print(f"Error getting canvas tiles: {e}")
+            return {}
+
+    async def get_pixel_details(self, canvas_id: str, pixel_keys: List[str]) -> Dict[str, PixelData]:
+        tile_ids = []
+        for key in pixel_keys:
+            x, y = (int(v) for v in key.split("_"))
+            tile_ids.append(f"{x // self.tile_size}_{y // self.tile_size}")
+
+        try:
+            items, meta_items = await asyncio.gather(
+                self._batch_get_tiles(self.canvas_table_name, canvas_id, tile_ids),
+                self._batch_get_tiles(self.canvas_meta_table_name, canvas_id, tile_ids),
+            )
+            return self._join_items(items, meta_items, pixel_keys)
+        except ClientError as e:
+            print(f"Error getting pixel details: {e}")
+            return {}
+    
+    async def update_pixel(self, canvas_id: str, pixel: PixelData) -> int:
+        pixel_key = f"{pixel.x}_{pixel.y}"
+        tx = pixel.x // self.tile_size
+        ty = pixel.y // self.tile_size
+        tile_canvas_id = tile_key(canvas_id, f"{tx}_{ty}")
+
+        await asyncio.gather(
+            self._execute_atomic_update(
+                key={"canvas_id": tile_canvas_id},
+                update_expr="SET #colors.#pk = :color, #lm = :ts",
+                attr_names={
+                    "#colors": "colors",
+                    "#pk": pixel_key,
+                    "#lm": "lastModified",
+                },
+                attr_values={
+                    ":color": pixel.color,
+                    ":ts": pixel.timestamp,
+                }
+            ),
+            self._execute_atomic_update(
+                key={"canvas_id": tile_canvas_id},
+                update_expr="SET #meta.#pk = :meta",
+                attr_names={
+                    "#meta": "meta",
+                    "#pk": pixel_key,
+                },
+                attr_values={
+                    ":meta": {"userId": pixel.userId, "timestamp": pixel.timestamp},
+                },
+                table_name=self.canvas_meta_table_name,
+                map_attr="meta",
+            ),
+        )
+        return await self._bump_version(canvas_id, 1, pixel.timestamp)
+
+    async def bulk_update_canvas(self, canvas_id: str, pixels: List[PixelData]) -> int:
+        timestamp = int(datetime.now().timestamp())
+        tiles = defaultdict(list)
+        for p in pixels:
+            tx = p.x // self.tile_size
+            ty = p.y // self.tile_size
+            tiles[f"{tx}_{ty}"].append(p)
+
+        sem = asyncio.Semaphore(self.chunk_write_concurrency)
+
+        async def _process_tile_chunk(tile_id: str, chunk: List[PixelData]):
+            async with sem:
+                key = {"canvas_id": tile_key(canvas_id, tile_id)}
+                color_parts = []
+                meta_parts = []
+                color_names = {"#colors": "colors", "#lm": "lastModified"}
+                meta_names = {"#meta": "meta"}
+                color_values: Dict[str, Any] = {":ts": timestamp}
+                meta_values: Dict[str, Any] = {}
+
+                for idx, p in enumerate(chunk):
+                    p_key = f"{p.x}_{p.y}"
+                    name_ph = f"#pk{idx}"
+                    val_ph = f":pv{idx}"
+                    color_parts.append(f"#colors.{name_ph} = {val_ph}")
+                    meta_parts.append(f"#meta.{name_ph} = {val_ph}")
+                    color_names[name_ph] = p_key
+                    meta_names[name_ph] = p_key
+                    color_values[val_ph] = p.color
+                    meta_values[val_ph] = {"userId": p.userId, "timestamp": p.timestamp}
+
+                await asyncio.gather(
+                    self._execute_atomic_update(
+                        key=key,
+                        update_expr=f"SET {', '.join(color_parts)}, #lm = :ts",
+                        attr_names=color_names,
+                        attr_values=color_values
+                    ),
+                    self._execute_atomic_update(
+                        key=key,
+                        update_expr=f"SET {', '.join(meta_parts)}",
+                        attr_names=meta_names,
+                        attr_values=meta_values,
+                        table_name=self.canvas_meta_table_name,
+                        map_attr="meta",
+                    ),
+                )
+
+        tasks = []
+        for tile_id, tile_pixels in tiles.items():
+            for i in range(0, len(tile_pixels), self.chunk_size):
+                chunk = tile_pixels[i : i + self.chunk_size]
+                tasks.append(_process_tile_chunk(tile_id, chunk))
+
+        if not tasks:
+            return (await self.get_canvas_version(canvas_id))["version"]
+        await asyncio.gather(*tasks)
+        return await self._bump_version(canvas_id, len(pixels), timestamp)
+
+    async def bulk_overwrite_canvas(self, canvas_id: str, pixels: List[PixelData]) -> int:
+        table = await self.dynamodb.Table(self.canvas_table_name)
+        meta_table = await self.dynamodb.Table(self.canvas_meta_table_name)
+        
+        colors = defaultdict(dict)
+        meta = defaultdict(dict)
+        for p in pixels:
+            tx = p.x // self.tile_size
+            ty = p.y // self.tile_size
+            colors[f"{tx}_{ty}"][f"{p.x}_{p.y}"] = p.color
+            meta[f"{tx}_{ty}"][f"{p.x}_{p.y}"] = {"userId": p.userId, "timestamp": p.timestamp}
+
+        timestamp = int(datetime.now().timestamp())
+        for tile_id, tile_colors_data in colors.items():
+            await table.put_item(
+                Item={
+                    "canvas_id": tile_key(canvas_id, tile_id),
+                    "colors": tile_colors_data,
+                    "lastModified": timestamp
+                }
+            )
+            await meta_table.put_item(
+                Item={
+                    "canvas_id": tile_key(canvas_id, tile_id),
+                    "meta": meta[tile_id],
+                }
+            )
+
+        active_keys = {tile_key(canvas_id, tid) for tid in colors.keys()}
+        for cleanup_table, table_name in ((table, self.canvas_table_name), (meta_table, self.canvas_meta_table_name)):
+            try:
+                delete_futures = []
+                for item in await self._canvas_tiles(table_name, canvas_id, "canvas_id"):
+                    cid = item.get("canvas_id")
+                    if cid and cid not in active_keys:
+                        delete_futures.append(cleanup_table.delete_item(Key={"canvas_id": cid}))
+                if delete_futures:
+                    await asyncio.gather(*delete_futures)
+            except Exception as e:
+                print(f"Error cleaning up old tiles: {e}")
+
+        return await self._bump_version(canvas_id, len(pixels), timestamp)
+
+    async def get_canvas_version(self, canvas_id: str) -> Dict[str, int]:
+        table = await self.dynamodb.Table(self.canvas_table_name)
+        try:
+            response = await table.get_item(Key=self._version_key(canvas_id), ConsistentRead=True)
+        except ClientError as e:
+            print(f"Error getting canvas version: {e}")
+            return empty_canvas_version()
+        item = response.get("Item")
+        if not item:
+            return empty_canvas_version()
+        return {"version": int(item.get("version", 0)), "last_modified": int(item.get("lastModified", 0))}
+
+    def _snapshot_filter(self, canvas_id: str):
+        condition = Attr("canvas_id").eq(canvas_id)
+        if canvas_id == config.default_canvas_id:
+            # Snapshots taken before canvases had ids
+            condition = condition | Attr("canvas_id").not_exists()
+        return condition
+
+    async def create_snapshot_metadata(self, canvas_id: str, snapshot_id: str, image_key: str, thumbnail_key: str, canvas_last_modified: Optional[int] = None, canvas_version: Optional[int] = None) -> Dict:
+        table = await self.dynamodb.Table(self.snapshots_table_name)
+        meta = {
+            "canvas_id": canvas_id,
+            "snapshot_id": snapshot_id,
+            "image_key": image_key,
+            "thumbnail_key": thumbnail_key,
+            "canvas_width": config.canvas_width,
+            "canvas_height": config.canvas_height,
+            "created_at": datetime.now().isoformat(),
+        }
+        if canvas_last_modified is not None:
+            meta["canvas_last_modified"] = canvas_last_modified
+        if canvas_version is not None:
+            meta["canvas_version"] = canvas_version
+        await table.put_item(Item=meta)
+        return meta
+
+    async def create_snapshot_tiles(self, snapshot_id: str, tiles_data: List[Dict]) -> None:
+        table = await self.dynamodb.Table(self.snapshot_tiles_table_name)
+        sem = asyncio.Semaphore(10)
+        
+        async def _write(tile):
+            async with sem:
+                cid = tile.get("canvas_id", "")
+                tile_id = cid.split("#", 1)[1] if "#" in cid else "0_0"
+                await table.put_item(Item={
+                    "snapshot_id": snapshot_id,
+                    "tile_id": tile_id,
+                    "pixels": tile.get("pixels", {})
+                })
+
+        await asyncio.gather(*[_write(t) for t in tiles_data])
+
+    async def get_snapshots(self, canvas_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        try:
+            table = await self.dynamodb.Table(self.snapshots_table_name)
+            resp = await table.scan(FilterExpression=self._snapshot_filter(canvas_id))
+            items = resp.get("Items", [])
+            items.sort(key=lambda x: x.get("created_at", ""), reverse=True)
+            return items[offset : offset + limit]
+        except ClientError:
+            return []
+
+    async def get_snapshot_by_id(self, snapshot_id: str) -> Optional[Dict]:
+        try:
+            snapshots_table = await self.dynamodb.Table(self.snapshots_table_name)
+            resp = await snapshots_table.get_item(Key={"snapshot_id": snapshot_id})
+            if "Item" not in resp:
+                return None
+            
+            meta = resp["Item"]
+            
+            tiles_table = await self.dynamodb.Table(self.snapshot_tiles_table_name)
+            tiles_resp = await tiles_table.query(
+                KeyConditionExpression=Key("snapshot_id").eq(snapshot_id)
+            )
+            
+            pixels = {}
+            for t in tiles_resp.get("Items", []):
+                for p_key, p_val in t.get("pixels", {}).items():
+                    val_fixed = {
+                        k: int(v) if isinstance(v, Decimal) else v 
+                        for k, v in p_val.items()
+                    }
+                    pixels[p_key] = val_fixed
+            
+            meta["pixels"] = pixels
+            return meta
+        except ClientError:
+            return None
+
+    async def delete_snapshot(self, snapshot_id: str) -> bool:
+        try:
+            snapshots_table = await self.dynamodb.Table(self.snapshots_table_name)
+            await snapshots_table.delete_item(Key={"snapshot_id": snapshot_id})
+            
+            tiles_table = await self.dynamodb.Table(self.snapshot_tiles_table_name)
+            tiles = await tiles_table.query(
+                KeyConditionExpression=Key("snapshot_id").eq(snapshot_id),
+                ProjectionExpression="tile_id"
+            )
+            
+            fs = []
+            for t in tiles.get("Items", []):
+                fs.append(tiles_table.delete_item(
+                    Key={"snapshot_id": snapshot_id, "tile_id": t["tile_id"]}
+                ))
+            if fs:
+                await asyncio.gather(*fs)
+            return True
+        except ClientError:
+            return False
+
+    async def get_snapshot_count(self, canvas_id: str) -> int:
+        try:
+            table = await self.dynamodb.Table(self.snapshots_table_name)
+            resp = await table.scan(Select="COUNT", FilterExpression=self._snapshot_filter(canvas_id))
+            return resp.get("Count", 0)
+        except ClientError:
+            return 0
+
+    async def append_history(self, entries: List[HistoryEntry]) -> None:
+        table = await self.dynamodb.Table(self.history_table_name)
+        async with table.batch_writer() as batch:
+            for entry in entries:
+                await batch.put_item(Item={
+                    "partition": history_partition(entry.tile_id, entry.timestamp),
+                    "sort_key": f"{entry.timestamp:012d}#{entry.seq:020d}",
+                    "expires_at": entry.timestamp + config.history_retention,
+                    **entry.model_dump(exclude_none=True),
+                })
+
+    async def get_history(self, since: int, until: int, tile_ids: List[str]) -> List[HistoryEntry]:
+        table = await self.dynamodb.Table(self.history_table_name)
+        sem = asyncio.Semaphore(self.chunk_write_concurrency)
+
+        async def _query(partition: str) -> List[HistoryEntry]:
+            entries = []
+            query_kwargs: Dict[str, Any] = {
+                "KeyConditionExpression": Key("partition").eq(partition) & Key("sort_key").between(
+                    f"{since:012d}#", f"{until:012d}#~"
+                ),
+            }
+            async with sem:
+                while True:
+                    resp = await table.query(**query_kwargs)
+                    for item in resp.get("Items", []):
+                        fixed = self._fix_decimals(item)
+                        entries.append(HistoryEntry(**{k: v for k, v in fixed.items() if k in HistoryEntry.model_fields}))
+                    if "LastEvaluatedKey" not in resp:
+                        break
+                    query_kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+            return entries
+
+        results = await asyncio.gather(*[_query(p) for p in history_partitions(since, until, tile_ids)])
+        entries = [e for part in results for e in part]
+        entries.sort(key=lambda e: (e.timestamp, e.seq))
+        return entries
+
+    async def delete_history(self, before: int) -> int:
+        # Entries and checkpoints carry an expires_at attribute; DynamoDB TTL removes them
+        return 0
+
+    async def save_history_checkpoint(self, timestamp: int, tiles: Dict[str, Dict[str, Dict]]) -> None:
+        table = await self.dynamodb.Table(self.history_table_name)
+        expires_at = timestamp + config.history_retention
+        async with table.batch_writer() as batch:
+            for tile_id, pixels in tiles.items():
+                await batch.put_item(Item={
+                    "partition": f"checkpoint#{timestamp:012d}",
+                    "sort_key": tile_id,
+                    "pixels": pixels,
+                    "expires_at": expires_at,
+                })
+        # The batch writer sends items in any order and retries some later, so the marker only
+        # goes out once it has flushed every tile; readers never see a checkpoint missing tiles
+        await table.put_item(Item={
+            "partition": "checkpoints",
+            "sort_key": f"{timestamp:012d}",
+            "timestamp": timestamp,
+            "expires_at": expires_at,
+        })
+
+    async def get_history_checkpoint(self, at: int, tile_ids: List[str]) -> Optional[Dict]:
+        try:
+            table = await self.dynamodb.Table(self.history_table_name)
+            resp = await table.query(
+                KeyConditionExpression=Key("partition").eq("checkpoints") & Key("sort_key").lte(f"{at:012d}"),
+                ScanIndexForward=False,
+                Limit=1,
+            )
+            items = resp.get("Items", [])
+            if not items:
+                return None
+            timestamp = int(items[0]["timestamp"])
+
+            wanted = set(tile_ids)
+            pixels = {}
+            query_kwargs: Dict[str, Any] = {
+                "KeyConditionExpression": Key("partition").eq(f"checkpoint#{timestamp:012d}"),
+            }
+            while True:
+                tiles_resp = await table.query(**query_kwargs)
+                for tile in tiles_resp.get("Items", []):
+                    if tile["sort_key"] not in wanted:
+                        continue
+                    for p_key, p_val in tile.get("pixels", {}).items():
+                        pixels[p_key] = self._fix_decimals(p_val)
+                if "LastEvaluatedKey" not in tiles_resp:
+                    break
+                query_kwargs["ExclusiveStartKey"] = tiles_resp["LastEvaluatedKey"]
+
+            return {"timestamp": timestamp, "pixels": pixels}
+        except ClientError as e:
+            print(f"Error getting history checkpoint: {e}")
+            return None
@@ -0,0 +1,588 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+import hashlib
+import re
+import secrets
+from typing import Any, Dict, List, Optional
+import uuid
+
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient, IndexModel, ReturnDocument
+
+from adapters.auth import AuthAdapter, AuthToken, TokenSession, User
+from adapters.db import DBAdapter, empty_canvas_version, history_partition, history_partitions, join_pixels, tile_colors, tile_key, tile_meta
+from models import HistoryEntry, PixelData
+from config import config
+from utils.mongo import check_query_plans, ensure_indexes
+
+class MongoDBAdapter(DBAdapter):
+    def __init__(self, client: AsyncMongoClient):
+        self.client = client
+        self.db = self.client[config.mongo_db]
+        self.canvas_collection = self.db.canvas_state
+        self.canvas_meta_collection = self.db.canvas_meta
+        # One document per canvas, kept apart so the tile prefix queries never match it
+        self.canvas_versions_collection = self.db.canvas_versions
+        self.snapshots_collection = self.db.snapshots
+        self.snapshot_tiles_collection = self.db.snapshot_tiles
+        self.history_collection = self.db.pixel_history
+        self.history_checkpoints_collection = self.db.history_checkpoints
+        self.tile_size = config.tile_size
+
+    async def init_indexes(self):
+        await asyncio.gather(
+            ensure_indexes(self.canvas_collection, [IndexModel("canvas_id", unique=True)]),
+            ensure_indexes(self.canvas_meta_collection, [IndexModel("canvas_id", unique=True)]),
+            ensure_indexes(self.canvas_versions_collection, [IndexModel("canvas_id", unique=True)]),
+            ensure_indexes(self.snapshots_collection, [
+                IndexModel("snapshot_id", unique=True),
+                IndexModel([("canvas_id", ASCENDING), ("created_at", DESCENDING)]),
+            ]),
+            ensure_indexes(self.snapshot_tiles_collection, [IndexModel([("snapshot_id", ASCENDING), ("tile_id", ASCENDING)])]),
+            ensure_indexes(self.history_collection, [
+                IndexModel([("partition", ASCENDING), ("timestamp", ASCENDING), ("seq", ASCENDING)]),
+                IndexModel("timestamp"),
+            ]),
+            ensure_indexes(self.history_checkpoints_collection, [
+                IndexModel([("timestamp", ASCENDING), ("tile_id", ASCENDING)]),
+                IndexModel([("complete", ASCENDING), ("timestamp", DESCENDING)], partialFilterExpression={"complete": True}),
+            ]),
+        )
+
+    async def check_query_plans(self):
+        canvas_id = config.default_canvas_id
+        first_tile = tile_key(canvas_id, "0_0")
+        await check_query_plans(self.canvas_collection, [
+            {"filter": self._canvas_query(canvas_id)},
+            {"filter": {"canvas_id": {"$in": [first_tile]}}},
+            {"filter": {"canvas_id": first_tile}},
+        ])
+        await check_query_plans(self.canvas_meta_collection, [
+            {"filter": {"canvas_id": {"$in": [first_tile]}}},
+        ])
+        await check_query_plans(self.canvas_versions_collection, [{"filter": {"canvas_id": canvas_id}}])
+        await check_query_plans(self.snapshots_collection, [
+            {"filter": {"snapshot_id": ""}},
+            {"filter": self._snapshot_query(canvas_id), "sort": [("created_at", DESCENDING)]},
+        ])
+        await check_query_plans(self.snapshot_tiles_collection, [{"filter": {"snapshot_id": ""}}])
+        await check_query_plans(self.history_collection, [
+            {"filter": {"partition": {"$in": [""]}, "timestamp": {"$gte": 0, "$lte": 0}}, "sort": [("timestamp", ASCENDING), ("seq", ASCENDING)]},
+            {"filter": {"timestamp": {"$lt": 0}}},
+        ])
+        await check_query_plans(self.history_checkpoints_collection, [
+            {"filter": {"complete": True, "timestamp": {"$lte": 0}}, "sort": [("timestamp", DESCENDING)]},
+            {"filter": {"timestamp": 0, "tile_id": {"$in": [""]}}},
+        ])
+
+    def _canvas_query(self, canvas_id: str) -> Dict:
+        # Tile documents hold "{canvas_id}#{tile_id}" in their canvas_id field; an anchored
+        # prefix regex on it stays a range scan on the canvas_id index
+        return {"canvas_id": {"$regex": f"^{re.escape(canvas_id)}#"}}
+
+    def _snapshot_query(self, canvas_id: str) -> Dict:
+        if canvas_id == config.default_canvas_id:
+            # Also matches snapshots taken before canvases had ids
+            return {"canvas_id": {"$in": [canvas_id, None]}}
+        return {"canvas_id": canvas_id}
+
+    async def _bump_version(self, canvas_id: str, count: int, timestamp: int) -> int:
+        doc = await self.canvas_versions_collection.find_one_and_update(
+            {"canvas_id": canvas_id},
+            {"$inc": {"version": max(1, count)}, "$max": {"lastModified": timestamp}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return int(doc["version"])
+
+    async def _join_docs(self, query: Dict, keys: Optional[List[str]] = None) -> Dict[str, PixelData]:
+        meta_docs = {doc["canvas_id"]: doc async for doc in self.canvas_meta_collection.find(query)}
+        colors: Dict[str, str] = {}
+        meta: Dict[str, Dict] = {}
+        async for doc in self.canvas_collection.find(query):
+            colors.update(tile_colors(doc))
+            meta.update(tile_meta(doc, meta_docs.get(doc["canvas_id"])))
+        return join_pixels(colors, meta, keys)
+
+    async def get_canvas_state(self, canvas_id: str) -> Dict[str, PixelData]:
+        return await self._join_docs(self._canvas_query(canvas_id))
+
+    async def get_canvas_colors(self, canvas_id: str) -> Dict[str, str]:
+        colors = {}
+        cursor = self.canvas_collection.find(
+            self._canvas_query(canvas_id),
+            {"colors": 1, "pixels": 1, "_id": 0},
+        )
+        async for doc in cursor:
+            colors.update(tile_colors(doc))
+        return colors
+
+    async def get_canvas_tiles(self, canvas_id: str, tile_ids: List[str]) -> Dict[str, str]:
+        colors = {}
+        canvas_ids = [tile_key(canvas_id, tid) for tid in tile_ids]
+        cursor = self.canvas_collection.find(
+            {"canvas_id": {"$in": canvas_ids}},
+            {"colors": 1, "pixels": 1, "_id": 0},
+        )
+        async for doc in cursor:
+            colors.update(tile_colors(doc))
+        return colors
+
+    async def get_pixel_details(self, canvas_id: str, pixel_keys: List[str]) -> Dict[str, PixelData]:
+        canvas_ids = set()
+        for key in pixel_keys:
+            x, y = (int(v) for v in key.split("_"))
+            canvas_ids.add(tile_key(canvas_id, f"{x // self.tile_size}_{y // self.tile_size}"))
+        return await self._join_docs({"canvas_id": {"$in": list(canvas_ids)}}, pixel_keys)
+
+    async def update_pixel(self, canvas_id: str, pixel: PixelData) -> int:
+        pixel_key = f"{pixel.x}_{pixel.y}"
+        tx = pixel.x // self.tile_size
+        ty = pixel.y // self.tile_size
+        key = tile_key(canvas_id, f"{tx}_{ty}")
+
+        await asyncio.gather(
+            self.canvas_collection.update_one(
+                {"canvas_id": key},
+                {
+                    "$set": {
+                        f"colors.{pixel_key}": pixel.color,
+                        "lastModified": pixel.timestamp
+                    }
+                },
+                upsert=True
+            ),
+            self.canvas_meta_collection.update_one(
+                {"canvas_id": key},
+                {
+                    "$set": {
+                        f"meta.{pixel_key}": {"userId": pixel.userId, "timestamp": pixel.timestamp},
+                    }
+                },
+                upsert=True
+            ),
+        )
+        return await self._bump_version(canvas_id, 1, pixel.timestamp)
+
+    async def bulk_update_canvas(self, canvas_id: str, pixels: List[PixelData]) -> int:
+        tiles = defaultdict(list)
+        for p in pixels:
+            tx = p.x // self.tile_size
+            ty = p.y // self.tile_size
+            tiles[f"{tx}_{ty}"].append(p)
+
+        ts = int(datetime.now().timestamp())
+        for tile_id, tile_pixels in tiles.items():
+            colors_update: Dict[str, Any] = {f"colors.{p.x}_{p.y}": p.color for p in tile_pixels}
+            colors_update["lastModified"] = ts
+            meta_update = {
+                f"meta.{p.x}_{p.y}": {"userId": p.userId, "timestamp": p.timestamp}
+                for p in tile_pixels
+            }
+            await asyncio.gather(
+                self.canvas_collection.update_one(
+                    {"canvas_id": tile_key(canvas_id, tile_id)},
+                    {"$set": colors_update},
+                    upsert=True
+                ),
+                self.canvas_meta_collection.update_one(
+                    {"canvas_id": tile_key(canvas_id, tile_id)},
+                    {"$set": meta_update},
+                    upsert=True
+                ),
+            )
+        if not tiles:
+            return (await self.get_canvas_version(canvas_id))["version"]
+        return await self._bump_version(canvas_id, len(pixels), ts)
+
+    async def bulk_overwrite_canvas(self, canvas_id: str, pixels: List[PixelData]) -> int:
+        colors = defaultdict(dict)
+        meta = defaultdict(dict)
+        ts = int(datetime.now().timestamp())
+        for p in pixels:
+            tx = p.x // self.tile_size
+            ty = p.y // self.tile_size
+            colors[f"{tx}_{ty}"][f"{p.x}_{p.y}"] = p.color
+            meta[f"{tx}_{ty}"][f"{p.x}_{p.y}"] = {"userId": p.userId, "timestamp": p.timestamp}
+
+        await self.canvas_collection.delete_many(self._canvas_query(canvas_id))
+        await self.canvas_meta_collection.delete_many(self._canvas_query(canvas_id))
+        
+        docs = []
+        meta_docs = []
+        for tile_id, tile_colors_data in colors.items():
+            docs.append({
+                "canvas_id": tile_key(canvas_id, tile_id),
+                "colors": tile_colors_data,
+                "lastModified": ts
+            })
+            meta_docs.append({
+                "canvas_id": tile_key(canvas_id, tile_id),
+                "meta": meta[tile_id],
+            })
+        if docs:
+            await self.canvas_collection.insert_many(docs)
+            await self.canvas_meta_collection.insert_many(meta_docs)
+        return await self._bump_version(canvas_id, len(pixels), ts)
+
+    async def get_canvas_version(self, canvas_id: str) -> Dict[str, int]:
+        doc = await self.canvas_versions_collection.find_one({"canvas_id": canvas_id})
+        if not doc:
+            return empty_canvas_version()
+        return {"version": int(doc.get("version", 0)), "last_modified": int(doc.get("lastModified", 0))}
+
+    async def create_snapshot_metadata(self, canvas_id: str, snapshot_id: str, image_key: str, thumbnail_key: str, canvas_last_modified: Optional[int] = None, canvas_version: Optional[int] = None) -> Dict:
+        meta = {
+            "canvas_id": canvas_id,
+            "snapshot_id": snapshot_id,
+            "image_key": image_key,
+            "thumbnail_key": thumbnail_key,
+            "canvas_width": config.canvas_width,
+            "canvas_height": config.canvas_height,
+            "created_at": datetime.now(),
+        }
+        if canvas_last_modified is not None:
+            meta["canvas_last_modified"] = canvas_last_modified
+        if canvas_version is not None:
+            meta["canvas_version"] = canvas_version
+        await self.snapshots_collection.insert_one(meta)
+        return meta
+
+    async def create_snapshot_tiles(self, snapshot_id: str, tiles_data: List[Dict]) -> None:
+        docs = []
+        for tile in tiles_data:
+            cid = tile.get("canvas_id", "")
+            tile_id = cid.split("#", 1)[1] if "#" in cid else "0_0"
+            docs.append({
+                "snapshot_id": snapshot_id,
+                "tile_id": tile_id,
+                "pixels": tile.get("pixels", {})
+            })
+        if docs:
+            await self.snapshot_tiles_collection.insert_many(docs)
+
+    async def get_snapshots(self, canvas_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+        cursor = self.snapshots_collection.find(self._snapshot_query(canvas_id), {"pixels": 0}).sort("created_at", -1).skip(offset).limit(limit)
+        return [doc async for doc in cursor]
+
+    async def get_snapshot_by_id(self, snapshot_id: str) -> Optional[Dict]:
+        meta = await self.snapshots_collection.find_one({"snapshot_id": snapshot_id})
+        if not meta:
+            return None
+        
+        pixels = {}
+        async for doc in self.snapshot_tiles_collection.find({"snapshot_id": snapshot_id}):
+            pixels.update(doc.get("pixels", {}))
+        
+        meta["pixels"] = pixels
+        return meta
+
+    async def delete_snapshot(self, snapshot_id: str) -> bool:
+        res = await self.snapshots_collection.delete_one({"snapshot_id": snapshot_id})
+        await self.snapshot_tiles_collection.delete_many({"snapshot_id": snapshot_id})
+        return res.deleted_count > 0
+
+    async def get_snapshot_count(self, canvas_id: str) -> int:
+        return await self.snapshots_collection.count_documents(self._snapshot_query(canvas_id))
+
+    async def append_history(self, entries: List[HistoryEntry]) -> None:
+        docs = [
+            {"partition": history_partition(e.tile_id, e.timestamp), **e.model_dump(exclude_none=True)}
+            for e in entries
+        ]
+        if docs:
+            await self.history_collection.insert_many(docs, ordered=False)
+
+    async def get_history(self, since: int, until: int, tile_ids: List[str]) -> List[HistoryEntry]:
+        cursor = self.history_collection.find(
+            {
+                "partition": {"$in": history_partitions(since, until, tile_ids)},
+                "timestamp": {"$gte": since, "$lte": until},
+            },
+            {"_id": 0, "partition": 0},
+        ).sort([("timestamp", 1), ("seq", 1)])
+        return [HistoryEntry(**doc) async for doc in cursor]
+
+    async def delete_history(self, before: int) -> int:
+        res = await self.history_collection.delete_many({"timestamp": {"$lt": before}})
+        # Markers first, so a checkpoint never looks complete while its tiles are being removed
+        await self.history_checkpoints_collection.delete_many({"complete": True, "timestamp": {"$lt": before}})
+        await self.history_checkpoints_collection.delete_many({"timestamp": {"$lt": before}})
+        return res.deleted_count
+
+    async def save_history_checkpoint(self, timestamp: int, tiles: Dict[str, Dict[str, Dict]]) -> None:
+        docs = [
+            {"timestamp": timestamp, "tile_id": tile_id, "pixels": pixels}
+            for tile_id, pixels in tiles.items()
+        ]
+        if docs:
+            await self.history_checkpoints_collection.insert_many(docs)
+        # Readers only use checkpoints with this marker, which is written after all of the tiles
+        await self.history_checkpoints_collection.insert_one({"timestamp": timestamp, "complete": True})
+
+    async def get_history_checkpoint(self, at: int, tile_ids: List[str]) -> Optional[Dict]:
+        latest = await self.history_checkpoints_collection.find_one(
+            {"complete": True, "timestamp": {"$lte": at}},
+            {"timestamp": 1},
+            sort=[("timestamp", -1)],
+        )
+        if not latest:
+            return None
+
+        pixels = {}
+        cursor = self.history_checkpoints_collection.find(
+            {"timestamp": latest["timestamp"], "tile_id": {"$in": tile_ids}}
+        )
+        async for doc in cursor:
+            pixels.update(doc.get("pixels", {}))
+        return {"timestamp": latest["timestamp"], "pixels": pixels}
+
+class LocalMongoAuthAdapter(AuthAdapter):
+    def __init__(self, client: AsyncMongoClient, mongo_db: str):
+        self.client = client
+        self.db = self.client[mongo_db]
+        self.users_collection = self.db.users
+        self.tokens_collection = self.db.tokens
+        self.pending_verifications = self.db.pending_verifications
+
+    async def init_indexes(self):
+        await asyncio.gather(
+            ensure_indexes(self.users_collection, [
+                IndexModel("email", unique=True),
+                IndexModel("user_id", unique=True),
+                IndexModel("username_lower", unique=True),
+            ]),
+            # Refresh tokens were once indexed without unique; the old index is replaced
+            ensure_indexes(self.tokens_collection, [
+                IndexModel("access_token", unique=True),
+                IndexModel("refresh_token", unique=True),
+                # Token documents outlive the access token so that they can still be refreshed
+                IndexModel("refresh_expires_at", expireAfterSeconds=0),
+            ], replace_conflicting=True),
+            ensure_indexes(self.pending_verifications, [
+                IndexModel("email", unique=True),
+                IndexModel("created_at", expireAfterSeconds=config.pending_verification_ttl),
+            ]),
+        )
+
+    async def check_query_plans(self):
+        await check_query_plans(self.users_collection, [
+            {"filter": {"email": ""}},
+            {"filter": {"user_id": ""}},
+            {"filter": {"user_id": {"$in": [""]}}},
+            {"filter": {"username_lower": ""}},
+        ])
+        await check_query_plans(self.tokens_collection, [
+            {"filter": {"access_token": ""}},
+            {"filter": {"refresh_token": ""}},
+        ])
+        await check_query_plans(self.pending_verifications, [{"filter": {"email": ""}}])
+
+    def _hash_password(self, password: str) -> str:
+        return hashlib.sha256(password.encode()).hexdigest()
+    
+    def _generate_token(self) -> str:
+        return secrets.token_urlsafe(32)
+    
+    async def username_exists(self, username: str) -> bool:
+        count = await self.users_collection.count_documents(
+            {"username_lower": username.lower()}
+        )
+        return count > 0
+    
+    async def register(self, email: str, username: str, password: str) -> Dict:
+        email_exists = await self.users_collection.find_one({"email": email})
+        if email_exists:
+            raise ValueError("Email already registered")
+        
+        if await self.username_exists(username):
+            raise ValueError("Username already taken")
+            
+        user_id = str(uuid.uuid4())
+        password_hash = self._hash_password(password)
+
+        await self.pending_verifications.update_one(
+            {"email": email},
+            {
+                "$set": {
+                    "user_id": user_id,
+                    "email": email,
+                    "username": username,
+                    "username_lower": username.lower(),
+                    "password_hash": password_hash,
+                    "created_at": datetime.now()
+                }
+            },
+            upsert=True,
+        )
+
+        return {"requires_verification": True, "user_id": user_id}
+    
+    async def verify_email(self, email: str, code: str) -> User:
+        pending = await self.pending_verifications.find_one({"email": email})
+        if not pending:
+            raise ValueError("No pending registration found")
+        
+        # Locally: we don't care about the code
+
+        user_doc = {
+            "user_id": pending["user_id"],
+            "email": pending["email"],
+            "username": pending["username"],
+            "username_lower": pending["username_lower"],
+            "password_hash": pending["password_hash"],
+            "email_verified": True,
+            "created_at": pending["created_at"],
+        }
+
+        await self.users_collection.insert_one(user_doc)
+        await self.pending_verifications.delete_one({"email": email})
+
+        return User(
+            user_id=user_doc["user_id"],
+            email=user_doc["email"],
+            username=user_doc["username"],
+            email_verified=True,
+            created_at=user_doc["created_at"],
+        )
+    
+    async def login(self, email: str, password: str) -> tuple[User, AuthToken]:
+        user_doc = await self.users_collection.find_one({"email": email})
+        if not user_doc:
+            raise ValueError("Invalid credentials")
+        
+        password_hash = self._hash_password(password)
+        if user_doc["password_hash"] != password_hash:
+            raise ValueError("Invalid credentials")
+        
+        if not user_doc.get("email_verified", False):
+            raise ValueError("Email not verified")
+        
+        access_token = self._generate_token()
+        refresh_token = self._generate_token()
+        
+        now = datetime.now()
+        expires_at = now + timedelta(hours=1)
+        refresh_expires_at = now + timedelta(days=30)
+
+        await self.tokens_collection.insert_one({
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "user_id": user_doc["user_id"],
+            "expires_at": expires_at,
+            "refresh_expires_at": refresh_expires_at,
+            "created_at": datetime.now(),
+        })
+
+        user = User(
+            user_id=user_doc["user_id"],
+            email=user_doc["email"],
+            username=user_doc["username"],
+            email_verified=user_doc["email_verified"],
+            created_at=user_doc["created_at"],
+        )
+
+        token = AuthToken(
+            access_token=access_token,
+            refresh_token=refresh_token,
+            expires_in=86400,  # 24 hours
+        )
+
+        return user, token
+    
+    async def refresh_token(self, email: str, refresh_token: str) -> tuple[User, AuthToken]:
+        token_doc = await self.tokens_collection.find_one({"refresh_token": refresh_token})
+        if not token_doc:
+            raise ValueError("Invalid refresh token")
+        
+        if token_doc.get("refresh_expires_at") and token_doc["refresh_expires_at"] < datetime.now():
+            await self.tokens_collection.delete_one({"_id": token_doc["_id"]})
+            raise ValueError("Refresh token expired")
+        
+        user_doc = await self.users_collection.find_one({"user_id": token_doc["user_id"]})
+        if not user_doc:
+            raise ValueError("User not found")
+        
+        new_access_token = self._generate_token()
+        new_expires_at = datetime.now() + timedelta(hours=1)
+        
+        await self.tokens_collection.update_one(
+            {"_id": token_doc["_id"]},
+            {
+                "$set": {
+                    "access_token": new_access_token,
+                    "expires_at": new_expires_at
+                }
+            }
+        )
+
+        user = User(
+            user_id=user_doc["user_id"],
+            email=user_doc["email"],
+            username=user_doc["username"],
+            email_verified=user_doc["email_verified"],
+            created_at=user_doc["created_at"],
+        )
+
+        token = AuthToken(
+            access_token=new_access_token,
+            refresh_token=None, # Do not rotate refresh token for now
+            expires_in=3600
+        )
+
+        return user, token
+
+    async def logout(self, access_token: str) -> bool:
+        result = await self.tokens_collection.delete_one({"access_token": access_token})
+        return result.deleted_count > 0
+    
+    async def get_session_from_token(self, access_token: str) -> TokenSession | None:
+        token_doc = await self.tokens_collection.find_one({"access_token": access_token})
+        if not token_doc:
+            return None
+
+        if token_doc["expires_at"] < datetime.now():
+            # Allow refresh token to persist
+            # await self.tokens_collection.delete_one({"access_token": access_token})
+            return None
+
+        user_doc = await self.users_collection.find_one(
+            {"user_id": token_doc["user_id"]}
+        )
+        if not user_doc:
+            return None
+
+        user = User(
+            user_id=user_doc["user_id"],
+            email=user_doc["email"],
+            username=user_doc["username"],
+            email_verified=user_doc["email_verified"],
+            created_at=user_doc["created_at"],
+        )
+        return TokenSession(user, token_doc["expires_at"])
+
+    async def get_user_by_id(self, user_id: str) -> User | None:
+        user_doc = await self.users_collection.find_one({"user_id": user_id})
+        if not user_doc:
+            return None
+
+        return User(
+            user_id=user_doc["user_id"],
+            email=user_doc["email"],
+            username=user_doc["username"],
+            email_verified=user_doc["email_verified"],
+            created_at=user_doc["created_at"],
+        )
+
+    async def get_users_by_ids(self, user_ids: List[str]) -> Dict[str, User]:
+        cursor = self.users_collection.find({"user_id": {"$in": user_ids}})
+        users = {}
+        async for user_doc in cursor:
+            users[user_doc["user_id"]] = User(
+                user_id=user_doc["user_id"],
+                email=user_doc["email"],
+                username=user_doc["username"],
+                email_verified=user_doc["email_verified"],
+                created_at=user_doc["created_at"],
+            )
+        return users
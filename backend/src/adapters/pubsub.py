@@ -1,11 +1,7 @@
 from abc import ABC, abstractmethod
 import asyncio
 import json
-import socket
-from typing import Awaitable, Callable, Dict
-
-from valkey.asyncio import Valkey
-from valkey.exceptions import ValkeyError, TimeoutError
+from typing import Awaitable, Callable, Dict, List
 
 class PubSubAdapter(ABC):
     @abstractmethod
@@ -20,61 +16,33 @@ class PubSubAdapter(ABC):
     async def close(self) -> None:
         pass
 
-class ValkeyPubSubAdapter(PubSubAdapter):
-    def __init__(self, host: str, port: int, ssl: bool = False) -> None:
-        self.pub_client = Valkey(
-            host=host, 
-            port=port, 
-            ssl=ssl,
-            decode_responses=True,
-        )
-
-        self.sub_client = Valkey(
-            host=host, 
-            port=port, 
-            ssl=ssl,
-            decode_responses=True,
-            health_check_interval=0,
-            
-            socket_timeout=None,
-            
-            socket_keepalive=True,
-            socket_keepalive_options={
-                socket.TCP_KEEPIDLE: 15,
-                socket.TCP_KEEPINTVL: 5,
-                socket.TCP_KEEPCNT: 3,
-            }
-        )
-
-        self.pubsub = None
-        self._is_active = True
+class MemoryPubSubAdapter(PubSubAdapter):
+    # Single-process channels; messages still go through JSON so subscribers get their own copy
+    def __init__(self) -> None:
+        self.channels: Dict[str, List[asyncio.Queue]] = {}
 
     async def publish(self, channel: str, message: Dict) -> None:
-        await self.pub_client.publish(channel, json.dumps(message))
+        data = json.dumps(message)
+        for queue in self.channels.get(channel, []):
+            queue.put_nowait(data)
 
     async def subscribe(self, channel: str, callback: Callable[[Dict], Awaitable[None]]) -> None:
-        self.pubsub = self.sub_client.pubsub()
-        await self.pubsub.subscribe(channel)
+        queue: asyncio.Queue = asyncio.Queue()
+        self.channels.setdefault(channel, []).append(queue)
 
         try:
-            async for message in self.pubsub.listen():
-                if message["type"] == "message":
-                    try:
-                        payload = json.loads(message["data"])
-                        if payload.get("intent") != "heartbeat":
-                            await callback(payload)
-                    except Exception as e:
-                        print(f"Error processing message: {e}")
-                        
-        except Exception as e:
-            print(f"Subscription connection lost: {e}")
-            raise e
+            while True:
+                data = await queue.get()
+                try:
+                    payload = json.loads(data)
+                    if payload.get("intent") != "heartbeat":
+                        await callback(payload)
+                except Exception as e:
+                    print(f"Error processing message: {e}")
         finally:
-            if self.pubsub:
-                await self.pubsub.close()
+            queues = self.channels.get(channel, [])
+            if queue in queues:
+                queues.remove(queue)
 
     async def close(self) -> None:
-        if self.pubsub:
-            await self.pubsub.close()
-        await self.pub_client.aclose()
-        await self.sub_client.aclose()
+        self.channels.clear()
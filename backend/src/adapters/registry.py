@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict
+
+from adapters.auth import AuthAdapter
+from adapters.connections import Connections
+from adapters.db import DBAdapter
+from adapters.pubsub import PubSubAdapter
+from adapters.revocations import RevocationStore
+from adapters.storage import StorageAdapter
+from config import config
+from utils.metrics import auth_operation_duration, db_operation_duration, instrument, instrument_storage
+
+# Each environment imports its backend libraries (aioboto3, pymongo, valkey) only when it is
+# selected, so a container doesn't pay for clients it will never create.
+
+@dataclass
+class Adapters:
+    db: DBAdapter
+    auth: AuthAdapter
+    storage: StorageAdapter
+    pubsub: PubSubAdapter
+    revocations: RevocationStore
+
+Factory = Callable[[Connections], Awaitable[Adapters]]
+
+_factories: Dict[str, Factory] = {}
+
+def register(environment: str):
+    def decorator(factory: Factory) -> Factory:
+        _factories[environment] = factory
+        return factory
+    return decorator
+
+def _valkey_pubsub(connections: Connections) -> PubSubAdapter:
+    from adapters.valkey import ValkeyPubSubAdapter
+
+    return ValkeyPubSubAdapter(connections.valkey_publisher(), connections.valkey_subscriber())
+
+def _valkey_revocations(connections: Connections) -> RevocationStore:
+    from adapters.valkey import ValkeyRevocationStore
+
+    return ValkeyRevocationStore(connections.valkey_publisher())
+
+@register("aws")
+async def _aws(connections: Connections) -> Adapters:
+    from adapters.cognito import CognitoAuthAdapter
+    from adapters.dynamodb import DynamoDBAdapter
+    from adapters.s3 import S3StorageAdapter
+
+    dynamodb = await connections.aws_resource("dynamodb")
+    cognito = await connections.aws_client("cognito-idp")
+    s3 = await connections.aws_client("s3")
+
+    return Adapters(
+        db=instrument(DynamoDBAdapter(dynamodb), db_operation_duration, "dynamodb"),
+        auth=instrument(CognitoAuthAdapter(cognito), auth_operation_duration, "cognito"),
+        storage=instrument_storage(S3StorageAdapter(s3), "s3"),
+        pubsub=_valkey_pubsub(connections),
+        revocations=_valkey_revocations(connections),
+    )
+
+@register("local")
+async def _local(connections: Connections) -> Adapters:
+    from adapters.mongo import LocalMongoAuthAdapter, MongoDBAdapter
+    from adapters.storage import LocalFileStorageAdapter
+
+    # Canvas and auth collections share one client and so one pool
+    client = connections.mongo()
+    db = MongoDBAdapter(client)
+    auth = LocalMongoAuthAdapter(client, config.mongo_db)
+    await db.init_indexes()
+    await auth.init_indexes()
+    if config.mongo_check_query_plans:
+        await db.check_query_plans()
+        await auth.check_query_plans()
+
+    return Adapters(
+        db=instrument(db, db_operation_duration, "mongo"),
+        auth=instrument(auth, auth_operation_duration, "mongo"),
+        storage=instrument_storage(LocalFileStorageAdapter(config.local_storage_path), "local"),
+        pubsub=_valkey_pubsub(connections),
+        revocations=_valkey_revocations(connections),
+    )
+
+@register("memory")
+async def _memory(connections: Connections) -> Adapters:
+    # Single node with no external services; state lives as long as the process
+    from adapters.auth import MemoryAuthAdapter
+    from adapters.db import MemoryDBAdapter
+    from adapters.pubsub import MemoryPubSubAdapter
+    from adapters.revocations import MemoryRevocationStore
+    from adapters.storage import MemoryStorageAdapter
+
+    return Adapters(
+        db=instrument(MemoryDBAdapter(), db_operation_duration, "memory"),
+        auth=instrument(MemoryAuthAdapter(), auth_operation_duration, "memory"),
+        storage=instrument_storage(MemoryStorageAdapter(), "memory"),
+        pubsub=MemoryPubSubAdapter(),
+        revocations=MemoryRevocationStore(),
+    )
+
+async def create_adapters(environment: str, connections: Connections) -> Adapters:
+    factory = _factories.get(environment)
+    if not factory:
+        raise ValueError(f"Unknown environment: {environment}")
+    return await factory(connections)
@@ -0,0 +1,34 @@
+from abc import ABC, abstractmethod
+import time
+from typing import Dict
+
+class RevocationStore(ABC):
+    # Hashes of signed-out access tokens, each kept until the token would have expired anyway
+    @abstractmethod
+    async def revoke(self, token_hash: str, ttl: float) -> None:
+        pass
+
+    @abstractmethod
+    async def is_revoked(self, token_hash: str) -> bool:
+        pass
+
+class MemoryRevocationStore(RevocationStore):
+    # Single process; entries are never dropped before their token expires
+    def __init__(self) -> None:
+        self.expires: Dict[str, float] = {}
+
+    async def revoke(self, token_hash: str, ttl: float) -> None:
+        now = time.monotonic()
+        self.expires = {h: expires_at for h, expires_at in self.expires.items() if expires_at > now}
+        self.expires[token_hash] = now + ttl
+
+    async def is_revoked(self, token_hash: str) -> bool:
+        expires_at = self.expires.get(token_hash)
+        return expires_at is not None and expires_at > time.monotonic()
+
+def get_revocation_store() -> RevocationStore:
+    from deps import manager
+
+    if not manager.revocations:
+        raise RuntimeError("Revocation store not initialized")
+    return manager.revocations
@@ -0,0 +1,157 @@
+from datetime import datetime
+import mimetypes
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Dict, List
+
+from botocore.exceptions import ClientError
+
+from adapters.storage import STREAM_CHUNK_SIZE, StorageAdapter, StorageFile, UploadTarget
+from config import config
+
+# S3 rejects multipart parts under 5 MiB except the last one
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+class S3StorageAdapter(StorageAdapter):
+    def __init__(self, s3_client):
+        self.s3 = s3_client
+        self.bucket_name = config.s3_bucket_name
+        self.region = config.aws_region
+    
+    async def upload_file(self, key: str, file_data: BinaryIO) -> StorageFile:
+        try:
+            file_content = file_data.read()
+            file_size = len(file_content)
+
+            await self.s3.put_object(
+                Bucket=self.bucket_name,
+                Key=key,
+                Body=file_content,
+                ContentType=self._content_type(key)
+            )
+            
+            return StorageFile(
+                key=key,
+                url=self.get_file_url(key),
+                size=file_size,
+                created_at=datetime.now()
+            )
+        except ClientError as e:
+            print(f"Error uploading file to S3: {e}")
+            raise ValueError(f"Failed to upload file: {e}")
+
+    def _content_type(self, key: str) -> str:
+        return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+    async def download_file(self, key: str) -> bytes:
+        try:
+            response = await self.s3.get_object(Bucket=self.bucket_name, Key=key)
+            async with response["Body"] as stream:
+                return await stream.read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                raise FileNotFoundError(f"File not found: {key}")
+            print(f"Error downloading file from S3: {e}")
+            raise ValueError(f"Failed to download file: {e}")
+
+    async def delete_file(self, key: str) -> bool:
+        try:
+            await self.s3.delete_object(Bucket=self.bucket_name, Key=key)
+            return True
+        except ClientError as e:
+            print(f"Error deleting file from S3: {e}")
+            return False
+    
+    def get_file_url(self, key: str) -> str:
+        return f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{key}"
+    
+    async def file_exists(self, key: str) -> bool:
+        try:
+            await self.s3.head_object(Bucket=self.bucket_name, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    async def get_signed_url(self, key: str, expires_in: int) -> str:
+        return await self.s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket_name, "Key": key},
+            ExpiresIn=expires_in,
+        )
+
+    async def create_upload(self, key: str, content_type: str, max_size: int, expires_in: int) -> UploadTarget:
+        # A POST policy rather than a presigned PUT, so S3 itself enforces the size limit
+        post = await self.s3.generate_presigned_post(
+            self.bucket_name,
+            key,
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, max_size]],
+            ExpiresIn=expires_in,
+        )
+        return UploadTarget(url=post["url"], fields=post["fields"])
+
+    async def open_read(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        try:
+            response = await self.s3.get_object(Bucket=self.bucket_name, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                raise FileNotFoundError(f"File not found: {key}")
+            print(f"Error downloading file from S3: {e}")
+            raise ValueError(f"Failed to download file: {e}")
+
+        async with response["Body"] as stream:
+            async for chunk in stream.iter_chunks(chunk_size):
+                yield chunk
+
+    async def _upload_part(self, key: str, upload_id: str, parts: List[Dict], data: bytes):
+        number = len(parts) + 1
+        response = await self.s3.upload_part(
+            Bucket=self.bucket_name, Key=key, UploadId=upload_id, PartNumber=number, Body=data,
+        )
+        parts.append({"PartNumber": number, "ETag": response["ETag"]})
+
+    async def open_write(self, key: str, chunks: AsyncIterable[bytes]) -> StorageFile:
+        # Small objects go up in one request; anything past one part becomes a multipart upload,
+        # so at most one part is buffered at a time
+        buffer = bytearray()
+        size = 0
+        upload_id = None
+        parts: List[Dict] = []
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                size += len(chunk)
+                if len(buffer) >= MULTIPART_PART_SIZE:
+                    if upload_id is None:
+                        response = await self.s3.create_multipart_upload(
+                            Bucket=self.bucket_name, Key=key, ContentType=self._content_type(key),
+                        )
+                        upload_id = response["UploadId"]
+                    await self._upload_part(key, upload_id, parts, bytes(buffer))
+                    buffer.clear()
+
+            if upload_id is None:
+                await self.s3.put_object(
+                    Bucket=self.bucket_name, Key=key, Body=bytes(buffer), ContentType=self._content_type(key),
+                )
+            else:
+                if buffer:
+                    await self._upload_part(key, upload_id, parts, bytes(buffer))
+                await self.s3.complete_multipart_upload(
+                    Bucket=self.bucket_name, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts},
+                )
+        except BaseException as e:
+            if upload_id is not None:
+                try:
+                    await self.s3.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+                except ClientError as abort_error:
+                    print(f"Error aborting multipart upload to S3: {abort_error}")
+            if isinstance(e, ClientError):
+                print(f"Error uploading file to S3: {e}")
+                raise ValueError(f"Failed to upload file: {e}")
+            raise
+
+        return StorageFile(
+            key=key,
+            url=self.get_file_url(key),
+            size=size,
+            created_at=datetime.now()
+        )
@@ -1,15 +1,28 @@
 from abc import ABC, abstractmethod
+import asyncio
 from dataclasses import dataclass
 from datetime import datetime
+import hashlib
+import hmac
+import os
 from os import PathLike
 from pathlib import Path
 import shutil
-from typing import BinaryIO
-
-from botocore.exceptions import ClientError
+import time
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Dict, Tuple
+from urllib.parse import quote, urlencode
+import uuid
 
 from config import config
 
+# Size of the pieces open_read yields; writers may hand open_write any size
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+async def iter_file(file_data: BinaryIO, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    # Feeds an in-memory buffer to open_write without copying it whole first
+    while chunk := file_data.read(chunk_size):
+        yield chunk
+
 @dataclass
 class StorageFile:
     key: str
@@ -17,6 +30,38 @@ class StorageFile:
     size: int
     created_at: datetime
 
+@dataclass
+class UploadTarget:
+    # A multipart form POST: the fields in order, then the file as "file"
+    url: str
+    fields: Dict[str, str]
+
+# Readable without a signed link, as in the bucket policy; everything else is handed out signed.
+# Live pyramids only: snapshot pyramids are as private as their snapshots.
+PUBLIC_PREFIXES = ("pyramids/live",)
+
+def sign(*parts: object) -> str:
+    message = "\n".join(str(p) for p in parts).encode()
+    return hmac.new(config.storage_signing_key.encode(), message, hashlib.sha256).hexdigest()
+
+def verify_signature(signature: str, expires: int, *parts: object) -> bool:
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(signature, sign(*parts, expires))
+
+def _signed_static_url(key: str, expires_in: int) -> str:
+    # Local stand-in for a presigned GET; routes/static.py checks it
+    expires = int(time.time()) + expires_in
+    query = urlencode({"expires": expires, "signature": sign("GET", key, expires)})
+    return f"/static/{quote(key)}?{query}"
+
+def _static_upload(key: str, content_type: str, max_size: int, expires_in: int) -> UploadTarget:
+    # Local stand-in for a presigned POST, received by routes/static.py
+    expires = int(time.time()) + expires_in
+    fields = {"key": key, "Content-Type": content_type, "max_size": str(max_size), "expires": str(expires)}
+    fields["signature"] = sign("POST", key, content_type, max_size, expires)
+    return UploadTarget(url="/static/upload", fields=fields)
+
 class StorageAdapter(ABC):
     @abstractmethod
     async def upload_file(self, key: str, file_data: BinaryIO) -> StorageFile:
@@ -38,112 +83,181 @@ class StorageAdapter(ABC):
     async def file_exists(self, key: str) -> bool:
         pass
 
-class S3StorageAdapter(StorageAdapter):
-    def __init__(self, s3_client):
-        self.s3 = s3_client
-        self.bucket_name = config.s3_bucket_name
-        self.region = config.aws_region
-    
+    # Time-limited links for private objects, and uploads that go straight to storage
+    @abstractmethod
+    async def get_signed_url(self, key: str, expires_in: int) -> str:
+        pass
+
+    @abstractmethod
+    async def create_upload(self, key: str, content_type: str, max_size: int, expires_in: int) -> UploadTarget:
+        pass
+
+    # Streaming counterparts of download_file and upload_file, so large artifacts never have to
+    # be held in memory whole. open_read raises FileNotFoundError when first iterated.
+    @abstractmethod
+    def open_read(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        pass
+
+    @abstractmethod
+    async def open_write(self, key: str, chunks: AsyncIterable[bytes]) -> StorageFile:
+        pass
+
+class LocalFileStorageAdapter(StorageAdapter):
+    # All disk access runs in worker threads; a slow disk must not stall the event loop
+    def __init__(self, base_path: PathLike | str):
+        self.base_path = Path(base_path)
+        self.base_path.mkdir(parents=True, exist_ok=True)
+
+    def _get_file_path(self, key: str) -> Path:
+        return self.base_path / key
+
+    def _open_temp(self, path: Path) -> Tuple[Path, BinaryIO]:
+        # Written beside the target and renamed into place, so readers never see half a file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        return temp_path, open(temp_path, "wb")
+
+    def _commit(self, key: str, temp_path: Path, path: Path) -> StorageFile:
+        os.replace(temp_path, path)
+        stat = path.stat()
+
+        return StorageFile(
+            key=key,
+            url=self.get_file_url(key),
+            size=stat.st_size,
+            created_at=datetime.fromtimestamp(stat.st_ctime)
+        )
+
+    def _discard(self, temp_path: Path):
+        temp_path.unlink(missing_ok=True)
+
+    def _write(self, key: str, file_data: BinaryIO) -> StorageFile:
+        path = self._get_file_path(key)
+        temp_path, file = self._open_temp(path)
+        try:
+            with file:
+                shutil.copyfileobj(file_data, file)
+        except BaseException:
+            self._discard(temp_path)
+            raise
+        return self._commit(key, temp_path, path)
+
     async def upload_file(self, key: str, file_data: BinaryIO) -> StorageFile:
+        return await asyncio.to_thread(self._write, key, file_data)
+
+    def _read(self, key: str) -> bytes:
         try:
-            file_content = file_data.read()
-            file_size = len(file_content)
-
-            await self.s3.put_object(
-                Bucket=self.bucket_name,
-                Key=key,
-                Body=file_content,
-                ContentType="image/png"
-            )
-            
-            return StorageFile(
-                key=key,
-                url=self.get_file_url(key),
-                size=file_size,
-                created_at=datetime.now()
-            )
-        except ClientError as e:
-            print(f"Error uploading file to S3: {e}")
-            raise ValueError(f"Failed to upload file: {e}")
+            with open(self._get_file_path(key), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File not found: {key}")
 
     async def download_file(self, key: str) -> bytes:
-        try:
-            response = await self.s3.get_object(Bucket=self.bucket_name, Key=key)
-            async with response["Body"] as stream:
-                return await stream.read()
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "NoSuchKey":
-                raise FileNotFoundError(f"File not found: {key}")
-            print(f"Error downloading file from S3: {e}")
-            raise ValueError(f"Failed to download file: {e}")
+        return await asyncio.to_thread(self._read, key)
 
-    async def delete_file(self, key: str) -> bool:
+    def _delete(self, key: str) -> bool:
         try:
-            await self.s3.delete_object(Bucket=self.bucket_name, Key=key)
+            self._get_file_path(key).unlink()
             return True
-        except ClientError as e:
-            print(f"Error deleting file from S3: {e}")
+        except FileNotFoundError:
             return False
+
+    async def delete_file(self, key: str) -> bool:
+        return await asyncio.to_thread(self._delete, key)
     
     def get_file_url(self, key: str) -> str:
-        return f"https://{self.bucket_name}.s3.{self.region}.amazonaws.com/{key}"
+        return f"/static/{key}"
     
     async def file_exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self._get_file_path(key).exists)
+
+    async def get_signed_url(self, key: str, expires_in: int) -> str:
+        return _signed_static_url(key, expires_in)
+
+    async def create_upload(self, key: str, content_type: str, max_size: int, expires_in: int) -> UploadTarget:
+        return _static_upload(key, content_type, max_size, expires_in)
+
+    async def open_read(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
         try:
-            await self.s3.head_object(Bucket=self.bucket_name, Key=key)
-            return True
-        except ClientError:
-            return False
+            file = await asyncio.to_thread(open, self._get_file_path(key), "rb")
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File not found: {key}")
 
-class LocalFileStorageAdapter(StorageAdapter):
-    def __init__(self, base_path: PathLike | str):
-        self.base_path = Path(base_path)
-        self.base_path.mkdir(parents=True, exist_ok=True)
+        try:
+            while chunk := await asyncio.to_thread(file.read, chunk_size):
+                yield chunk
+        finally:
+            file.close()
 
-    def _get_file_path(self, key: str) -> Path:
-        path = self.base_path / key
-        path.parent.mkdir(parents=True, exist_ok=True)
-        return path
+    async def open_write(self, key: str, chunks: AsyncIterable[bytes]) -> StorageFile:
+        path = self._get_file_path(key)
+        temp_path, file = await asyncio.to_thread(self._open_temp, path)
+        try:
+            with file:
+                async for chunk in chunks:
+                    await asyncio.to_thread(file.write, chunk)
+        except BaseException:
+            await asyncio.to_thread(self._discard, temp_path)
+            raise
+        return await asyncio.to_thread(self._commit, key, temp_path, path)
     
-    async def upload_file(self, key: str, file_data: BinaryIO) -> StorageFile:
-        file_path = self._get_file_path(key)
+class MemoryStorageAdapter(StorageAdapter):
+    def __init__(self):
+        self.files: Dict[str, Tuple[bytes, datetime]] = {}
 
-        with open(file_path, "wb") as file:
-            shutil.copyfileobj(file_data, file)
-        
-        stat = file_path.stat()
+    async def upload_file(self, key: str, file_data: BinaryIO) -> StorageFile:
+        content = file_data.read()
+        created_at = datetime.now()
+        self.files[key] = (content, created_at)
 
         return StorageFile(
             key=key,
             url=self.get_file_url(key),
-            size=stat.st_size,
-            created_at=datetime.fromtimestamp(stat.st_ctime)
+            size=len(content),
+            created_at=created_at
         )
 
     async def download_file(self, key: str) -> bytes:
-        file_path = self._get_file_path(key)
-
-        if not file_path.exists():
+        if key not in self.files:
             raise FileNotFoundError(f"File not found: {key}")
-        
-        with open(file_path, "rb") as file:
-            return file.read()
+        return self.files[key][0]
 
     async def delete_file(self, key: str) -> bool:
-        file_path = self._get_file_path(key)
+        return self.files.pop(key, None) is not None
 
-        if file_path.exists():
-            file_path.unlink()
-            return True
-        
-        return False
-    
     def get_file_url(self, key: str) -> str:
         return f"/static/{key}"
-    
+
     async def file_exists(self, key: str) -> bool:
-        return self._get_file_path(key).exists()
-    
+        return key in self.files
+
+    async def get_signed_url(self, key: str, expires_in: int) -> str:
+        return _signed_static_url(key, expires_in)
+
+    async def create_upload(self, key: str, content_type: str, max_size: int, expires_in: int) -> UploadTarget:
+        return _static_upload(key, content_type, max_size, expires_in)
+
+    async def open_read(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        if key not in self.files:
+            raise FileNotFoundError(f"File not found: {key}")
+        content = self.files[key][0]
+        for offset in range(0, len(content), chunk_size):
+            yield content[offset:offset + chunk_size]
+
+    async def open_write(self, key: str, chunks: AsyncIterable[bytes]) -> StorageFile:
+        content = bytearray()
+        async for chunk in chunks:
+            content.extend(chunk)
+
+        created_at = datetime.now()
+        self.files[key] = (bytes(content), created_at)
+        return StorageFile(
+            key=key,
+            url=self.get_file_url(key),
+            size=len(content),
+            created_at=created_at
+        )
+
 def get_storage_adapter() -> StorageAdapter:
     from deps import manager
 
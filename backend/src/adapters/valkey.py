@@ -0,0 +1,128 @@
+import asyncio
+import json
+import math
+import socket
+import time
+from typing import Awaitable, Callable, Dict
+
+from valkey.asyncio import BlockingConnectionPool, Connection, SSLConnection, Valkey
+from valkey.exceptions import ConnectionError
+
+from adapters.pubsub import PubSubAdapter
+from adapters.revocations import RevocationStore
+from config import config
+
+class MeteredConnectionPool(BlockingConnectionPool):
+    # Blocks for a free connection instead of opening unbounded ones, and reports how long callers waited
+    def __init__(self, stats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+        self._checked_out = set()
+
+    def make_connection(self):
+        self.stats.opened()
+        return super().make_connection()
+
+    async def get_connection(self, command_name, *keys, **options):
+        self.stats.checkout_started()
+        started = time.perf_counter()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except BaseException as e:
+            # The pool reports its own wait timeout as a ConnectionError raised from the TimeoutError
+            self.stats.checkout_failed(isinstance(e, ConnectionError) and isinstance(e.__cause__, asyncio.TimeoutError))
+            raise
+        self.stats.checked_out(time.perf_counter() - started)
+        self._checked_out.add(connection)
+        return connection
+
+    async def release(self, connection):
+        await super().release(connection)
+        # get_connection releases connections that fail their health check before handing them out
+        if connection in self._checked_out:
+            self._checked_out.discard(connection)
+            self.stats.checked_in()
+
+def create_publisher(stats) -> Valkey:
+    pool = MeteredConnectionPool(
+        stats,
+        max_connections=config.valkey_max_connections,
+        timeout=config.valkey_pool_timeout,
+        host=config.valkey_host,
+        port=config.valkey_port,
+        connection_class=SSLConnection if config.valkey_ssl else Connection,
+        decode_responses=True,
+        socket_timeout=config.valkey_socket_timeout,
+        socket_connect_timeout=config.valkey_connect_timeout,
+        socket_keepalive=True,
+    )
+    return Valkey(connection_pool=pool)
+
+def create_subscriber() -> Valkey:
+    return Valkey(
+        host=config.valkey_host,
+        port=config.valkey_port,
+        ssl=config.valkey_ssl,
+        decode_responses=True,
+        health_check_interval=0,
+        
+        socket_timeout=None,
+        socket_connect_timeout=config.valkey_connect_timeout,
+        
+        socket_keepalive=True,
+        socket_keepalive_options={
+            socket.TCP_KEEPIDLE: 15,
+            socket.TCP_KEEPINTVL: 5,
+            socket.TCP_KEEPCNT: 3,
+        }
+    )
+
+class ValkeyPubSubAdapter(PubSubAdapter):
+    def __init__(self, pub_client: Valkey, sub_client: Valkey) -> None:
+        self.pub_client = pub_client
+        self.sub_client = sub_client
+        self.pubsub = None
+        self._is_active = True
+
+    async def publish(self, channel: str, message: Dict) -> None:
+        await self.pub_client.publish(channel, json.dumps(message))
+
+    async def subscribe(self, channel: str, callback: Callable[[Dict], Awaitable[None]]) -> None:
+        self.pubsub = self.sub_client.pubsub()
+        await self.pubsub.subscribe(channel)
+
+        try:
+            async for message in self.pubsub.listen():
+                if message["type"] == "message":
+                    try:
+                        payload = json.loads(message["data"])
+                        if payload.get("intent") != "heartbeat":
+                            await callback(payload)
+                    except Exception as e:
+                        print(f"Error processing message: {e}")
+                        
+        except Exception as e:
+            print(f"Subscription connection lost: {e}")
+            raise e
+        finally:
+            if self.pubsub:
+                await self.pubsub.close()
+
+    async def close(self) -> None:
+        # The clients themselves belong to the connection layer
+        if self.pubsub:
+            await self.pubsub.close()
+
+class ValkeyRevocationStore(RevocationStore):
+    # Shared by every instance and survives their restarts; Valkey expires each entry with its token
+    def __init__(self, client: Valkey) -> None:
+        self.client = client
+
+    def _key(self, token_hash: str) -> str:
+        return f"revoked:{token_hash}"
+
+    async def revoke(self, token_hash: str, ttl: float) -> None:
+        await self.client.set(self._key(token_hash), 1, ex=max(1, math.ceil(ttl)))
+
+    async def is_revoked(self, token_hash: str) -> bool:
+        return bool(await self.client.exists(self._key(token_hash)))
@@ -1,4 +1,5 @@
 import os
+import socket
 from typing import List
 
 class Config:
@@ -6,6 +7,7 @@ class Config:
         self.environment: str = os.getenv("ENVIRONMENT", "local")
         self.cors_origins: List[str] = os.getenv("CORS_ORIGINS", "").split(",")
         self.system_key: str = os.getenv("SYSTEM_KEY", "very-secret-key")
+        self.instance_id: str = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
 
         self.tile_size: int = int(os.getenv("TILE_SIZE", 32))
         self.chunk_size: int = int(os.getenv("CHUNK_SIZE", 100))
@@ -13,31 +15,149 @@ class Config:
 
         self.mongo_uri: str = os.getenv("MONGO_URI", "mongodb://localhost:27017")
         self.mongo_db: str = os.getenv("MONGO_DB", "pixel_canvas")
+        # Explain the adapters' queries at startup and log any that still scan a whole collection
+        self.mongo_check_query_plans: bool = os.getenv("MONGO_CHECK_QUERY_PLANS", "true").lower() == "true"
+        # One client is shared by every Mongo adapter; timeouts in seconds
+        self.mongo_max_pool_size: int = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+        self.mongo_min_pool_size: int = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+        self.mongo_max_idle_time: float = float(os.getenv("MONGO_MAX_IDLE_TIME", 300))
+        self.mongo_connect_timeout: float = float(os.getenv("MONGO_CONNECT_TIMEOUT", 5))
+        self.mongo_wait_queue_timeout: float = float(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT", 10))
+        self.pending_verification_ttl: int = int(os.getenv("PENDING_VERIFICATION_TTL", 24 * 3600))
 
         self.canvas_width: int = int(os.getenv("CANVAS_WIDTH", 100))
         self.canvas_height: int = int(os.getenv("CANVAS_HEIGHT", 100))
 
+        # Served at /canvas; the other canvases, listed comma-separated in CANVASES, live at
+        # /canvases/{id}. Each instance keeps the caches of recently used canvases within a memory
+        # budget in bytes.
+        self.default_canvas_id: str = os.getenv("DEFAULT_CANVAS_ID", "main")
+        self.canvas_ids: List[str] = [self.default_canvas_id] + [c.strip() for c in os.getenv("CANVASES", "").split(",") if c.strip()]
+        self.canvas_memory_budget: int = int(os.getenv("CANVAS_MEMORY_BUDGET", 256 * 1024 * 1024))
+
         self.max_snapshots: int = int(os.getenv("MAX_SNAPSHOTS", 50))
 
+        self.timelapse_workers: int = int(os.getenv("TIMELAPSE_WORKERS", 2))
+        self.timelapse_frame_cache_size: int = int(os.getenv("TIMELAPSE_FRAME_CACHE_SIZE", 256))
+        self.timelapse_max_width: int = int(os.getenv("TIMELAPSE_MAX_WIDTH", 1024))
+        # A render still marked pending after this many seconds is taken to have died with its instance
+        self.timelapse_job_timeout: float = float(os.getenv("TIMELAPSE_JOB_TIMEOUT", 600))
+
+        self.pyramid_tile_size: int = int(os.getenv("PYRAMID_TILE_SIZE", 256))
+        self.pyramid_refresh_interval: int = int(os.getenv("PYRAMID_REFRESH_INTERVAL", 30))
+
+        # Live canvas image; a changing canvas is re-rendered at most once per interval
+        self.live_image_interval: float = float(os.getenv("LIVE_IMAGE_INTERVAL", 5))
+        self.live_image_max_age: float = float(os.getenv("LIVE_IMAGE_MAX_AGE", 300))
+        self.live_image_max_scale: float = float(os.getenv("LIVE_IMAGE_MAX_SCALE", 8))
+        self.live_image_cache_size: int = int(os.getenv("LIVE_IMAGE_CACHE_SIZE", 16))
+
+        # Append-only placement history
+        self.history_batch_size: int = int(os.getenv("HISTORY_BATCH_SIZE", 500))
+        self.history_flush_interval: float = float(os.getenv("HISTORY_FLUSH_INTERVAL", 1.0))
+        self.history_bucket_seconds: int = int(os.getenv("HISTORY_BUCKET_SECONDS", 3600))
+        self.history_checkpoint_interval: int = int(os.getenv("HISTORY_CHECKPOINT_INTERVAL", 900))
+        self.history_retention: int = int(os.getenv("HISTORY_RETENTION", 7 * 24 * 3600))
+        self.history_shutdown_timeout: float = float(os.getenv("HISTORY_SHUTDOWN_TIMEOUT", 10.0))
+
+        # Full canvas reads arriving within this many seconds of each other share one database read
+        self.canvas_state_max_age: float = float(os.getenv("CANVAS_STATE_MAX_AGE", 0.5))
+
+        self.pixel_details_cache_size: int = int(os.getenv("PIXEL_DETAILS_CACHE_SIZE", 4096))
+        self.pixel_details_cache_ttl: int = int(os.getenv("PIXEL_DETAILS_CACHE_TTL", 30))
+
+        # Token -> user lookups; logouts are propagated to every instance over pub/sub
+        self.auth_cache_size: int = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+        self.auth_cache_ttl: int = int(os.getenv("AUTH_CACHE_TTL", 60))
+        self.auth_negative_cache_ttl: int = int(os.getenv("AUTH_NEGATIVE_CACHE_TTL", 10))
+        self.auth_profile_cache_ttl: int = int(os.getenv("AUTH_PROFILE_CACHE_TTL", 300))
+
+        # Public profiles for pixel authors
+        self.user_profile_cache_size: int = int(os.getenv("USER_PROFILE_CACHE_SIZE", 10000))
+        self.user_profile_cache_ttl: int = int(os.getenv("USER_PROFILE_CACHE_TTL", 600))
+        self.user_profile_negative_cache_ttl: int = int(os.getenv("USER_PROFILE_NEGATIVE_CACHE_TTL", 300))
+        # Profiles a single POST /auth/users may look up beyond what is already cached
+        self.user_batch_max_misses: int = int(os.getenv("USER_BATCH_MAX_MISSES", 25))
+        self.user_batch_max: int = int(os.getenv("USER_BATCH_MAX", 100))
+        self.cognito_lookup_concurrency: int = int(os.getenv("COGNITO_LOOKUP_CONCURRENCY", 5))
+        # Cognito access tokens stay verifiable after sign-out, so revocations are kept until they
+        # expire; this long for tokens without an expiry claim
+        self.auth_revocation_ttl: int = int(os.getenv("AUTH_REVOCATION_TTL", 3600))
+
         self.local_storage_path: str = os.getenv("LOCAL_STORAGE_PATH", ".storage")
 
+        # Presigned downloads and direct-to-storage image uploads; local storage signs its own links
+        self.storage_signing_key: str = os.getenv("STORAGE_SIGNING_KEY") or self.system_key
+        self.signed_url_ttl: int = int(os.getenv("SIGNED_URL_TTL", 3600))
+        self.upload_url_ttl: int = int(os.getenv("UPLOAD_URL_TTL", 900))
+        self.upload_max_size: int = int(os.getenv("UPLOAD_MAX_SIZE", 20 * 1024 * 1024))
+        self.upload_status_ttl: int = int(os.getenv("UPLOAD_STATUS_TTL", 3600))
+
+        # On-demand profiling through /api/admin
+        self.profile_max_duration: float = float(os.getenv("PROFILE_MAX_DURATION", 60))
+        self.profile_min_interval: float = float(os.getenv("PROFILE_MIN_INTERVAL", 0.001))
+
+        # Event loop lag watchdog
+        self.loop_lag_interval: float = float(os.getenv("LOOP_LAG_INTERVAL", 0.1))
+        self.loop_lag_window: int = int(os.getenv("LOOP_LAG_WINDOW", 600))
+        self.loop_stall_threshold: float = float(os.getenv("LOOP_STALL_THRESHOLD", 0.25))
+        self.loop_stall_history: int = int(os.getenv("LOOP_STALL_HISTORY", 50))
+
+        # Placement-to-delivery tracing; a sample of events asks clients to ack receipt
+        self.trace_ack_sample_rate: float = float(os.getenv("TRACE_ACK_SAMPLE_RATE", 0.01))
+        self.trace_cache_size: int = int(os.getenv("TRACE_CACHE_SIZE", 10000))
+        self.trace_ack_timeout: int = int(os.getenv("TRACE_ACK_TIMEOUT", 30))
+
+        # Opt-in traffic recording for benchmarks/replay.py; empty disables it
+        self.traffic_record_dir: str = os.getenv("TRAFFIC_RECORD_DIR", "")
+        self.traffic_max_body: int = int(os.getenv("TRAFFIC_MAX_BODY", 4 * 1024 * 1024))
+        self.traffic_flush_interval: float = float(os.getenv("TRAFFIC_FLUSH_INTERVAL", 1.0))
+
         self.heartbeat_interval: int = int(os.getenv("HEARTBEAT_INTERVAL", 5))
 
+        # Shutdown drain: sockets are told to reconnect and closed spread across the window, which
+        # with the publish timeout and grace must fit inside the orchestrator's stop timeout
+        self.drain_window: float = float(os.getenv("DRAIN_WINDOW", 15))
+        self.drain_close_grace: float = float(os.getenv("DRAIN_CLOSE_GRACE", 2))
+        self.drain_publish_timeout: float = float(os.getenv("DRAIN_PUBLISH_TIMEOUT", 5))
+
+        # Bulk operations touching more pixels than this are broadcast as tile invalidations
+        self.bulk_broadcast_threshold: int = int(os.getenv("BULK_BROADCAST_THRESHOLD", 4096))
+        self.bulk_frame_interval: float = float(os.getenv("BULK_FRAME_INTERVAL", 0.05))
+
         # Valkey / ElastiCache
         self.valkey_host: str = os.getenv("VALKEY_HOST", "localhost")
         self.valkey_port: int = int(os.getenv("VALKEY_PORT", 6379))
         self.valkey_ssl: bool = os.getenv("VALKEY_SSL", "false").lower() == "true"
+        # Publishing connections; the subscriber keeps its own dedicated connection
+        self.valkey_max_connections: int = int(os.getenv("VALKEY_MAX_CONNECTIONS", 20))
+        self.valkey_pool_timeout: float = float(os.getenv("VALKEY_POOL_TIMEOUT", 5))
+        self.valkey_socket_timeout: float = float(os.getenv("VALKEY_SOCKET_TIMEOUT", 5))
+        self.valkey_connect_timeout: float = float(os.getenv("VALKEY_CONNECT_TIMEOUT", 5))
 
         # AWS
         self.aws_region: str = os.getenv("AWS_REGION", "us-east-1")
+        # Per-service HTTP pools; botocore defaults to 10 connections
+        self.aws_max_pool_connections: int = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", 50))
+        self.aws_connect_timeout: float = float(os.getenv("AWS_CONNECT_TIMEOUT", 5))
+        self.aws_read_timeout: float = float(os.getenv("AWS_READ_TIMEOUT", 30))
+        self.aws_keepalive_timeout: float = float(os.getenv("AWS_KEEPALIVE_TIMEOUT", 60))
+        self.aws_max_attempts: int = int(os.getenv("AWS_MAX_ATTEMPTS", 3))
 
         self.dynamodb_canvas_table: str = os.getenv("DYNAMODB_CANVAS_TABLE", "canvas")
+        self.dynamodb_canvas_meta_table: str = os.getenv("DYNAMODB_CANVAS_META_TABLE", "canvas-meta")
         self.dynamodb_snapshots_table: str = os.getenv("DYNAMODB_SNAPSHOTS_TABLE", "snapshots")
         self.dynamodb_snapshot_tiles_table: str = os.getenv("DYNAMODB_SNAPSHOT_TILES_TABLE", "snapshot-tiles")
+        self.dynamodb_history_table: str = os.getenv("DYNAMODB_HISTORY_TABLE", "pixel-history")
 
         self.cognito_user_pool_id: str = os.getenv("COGNITO_USER_POOL_ID", "")
         self.cognito_client_id: str = os.getenv("COGNITO_CLIENT_ID", "")
         self.cognito_client_secret: str = os.getenv("COGNITO_CLIENT_SECRET", "")
+        # Verify access tokens against the pool's JWKS instead of calling GetUser per request
+        self.cognito_local_verification: bool = os.getenv("COGNITO_LOCAL_VERIFICATION", "true").lower() == "true"
+        self.cognito_jwks_path: str = os.getenv("COGNITO_JWKS_PATH", "")
+        self.cognito_jwks_refresh_interval: int = int(os.getenv("COGNITO_JWKS_REFRESH_INTERVAL", 60))
+        self.cognito_token_leeway: int = int(os.getenv("COGNITO_TOKEN_LEEWAY", 5))
 
         self.s3_bucket_name: str = os.getenv("S3_BUCKET_NAME", "")
 
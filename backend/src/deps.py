@@ -1,11 +1,13 @@
 from typing import Optional
 from adapters.db import DBAdapter
 from adapters.auth import AuthAdapter
+from adapters.revocations import RevocationStore
 from adapters.storage import StorageAdapter
 
 class DependencyManager:
     db: Optional[DBAdapter] = None
     auth: Optional[AuthAdapter] = None
     storage: Optional[StorageAdapter] = None
+    revocations: Optional[RevocationStore] = None
 
 manager = DependencyManager()
@@ -1,54 +1,79 @@
+import asyncio
 from contextlib import asynccontextmanager
-import aioboto3
-from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect
+from typing import Dict, Optional
+from fastapi import APIRouter, FastAPI, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
-from adapters.db import DynamoDBAdapter, MongoDBAdapter
-from adapters.auth import CognitoAuthAdapter, LocalMongoAuthAdapter
-from adapters.storage import LocalFileStorageAdapter, S3StorageAdapter
-from adapters.pubsub import ValkeyPubSubAdapter
+from adapters.connections import connections
+from adapters.db import is_known_canvas
+from adapters.registry import create_adapters
 from config import config
+from routes.admin import admin_router
 from routes.auth import auth_router
-from routes.canvas import canvas_router
+from routes.canvas import canvas_router, history_router
+from routes.metrics import metrics_router
 from routes.static import static_router
+from services.canvas import invalidate_pixel_details
+from services.history import recorder as history_recorder
+from services.watchdog import watchdog
+from utils.auth import handle_token_revoked
 from wsmanager import manager as ws_manager
 from deps import manager as dep_manager
+from utils.metrics import MetricsMiddleware
+from utils.traffic import TrafficRecordingMiddleware, recorder as traffic_recorder
+
+async def _canvas_version(canvas_id: str) -> int:
+    try:
+        return (await dep_manager.db.get_canvas_version(canvas_id))["version"]
+    except Exception as e:
+        print(f"Couldn't read version of canvas {canvas_id} for drain: {e}")
+        return 0
+
+async def drain():
+    # Runs while clients are still connected; once it returns the server may drop every socket at once
+    if ws_manager.draining:
+        return
+    canvas_ids = list(ws_manager.rooms)
+    versions: Dict[str, int] = dict(zip(canvas_ids, await asyncio.gather(*map(_canvas_version, canvas_ids))))
+    await ws_manager.drain(versions)
+    await history_recorder.flush()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    session = aioboto3.Session()
-
-    pubsub_adapter = ValkeyPubSubAdapter(
-        host=config.valkey_host, 
-        port=config.valkey_port,
-        ssl=config.valkey_ssl,
-    )
-    ws_manager.init_pubsub(pubsub_adapter)
-    await ws_manager.start_listening()
-
-    match config.environment:
-        case "aws":
-            async with session.resource("dynamodb", region_name=config.aws_region) as dynamodb, \
-                session.client("cognito-idp", region_name=config.aws_region) as cognito, \
-                session.client("s3", region_name=config.aws_region) as s3:
-                dep_manager.db = DynamoDBAdapter(dynamodb)
-                dep_manager.auth = CognitoAuthAdapter(cognito)
-                dep_manager.storage = S3StorageAdapter(s3)
-
-                yield
-        case "local":
-            dep_manager.db = MongoDBAdapter()
-            dep_manager.auth = LocalMongoAuthAdapter(config.mongo_uri, config.mongo_db)
-            dep_manager.storage = LocalFileStorageAdapter(config.local_storage_path)
-
-            yield
-        case _:
-            raise ValueError(f"Unknown environment: {config.environment}")        
-
-    await ws_manager.shutdown()
+    await watchdog.start()
+    if config.traffic_record_dir:
+        await traffic_recorder.start(config.traffic_record_dir)
+
+    async with connections:
+        adapters = await create_adapters(config.environment, connections)
+
+        ws_manager.init_pubsub(adapters.pubsub)
+        ws_manager.add_listener(invalidate_pixel_details)
+        ws_manager.add_listener(handle_token_revoked)
+        await ws_manager.start_listening()
+
+        dep_manager.db = adapters.db
+        dep_manager.auth = adapters.auth
+        dep_manager.storage = adapters.storage
+        dep_manager.revocations = adapters.revocations
+
+        history_recorder.init_db(dep_manager.db)
+        await history_recorder.start()
+        yield
+        # A no-op under __main__, where the server drains before it closes connections
+        await drain()
+        await history_recorder.shutdown()
+        # Before the clients it uses are closed
+        await ws_manager.shutdown()
+
+    await traffic_recorder.shutdown()
+    await watchdog.shutdown()
 
 app = FastAPI(title="Cloud Pixel Canvas API", lifespan=lifespan)
 
+if config.traffic_record_dir:
+    app.add_middleware(TrafficRecordingMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=config.cors_origins,
@@ -64,21 +89,41 @@ async def root():
     return "Pixel Canvas API"
 
 @api_router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await ws_manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, canvas: Optional[str] = Query(None)):
+    canvas_id = canvas or config.default_canvas_id
+    if not is_known_canvas(canvas_id):
+        await websocket.close(code=1008)
+        return
+    if not await ws_manager.connect(websocket, canvas_id):
+        return
     try:
         while True:
-            # keep the connection alive; clients don't need to send data
-            await websocket.receive_text()
+            # keep the connection alive; clients only send delivery acks
+            ws_manager.handle_client_message(await websocket.receive_text())
     except WebSocketDisconnect:
-        ws_manager.disconnect(websocket)
+        ws_manager.disconnect(websocket, canvas_id)
 
 api_router.include_router(auth_router)
-api_router.include_router(canvas_router)
+# The same routes serve the default canvas at /canvas and every canvas at /canvases/{canvas_id}
+api_router.include_router(canvas_router, prefix="/canvas")
+api_router.include_router(canvas_router, prefix="/canvases/{canvas_id}")
+api_router.include_router(history_router)
+api_router.include_router(admin_router)
 
 app.include_router(api_router)
 app.include_router(static_router)
+app.include_router(metrics_router)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    class Server(uvicorn.Server):
+        async def shutdown(self, sockets=None):
+            # uvicorn closes every websocket before the lifespan shutdown runs, so drain first.
+            # The listeners close right away so the load balancer moves new connections elsewhere.
+            for server in self.servers:
+                server.close()
+            await drain()
+            await super().shutdown(sockets)
+
+    Server(uvicorn.Config(app, host="0.0.0.0", port=8000)).run()
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Literal, Optional
 from pydantic import BaseModel, Field
 
 class PixelPlacement(BaseModel):
@@ -14,6 +14,23 @@ class PixelData(BaseModel):
     userId: str
     timestamp: int
 
+class PixelCoords(BaseModel):
+    x: int = Field(..., ge=0)
+    y: int = Field(..., ge=0)
+
+class PixelDetailsRequest(BaseModel):
+    pixels: List[PixelCoords] = Field(..., min_length=1, max_length=1000)
+
+class HistoryEntry(BaseModel):
+    tile_id: str
+    timestamp: int
+    seq: int
+    # A missing colour marks a reset of the whole tile (e.g. by an overwrite)
+    x: Optional[int] = None
+    y: Optional[int] = None
+    color: Optional[str] = None
+    userId: Optional[str] = None
+
 class SnapshotResponse(BaseModel):
     snapshot_id: str
     image_url: str
@@ -22,8 +39,40 @@ class SnapshotResponse(BaseModel):
     canvas_height: int
     created_at: datetime
 
+class SnapshotCreateResponse(SnapshotResponse):
+    skipped: bool = False
+
 class SnapshotListResponse(BaseModel):
     snapshots: List[SnapshotResponse]
     total: int
     limit: int
     offset: int
+
+class TimelapseRequest(BaseModel):
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    width: int = Field(256, ge=16)
+    format: Literal["webp", "gif"] = "webp"
+    frame_duration: int = Field(200, ge=20, le=10000)
+
+class TimelapseResponse(BaseModel):
+    timelapse_id: str
+    status: Literal["pending", "ready", "failed"]
+    url: str
+    frames: Optional[int] = None
+
+class ImageUploadRequest(BaseModel):
+    content_type: str = Field(..., pattern=r"^image/[\w.+-]+$")
+    size: int = Field(..., gt=0)
+
+class ImageUploadResponse(BaseModel):
+    upload_id: str
+    url: str
+    fields: Dict[str, str]
+    expires_in: int
+
+class ImageUploadStatus(BaseModel):
+    upload_id: str
+    status: Literal["uploaded", "pending", "ready", "failed"]
+    pixels_updated: Optional[int] = None
+    error: Optional[str] = None
@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from adapters.connections import connections
+from services.profiling import ProfilerBusyError, profile_cpu, profile_memory
+from services.residency import resident_canvases
+from services.watchdog import watchdog
+from utils.auth import verify_system_key
+
+admin_router = APIRouter(prefix="/admin", dependencies=[Depends(verify_system_key)])
+
+@admin_router.get("/stalls")
+async def get_loop_stalls():
+    return {"stalls": watchdog.recent_stalls()}
+
+@admin_router.get("/pools")
+async def get_connection_pools():
+    return {"pools": connections.pool_stats()}
+
+@admin_router.get("/canvases")
+async def get_resident_canvases():
+    # Most recently used first
+    return {
+        "budget": resident_canvases.budget,
+        "bytes": resident_canvases.total_bytes,
+        "canvases": resident_canvases.stats(),
+    }
+
+@admin_router.post("/profile/cpu", response_class=PlainTextResponse)
+async def cpu_profile(
+    duration: float = Query(10, gt=0),
+    interval: float = Query(0.005, gt=0),
+    all_threads: bool = False,
+):
+    try:
+        result = await profile_cpu(duration, interval, all_threads)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return PlainTextResponse(
+        result["folded"],
+        headers={
+            "X-Profile-Samples": str(result["samples"]),
+            "X-Profile-Duration": f"{result['duration']:.3f}",
+        },
+    )
+
+@admin_router.post("/profile/memory")
+async def memory_profile(
+    duration: float = Query(10, gt=0),
+    top: int = Query(25, ge=1, le=500),
+    frames: int = Query(10, ge=1, le=100),
+):
+    try:
+        return await profile_memory(duration, top, frames)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
@@ -1,9 +1,10 @@
-from typing import Optional
+from typing import List, Optional
 from fastapi import APIRouter, Cookie, Depends, HTTPException, Response
 from pydantic import BaseModel, EmailStr, Field
 
 from adapters.auth import AuthAdapter, User, get_auth_adapter
-from utils.auth import get_token, get_current_user as auth_get_current_user
+from services.users import UserProfileService, get_user_profile_service
+from utils.auth import get_token, get_current_user as auth_get_current_user, revoke_cached_token
 from config import config
 
 auth_router = APIRouter(prefix="/auth")
@@ -24,6 +25,16 @@ class LoginRequest(BaseModel):
 class RefreshRequest(BaseModel):
     email: EmailStr
 
+class UsersRequest(BaseModel):
+    user_ids: List[str] = Field(..., min_length=1, max_length=config.user_batch_max)
+
+def _public_profile(user: User) -> dict:
+    return {
+        "user_id": user.user_id,
+        "username": user.username,
+        "created_at": user.created_at
+    }
+
 @auth_router.post("/register")
 async def register(request: RegisterRequest, auth: AuthAdapter = Depends(get_auth_adapter)):
     try:
@@ -82,6 +93,7 @@ async def refresh(
     response: Response, 
     request: RefreshRequest, 
     refresh_token: Optional[str] = Cookie(default=None, alias="refresh_token"), 
+    auth_token: Optional[str] = Depends(get_token),
     auth: AuthAdapter = Depends(get_auth_adapter)
 ):
     if not refresh_token:
@@ -89,6 +101,9 @@ async def refresh(
     
     try:
         user, token = await auth.refresh_token(request.email, refresh_token)
+        if auth_token and auth_token != token.access_token:
+            # The local adapter invalidates the previous access token on refresh
+            await revoke_cached_token(auth_token)
         
         response.set_cookie(
             key="auth_token",
@@ -129,6 +144,7 @@ async def refresh(
 async def logout(response: Response, auth_token: Optional[str] = Depends(get_token), auth: AuthAdapter = Depends(get_auth_adapter)):
     if auth_token:
         await auth.logout(auth_token)
+        await revoke_cached_token(auth_token)
 
     response.delete_cookie(key="auth_token")
     response.delete_cookie(key="refresh_token", path="/api/auth")
@@ -139,13 +155,21 @@ async def get_current_user(user: User = Depends(auth_get_current_user)):
     return user
     
 @auth_router.get("/user/{id}")
-async def get_user_by_id(id: str, auth: AuthAdapter = Depends(get_auth_adapter)):
-    user = await auth.get_user_by_id(id)
+async def get_user_by_id(id: str, users: UserProfileService = Depends(get_user_profile_service)):
+    user = await users.get_user(id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    return _public_profile(user)
+
+@auth_router.post("/users")
+async def get_users_by_ids(
+    request: UsersRequest,
+    current_user: User = Depends(auth_get_current_user),
+    users: UserProfileService = Depends(get_user_profile_service),
+):
+    # Ids that didn't fit in this request's lookups are missing from the response; ask again for them
+    found = await users.get_users(request.user_ids, max_misses=config.user_batch_max_misses)
     return {
-        "user_id": user.user_id,
-        "username": user.username,
-        "created_at": user.created_at
+        "users": {user_id: _public_profile(user) if user else None for user_id, user in found.items()}
     }
@@ -1,20 +1,102 @@
 from io import BytesIO
-from fastapi import APIRouter, Depends, File, HTTPException, Response, UploadFile
+from typing import List, Optional
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Path, Query, Response, UploadFile
 from PIL import Image
 
 from adapters.auth import User
-from adapters.db import DBAdapter, get_db_adapter
+from adapters.db import DBAdapter, get_db_adapter, snapshot_canvas
 from adapters.storage import StorageAdapter, get_storage_adapter
 from config import config
-from services.canvas import CanvasService, get_canvas_service
+from services.canvas import CanvasService, get_canvas_id, get_canvas_service
+from services.history import HistoryService, get_history_service
+from services.live_image import cache_headers
+from services.pyramid import public_manifest
+from services.timelapse import TimelapseService, get_timelapse_service
+from services.uploads import ImageUploadService, get_image_upload_service
 from utils.auth import get_current_user, verify_system_key
-from models import PixelPlacement, SnapshotListResponse, SnapshotResponse
+from models import ImageUploadRequest, ImageUploadResponse, ImageUploadStatus, PixelDetailsRequest, PixelPlacement, SnapshotCreateResponse, SnapshotListResponse, SnapshotResponse, TimelapseRequest, TimelapseResponse
 
-canvas_router = APIRouter(prefix="/canvas")
+# Mounted once per canvas path prefix, see main.py
+canvas_router = APIRouter()
+# History is only kept for the default canvas
+history_router = APIRouter(prefix="/canvas")
 
 @canvas_router.get("/")
 async def get_canvas(canvas: CanvasService = Depends(get_canvas_service)):
-    return await canvas.get_canvas_state()
+    return Response(await canvas.get_canvas_state_body(), media_type="application/json")
+
+@canvas_router.get("/tiles")
+async def get_canvas_tiles(ids: List[str] = Query(..., max_length=1024), canvas: CanvasService = Depends(get_canvas_service)):
+    return await canvas.get_canvas_tiles(ids)
+
+@canvas_router.get("/image.{fmt}")
+async def get_live_image(
+    fmt: str = Path(..., pattern="^(png|webp)$"),
+    scale: float = Query(1, gt=0),
+    if_none_match: Optional[str] = Header(None),
+    canvas: CanvasService = Depends(get_canvas_service),
+):
+    if scale > config.live_image_max_scale:
+        raise HTTPException(status_code=400, detail=f"Scale can be at most {config.live_image_max_scale}")
+
+    image = await canvas.get_live_image(fmt, scale)
+    headers = cache_headers(image)
+    if if_none_match and image.etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(image.body, media_type=image.media_type, headers=headers)
+
+@canvas_router.get("/pixel/{x}/{y}")
+async def get_pixel_details(x: int, y: int, canvas: CanvasService = Depends(get_canvas_service)):
+    try:
+        details = await canvas.get_pixel_details([(x, y)])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    pixel = details[f"{x}_{y}"]
+    if not pixel:
+        raise HTTPException(status_code=404, detail="Pixel not placed")
+    return pixel
+
+@canvas_router.post("/pixel/batch")
+async def get_pixel_details_batch(request: PixelDetailsRequest, canvas: CanvasService = Depends(get_canvas_service)):
+    try:
+        details = await canvas.get_pixel_details([(p.x, p.y) for p in request.pixels])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"pixels": details}
+
+@canvas_router.get("/pyramid")
+async def get_live_pyramid(canvas: CanvasService = Depends(get_canvas_service)):
+    return public_manifest(await canvas.get_live_pyramid())
+
+@history_router.get("/history")
+async def get_canvas_history(
+    at: int = Query(..., ge=0),
+    x: int = Query(0, ge=0),
+    y: int = Query(0, ge=0),
+    width: Optional[int] = Query(None, ge=1),
+    height: Optional[int] = Query(None, ge=1),
+    history: HistoryService = Depends(get_history_service),
+):
+    region = None
+    if width is not None or height is not None or x or y:
+        w = min(width or config.canvas_width, config.canvas_width - x)
+        h = min(height or config.canvas_height, config.canvas_height - y)
+        if w <= 0 or h <= 0:
+            raise HTTPException(status_code=400, detail="Region out of bounds")
+        region = (x, y, w, h)
+
+    try:
+        return await history.reconstruct(at, region)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@history_router.post("/history/compact")
+async def compact_history(
+    system_key: str = Depends(verify_system_key),
+    history: HistoryService = Depends(get_history_service),
+):
+    return await history.compact()
 
 @canvas_router.post("/")
 async def place_pixel(pixel: PixelPlacement, user: User = Depends(get_current_user), canvas: CanvasService = Depends(get_canvas_service)):
@@ -24,36 +106,46 @@ async def place_pixel(pixel: PixelPlacement, user: User = Depends(get_current_us
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@canvas_router.get("/activity")
+async def get_activity(
+    system_key: str = Depends(verify_system_key),
+    canvas: CanvasService = Depends(get_canvas_service),
+):
+    return await canvas.get_activity()
+
 @canvas_router.post("/snapshot")
 async def create_snapshot(
+    if_changed: bool = False,
     system_key: str = Depends(verify_system_key),
     canvas: CanvasService = Depends(get_canvas_service),
 ):
-    result = await canvas.create_snapshot()
+    result = await canvas.create_snapshot(if_changed=if_changed)
 
-    return SnapshotResponse(
+    return SnapshotCreateResponse(
         snapshot_id=result["snapshot_id"],
         image_url=result["image_url"],
         thumbnail_url=result["thumbnail_url"],
         canvas_width=config.canvas_width,
         canvas_height=config.canvas_height,
-        created_at=result["created_at"]
+        created_at=result["created_at"],
+        skipped=result["skipped"],
     )
 
 @canvas_router.get("/snapshot")
 async def list_snapshots(
     limit: int = 20,
     offset: int = 0,
+    canvas_id: str = Depends(get_canvas_id),
     db: DBAdapter = Depends(get_db_adapter),
     storage: StorageAdapter = Depends(get_storage_adapter)
 ):
-    snapshots = await db.get_snapshots(limit, offset)
-    total = await db.get_snapshot_count()
+    snapshots = await db.get_snapshots(canvas_id, limit, offset)
+    total = await db.get_snapshot_count(canvas_id)
 
     snapshot_responses = []
     for snapshot in snapshots:
-        image_url = storage.get_file_url(snapshot["image_key"])
-        thumbnail_url = storage.get_file_url(snapshot["thumbnail_key"])
+        image_url = await storage.get_signed_url(snapshot["image_key"], config.signed_url_ttl)
+        thumbnail_url = await storage.get_signed_url(snapshot["thumbnail_key"], config.signed_url_ttl)
 
         snapshot_responses.append(SnapshotResponse(
             snapshot_id=snapshot["snapshot_id"],
@@ -72,14 +164,26 @@ async def list_snapshots(
     )
 
 @canvas_router.get("/snapshot/{snapshot_id}/download")
-async def download_snapshot(snapshot_id: str, storage: StorageAdapter = Depends(get_storage_adapter), db: DBAdapter = Depends(get_db_adapter)):
+async def download_snapshot(
+    snapshot_id: str,
+    canvas_id: str = Depends(get_canvas_id),
+    storage: StorageAdapter = Depends(get_storage_adapter),
+    db: DBAdapter = Depends(get_db_adapter),
+):
     snapshot = await db.get_snapshot_by_id(snapshot_id)
-    if not snapshot:
+    if not snapshot or snapshot_canvas(snapshot) != canvas_id:
         raise HTTPException(status_code=404, detail="Snapshot not found")
     
-    image_url = storage.get_file_url(snapshot["image_key"])
+    image_url = await storage.get_signed_url(snapshot["image_key"], config.signed_url_ttl)
     return {"download_url": image_url}
 
+@canvas_router.get("/snapshot/{snapshot_id}/pyramid")
+async def get_snapshot_pyramid(snapshot_id: str, canvas: CanvasService = Depends(get_canvas_service)):
+    manifest = await canvas.get_snapshot_pyramid(snapshot_id)
+    if not manifest:
+        raise HTTPException(status_code=404, detail="Snapshot pyramid not found")
+    return manifest
+
 @canvas_router.post("/snapshot/{snapshot_id}/restore")
 async def restore_snapshot(
     snapshot_id: str,
@@ -88,7 +192,7 @@ async def restore_snapshot(
     db: DBAdapter = Depends(get_db_adapter)
 ):
     snapshot = await db.get_snapshot_by_id(snapshot_id)
-    if not snapshot:
+    if not snapshot or snapshot_canvas(snapshot) != canvas.canvas_id:
         raise HTTPException(status_code=404, detail="Snapshot not found")
     
     pixels = snapshot["pixels"]
@@ -96,6 +200,41 @@ async def restore_snapshot(
 
     return Response(status_code=200)
 
+@canvas_router.post("/timelapse")
+async def create_timelapse(
+    request: TimelapseRequest,
+    response: Response,
+    user: User = Depends(get_current_user),
+    timelapse: TimelapseService = Depends(get_timelapse_service),
+):
+    if request.width > config.timelapse_max_width:
+        raise HTTPException(status_code=400, detail=f"Width must be at most {config.timelapse_max_width}")
+
+    try:
+        result = await timelapse.create_timelapse(
+            start=request.start,
+            end=request.end,
+            width=request.width,
+            fmt=request.format,
+            frame_duration=request.frame_duration,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if result["status"] == "pending":
+        response.status_code = 202
+    return TimelapseResponse(**result)
+
+@canvas_router.get("/timelapse/{timelapse_id}")
+async def get_timelapse(
+    timelapse_id: str = Path(..., pattern=r"^[0-9a-f]{24}\.(webp|gif)$"),
+    timelapse: TimelapseService = Depends(get_timelapse_service),
+):
+    result = await timelapse.get_timelapse_status(timelapse_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Timelapse not found")
+    return TimelapseResponse(**result)
+
 @canvas_router.post("/overwrite")
 async def overwrite_with_image(
     file: UploadFile = File(...),
@@ -107,25 +246,42 @@ async def overwrite_with_image(
     
     contents = await file.read()
     img = Image.open(BytesIO(contents))
+    pixels = canvas.image_to_pixels(img)
 
-    if img.mode != "RGB":
-        img = img.convert("RGB")
-
-    img = img.resize((config.canvas_width, config.canvas_height), Image.Resampling.LANCZOS)
-    pixels = {}
+    result = await canvas.bulk_place_pixels(pixels, user.user_id)
 
-    for y in range(config.canvas_height):
-        for x in range(config.canvas_width):
-            r, g, b = img.getpixel((x, y)) # type: ignore
-            color = f"#{r:02x}{g:02x}{b:02x}"
-            pixel_key = f"{x}_{y}"
+    return {"pixels_updated": result["pixels_updated"]}
 
-            pixels[pixel_key] = {
-                "x": x,
-                "y": y,
-                "color": color,
-            }
+@canvas_router.post("/overwrite/upload", response_model=ImageUploadResponse)
+async def create_image_upload(
+    request: ImageUploadRequest,
+    user: User = Depends(get_current_user),
+    uploads: ImageUploadService = Depends(get_image_upload_service),
+):
+    # The client posts the image straight to storage, then asks for it to be applied
+    try:
+        return await uploads.create_upload(user.user_id, request.content_type, request.size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    result = await canvas.bulk_place_pixels(pixels, user.user_id)
+@canvas_router.post("/overwrite/upload/{upload_id}", response_model=ImageUploadStatus, status_code=202)
+async def apply_image_upload(
+    upload_id: str = Path(..., pattern=r"^[0-9a-f]{32}$"),
+    user: User = Depends(get_current_user),
+    uploads: ImageUploadService = Depends(get_image_upload_service),
+):
+    result = await uploads.apply_upload(user.user_id, upload_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return result
 
-    return {"pixels_updated": result["pixels_updated"]}
+@canvas_router.get("/overwrite/upload/{upload_id}", response_model=ImageUploadStatus)
+async def get_image_upload(
+    upload_id: str = Path(..., pattern=r"^[0-9a-f]{32}$"),
+    user: User = Depends(get_current_user),
+    uploads: ImageUploadService = Depends(get_image_upload_service),
+):
+    result = await uploads.get_status(user.user_id, upload_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return result
@@ -1,13 +1,69 @@
+import mimetypes
 from pathlib import Path
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from typing import Optional
+from fastapi import APIRouter, Form, HTTPException, Query, Response, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
 
+from adapters.storage import PUBLIC_PREFIXES, STREAM_CHUNK_SIZE, get_storage_adapter, verify_signature
 from config import config
 
 static_router = APIRouter(prefix="/static")
 
+async def _serve_from_memory(file_path: str) -> StreamingResponse:
+    chunks = get_storage_adapter().open_read(file_path)
+    # Pull the first chunk here so a missing file is still a 404 rather than a broken stream
+    try:
+        first = await anext(chunks)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    except StopAsyncIteration:
+        first = b""
+
+    async def _body():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    media_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    return StreamingResponse(_body(), media_type=media_type)
+
+@static_router.post("/upload", status_code=204)
+async def receive_upload(
+    file: UploadFile,
+    key: str = Form(...),
+    content_type: str = Form(..., alias="Content-Type"),
+    max_size: int = Form(...),
+    expires: int = Form(...),
+    signature: str = Form(...),
+):
+    # Stands in for an S3 POST policy when storage is local or in memory
+    if config.environment not in ("local", "memory"):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not verify_signature(signature, expires, "POST", key, content_type, max_size):
+        raise HTTPException(status_code=403, detail="Invalid or expired upload")
+    if file.content_type != content_type:
+        raise HTTPException(status_code=400, detail="Content type doesn't match the upload")
+    if not file.size or file.size > max_size:
+        raise HTTPException(status_code=413, detail="File is empty or too large")
+
+    async def _chunks():
+        while chunk := await file.read(STREAM_CHUNK_SIZE):
+            yield chunk
+
+    await get_storage_adapter().open_write(key, _chunks())
+    return Response(status_code=204)
+
 @static_router.get("/{file_path:path}")
-async def serve_static_file(file_path: str):
+async def serve_static_file(file_path: str, expires: Optional[int] = Query(None), signature: Optional[str] = Query(None)):
+    # Like a presigned URL: a signed link must be valid, and only public prefixes can be read without one
+    if signature is not None and not verify_signature(signature, expires or 0, "GET", file_path):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+    if signature is None and not file_path.startswith(PUBLIC_PREFIXES):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if config.environment == "memory":
+        return await _serve_from_memory(file_path)
+
     if not config.is_local():
         raise HTTPException(status_code=404, detail="Not found")
     
@@ -23,9 +79,7 @@ async def serve_static_file(file_path: str):
         if not resolved_path.exists() or not resolved_path.is_file():
             raise HTTPException(status_code=404, detail="File not found")
         
-        media_type = "application/octet-stream"
-        if resolved_path.suffix.lower() == ".png":
-            media_type = "image/png"
+        media_type = mimetypes.guess_type(resolved_path.name)[0] or "application/octet-stream"
         
         return FileResponse(resolved_path, media_type=media_type)
     except Exception as e:
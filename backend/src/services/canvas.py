@@ -1,41 +1,157 @@
+import asyncio
 from collections import defaultdict
 from datetime import datetime
 from io import BytesIO
-from typing import Dict
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
 import uuid
 
-from fastapi import Depends
+from fastapi import Depends, HTTPException, Request
 from PIL import Image
 
-from adapters.db import DBAdapter, get_db_adapter
+from adapters.db import DBAdapter, canvas_tile_ids, get_db_adapter, is_known_canvas, tile_key
 from adapters.storage import StorageAdapter, get_storage_adapter
 from models import PixelData
+from services import live_image
+from services.history import recorder as history
+from services.pyramid import LIVE_PYRAMID_ID, PyramidService
+from services.residency import resident_canvases
 from config import config
+from utils import tracing
+from utils.metrics import Counter, registry
 from wsmanager import manager as websocket
 
+canvas_state_reads = registry.register(Counter(
+    "canvas_state_reads_total", "Full canvas reads by whether they hit the database or shared another read", ("source",),
+))
+
+async def invalidate_pixel_details(message: Dict):
+    # Placements on any instance reach us through the shared broadcast channel
+    intent = message.get("intent")
+    if intent not in ("pixel", "bulk_update", "bulk_overwrite", "tiles_invalidated"):
+        return
+    resident = resident_canvases.peek(message.get("canvas_id") or config.default_canvas_id)
+    if resident is None:
+        return
+
+    payload = message.get("payload") or {}
+    resident.live_image.mark_changed()
+    if intent == "pixel":
+        resident.pixel_details.delete(f"{payload['x']}_{payload['y']}")
+    elif intent == "bulk_update":
+        resident.pixel_details.delete_many(payload.get("pixels", {}).keys())
+    else:
+        resident.pixel_details.clear()
+        # Single pixels are left to the socket stream, but a large change shouldn't be served stale
+        resident.state.forget("state")
+
+def _encode_state(state: Dict) -> bytes:
+    # Same output as FastAPI's JSONResponse
+    return json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
 
 class CanvasService:
-    def __init__(self, db: DBAdapter, storage: StorageAdapter):
+    def __init__(self, db: DBAdapter, storage: StorageAdapter, canvas_id: str = config.default_canvas_id):
         self.db = db
         self.storage = storage
+        self.canvas_id = canvas_id
+        self.pyramid = PyramidService(storage)
+        self.resident = resident_canvases.get(canvas_id)
+        # Placement history is only kept for the default canvas; snapshots and timelapses work for every canvas
+        self.keeps_history = canvas_id == config.default_canvas_id
 
     def _validate_bounds(self, x: int, y: int):
         if not 0 <= x < config.canvas_width or not 0 <= y < config.canvas_height:
             raise ValueError(f"Pixel coords out of bounds: ({x}, {y})")
         
-    def _create_canvas_image(self, pixels: Dict[str, PixelData], width: int, height: int) -> Image.Image:
+    def _create_canvas_image(self, colors: Dict[str, str], width: int, height: int) -> Image.Image:
         img = Image.new("RGB", (width, height), color="#ffffff")
-        for pixel in pixels.values():
-            color_rgb = tuple(int(pixel.color.lstrip("#")[i:i+2], 16) for i in (0, 2, 4))
-            img.putpixel((pixel.x, pixel.y), color_rgb)
+        for key, color in colors.items():
+            x, y = (int(v) for v in key.split("_"))
+            color_rgb = tuple(int(color.lstrip("#")[i:i+2], 16) for i in (0, 2, 4))
+            img.putpixel((x, y), color_rgb)
         return img
 
+    def image_to_pixels(self, img: Image.Image) -> Dict[str, Dict]:
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        img = img.resize((config.canvas_width, config.canvas_height), Image.Resampling.LANCZOS)
+        pixels = {}
+
+        for y in range(config.canvas_height):
+            for x in range(config.canvas_width):
+                r, g, b = img.getpixel((x, y)) # type: ignore
+                color = f"#{r:02x}{g:02x}{b:02x}"
+                pixel_key = f"{x}_{y}"
+
+                pixels[pixel_key] = {
+                    "x": x,
+                    "y": y,
+                    "color": color,
+                }
+        return pixels
+
+    def _group_by_tile(self, pixels: Iterable[PixelData]) -> Dict[str, Dict[str, PixelData]]:
+        grouped = defaultdict(dict)
+        for p in pixels:
+            tx = p.x // config.tile_size
+            ty = p.y // config.tile_size
+            grouped[f"{tx}_{ty}"][f"{p.x}_{p.y}"] = p
+        return grouped
+
+    def _snapshot_tiles(self, pixels_map: Dict[str, PixelData]) -> List[Dict]:
+        tiles_payload = []
+        grouped = self._group_by_tile(pixels_map.values())
+            
+        for tile_id, tile_pixels in grouped.items():
+            tiles_payload.append({
+                "canvas_id": tile_key(self.canvas_id, tile_id),
+                "pixels": {k: p.model_dump() for k, p in tile_pixels.items()}
+            })
+        return tiles_payload
+
+    async def _broadcast_bulk(self, intent: str, pixels: List[PixelData], version: int, extra: Dict, trace: Dict):
+        grouped = self._group_by_tile(pixels)
+
+        if len(pixels) > config.bulk_broadcast_threshold:
+            # Too big to push to every socket; tell clients which tiles to re-fetch instead
+            await websocket.broadcast({
+                "canvas_id": self.canvas_id,
+                "intent": "tiles_invalidated",
+                "payload": {
+                    "tiles": sorted(grouped.keys()),
+                    "version": version,
+                    "reset": intent == "bulk_overwrite",
+                    **extra,
+                },
+                "trace": trace,
+            })
+            return
+
+        frames = []
+        for i, tile_pixels in enumerate(grouped.values() or [{}]):
+            frames.append({
+                "canvas_id": self.canvas_id,
+                # Only the first frame of an overwrite clears the client's canvas
+                "intent": intent if i == 0 else "bulk_update",
+                "payload": {
+                    # Clients only draw colours; who placed what is fetched on demand
+                    "pixels": {k: p.color for k, p in tile_pixels.items()},
+                    "version": version,
+                    **extra,
+                },
+                "trace": trace,
+            })
+        websocket.broadcast_stream(frames, config.bulk_frame_interval)
+
     def _create_thumbnail(self, img: Image.Image, max_size: int = 200) -> Image.Image:
         img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
         return img
 
     async def place_pixel(self, x: int, y: int, color: str, user_id: str) -> PixelData:
         self._validate_bounds(x, y)
+        trace = tracing.new_trace()
         
         pixel = PixelData(
             x=x, 
@@ -45,19 +161,27 @@ class CanvasService:
             timestamp=int(datetime.now().timestamp())
         )
         
-        result = await self.db.update_pixel(pixel)
+        version = await self.db.update_pixel(self.canvas_id, pixel)
+        tracing.observe(trace, "pixel", "db_write")
+        if self.keeps_history:
+            history.record_pixels([pixel])
+        self.resident.pixel_details.delete(f"{x}_{y}")
         try:
             await websocket.broadcast({
+                "canvas_id": self.canvas_id,
                 "intent": "pixel",
-                "payload": result.model_dump()
+                "payload": {"x": pixel.x, "y": pixel.y, "color": pixel.color, "version": version},
+                "trace": trace,
             })
+            tracing.observe(trace, "pixel", "published")
         except Exception as e:
             print(f"WebSocket broadcast failed: {e}")
         
-        return result
+        return pixel
     
     async def bulk_place_pixels(self, pixels_map: Dict[str, Dict], user_id: str) -> Dict:
         timestamp = int(datetime.now().timestamp())
+        trace = tracing.new_trace()
         
         pixel_objects = []
         for p_data in pixels_map.values():
@@ -65,19 +189,14 @@ class CanvasService:
             p_data["timestamp"] = timestamp
             pixel_objects.append(PixelData(**p_data))
 
-        await self.db.bulk_update_canvas(pixel_objects)
+        version = await self.db.bulk_update_canvas(self.canvas_id, pixel_objects)
+        tracing.observe(trace, "bulk_update", "db_write")
+        if self.keeps_history:
+            history.record_pixels(pixel_objects)
+        self.resident.pixel_details.delete_many(f"{p.x}_{p.y}" for p in pixel_objects)
 
         try:
-            broadcast_payload = {
-                f"{p.x}_{p.y}": p.model_dump() for p in pixel_objects
-            }
-            await websocket.broadcast({
-                "intent": "bulk_update",
-                "payload": {
-                    "pixels": broadcast_payload,
-                    "user_id": user_id
-                }
-            })
+            await self._broadcast_bulk("bulk_update", pixel_objects, version, {"user_id": user_id}, trace)
         except Exception as e:
             print(f"WebSocket broadcast failed: {e}")
         
@@ -88,37 +207,156 @@ class CanvasService:
 
     async def bulk_overwrite(self, pixels_dict: Dict[str, Dict]) -> None:
         pixel_objects = [PixelData(**p) for p in pixels_dict.values()]
+        timestamp = int(datetime.now().timestamp())
+        trace = tracing.new_trace()
         
-        await self.db.bulk_overwrite_canvas(pixel_objects)
+        version = await self.db.bulk_overwrite_canvas(self.canvas_id, pixel_objects)
+        tracing.observe(trace, "bulk_overwrite", "db_write")
+        if self.keeps_history:
+            history.record_reset(canvas_tile_ids(), timestamp)
+            history.record_pixels(pixel_objects, timestamp)
+        self.resident.pixel_details.clear()
 
         try:
-            await websocket.broadcast({
-                "intent": "bulk_overwrite",
-                "payload": {
-                    "pixels": pixels_dict,
-                }
-            })
+            await self._broadcast_bulk("bulk_overwrite", pixel_objects, version, {}, trace)
         except Exception as e:
             print(f"WebSocket broadcast failed: {e}")
 
     async def get_canvas_state(self) -> Dict:
-        pixels_data = await self.db.get_canvas_state()
-        pixels_serializable = {k: v.model_dump() for k, v in pixels_data.items()}
-
+        # Read before the pixels, so the pixels are at least this new; clients drop events up to it
+        version = await self.db.get_canvas_version(self.canvas_id)
         state = {
             "canvas_width": config.canvas_width,
             "canvas_height": config.canvas_height,
-            "pixels": pixels_serializable,
+            "version": version["version"],
+            "pixels": await self.db.get_canvas_colors(self.canvas_id),
         }
         return state
+
+    async def get_canvas_state_body(self) -> bytes:
+        # Concurrent page loads share one database read and one encoded body
+        body, source = await self.resident.state.get("state", self._load_canvas_state_body)
+        canvas_state_reads.inc(source=source)
+        if source == "loaded":
+            resident_canvases.account(self.resident)
+        return body
+
+    async def _load_canvas_state_body(self) -> bytes:
+        state = await self.get_canvas_state()
+        body = await asyncio.to_thread(_encode_state, state)
+        self.resident.state_bytes = len(body)
+        return body
+
+    async def get_canvas_tiles(self, tile_ids: List[str]) -> Dict:
+        version = await self.db.get_canvas_version(self.canvas_id)
+        return {
+            "tiles": tile_ids,
+            "version": version["version"],
+            "pixels": await self.db.get_canvas_tiles(self.canvas_id, tile_ids),
+        }
+
+    async def get_pixel_details(self, coords: List[Tuple[int, int]]) -> Dict[str, Optional[PixelData]]:
+        for x, y in coords:
+            self._validate_bounds(x, y)
+
+        result: Dict[str, Optional[PixelData]] = {}
+        missing = []
+        for x, y in coords:
+            key = f"{x}_{y}"
+            hit, pixel = self.resident.pixel_details.lookup(key)
+            if hit:
+                result[key] = pixel
+            else:
+                missing.append(key)
+
+        if missing:
+            found = await self.db.get_pixel_details(self.canvas_id, missing)
+            for key in missing:
+                # Unplaced pixels are cached too, hovering over empty canvas is the common case
+                pixel = found.get(key)
+                self.resident.pixel_details.set(key, pixel)
+                result[key] = pixel
+            resident_canvases.account(self.resident)
+
+        return result
     
-    async def create_snapshot(self) -> Dict:
-        pixels_map = await self.db.get_canvas_state()
+    async def _render_live_image(self) -> Image.Image:
+        colors = await self.db.get_canvas_colors(self.canvas_id)
+        return await asyncio.to_thread(self._create_canvas_image, colors, config.canvas_width, config.canvas_height)
+
+    async def get_live_image(self, fmt: str, scale: float) -> live_image.LiveImage:
+        image = await self.resident.live_image.get(fmt, scale, self._render_live_image)
+        resident_canvases.account(self.resident)
+        return image
+
+    async def get_live_pyramid(self) -> Dict:
+        manifest = await self.pyramid.get_live_manifest(self.resident.pyramid, self._render_live_image)
+        resident_canvases.account(self.resident)
+        return manifest
+
+    async def get_snapshot_pyramid(self, snapshot_id: str) -> Optional[Dict]:
+        if snapshot_id.startswith(LIVE_PYRAMID_ID):
+            return None
+        manifest = await self.pyramid.get_manifest(snapshot_id)
+        # Pyramids built before canvases had ids belong to the default canvas
+        if not manifest or manifest.get("canvas_id", config.default_canvas_id) != self.canvas_id:
+            return None
+        return await self.pyramid.signed_manifest(manifest)
+
+    async def _get_latest_snapshot(self) -> Optional[Dict]:
+        snapshots = await self.db.get_snapshots(self.canvas_id, limit=1, offset=0)
+        return snapshots[0] if snapshots else None
+
+    async def get_activity(self) -> Dict:
+        now = int(datetime.now().timestamp())
+        version, latest = await asyncio.gather(self.db.get_canvas_version(self.canvas_id), self._get_latest_snapshot())
+
+        last_snapshot_at = None
+        # Snapshots taken before the version counter existed count every placement as new
+        snapshot_version = 0
+        if latest:
+            created_at = latest["created_at"]
+            if isinstance(created_at, str):
+                created_at = datetime.fromisoformat(created_at)
+            last_snapshot_at = int(created_at.timestamp())
+            snapshot_version = int(latest.get("canvas_version") or 0)
+
+        return {
+            "now": now,
+            "version": version["version"],
+            "last_modified": version["last_modified"],
+            "changes_since_snapshot": max(0, version["version"] - snapshot_version),
+            "last_snapshot_at": last_snapshot_at,
+        }
+
+    async def create_snapshot(self, if_changed: bool = False) -> Dict:
+        # Read before the canvas, so a write that lands during the read bumps the version
+        # past the one recorded here and the next conditional snapshot picks it up
+        version = await self.db.get_canvas_version(self.canvas_id)
+
+        if if_changed:
+            latest = await self._get_latest_snapshot()
+            if latest and latest.get("canvas_version") is not None and int(latest["canvas_version"]) == version["version"]:
+                return {
+                    "snapshot_id": latest["snapshot_id"],
+                    "image_url": await self.storage.get_signed_url(latest["image_key"], config.signed_url_ttl),
+                    "thumbnail_url": await self.storage.get_signed_url(latest["thumbnail_key"], config.signed_url_ttl),
+                    "created_at": latest["created_at"],
+                    "skipped": True,
+                }
+
+        pixels_map = await self.db.get_canvas_state(self.canvas_id)
 
         snapshot_id = str(uuid.uuid4())
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-        img = self._create_canvas_image(pixels_map, config.canvas_width, config.canvas_height)
+        colors = {k: p.color for k, p in pixels_map.items()}
+        img = self._create_canvas_image(colors, config.canvas_width, config.canvas_height)
+
+        try:
+            await self.pyramid.build(snapshot_id, img, canvas_id=self.canvas_id)
+        except Exception as e:
+            print(f"Snapshot pyramid generation failed: {e}")
         
         img_buffer = BytesIO()
         img.save(img_buffer, format="PNG")
@@ -132,32 +370,31 @@ class CanvasService:
         thumbnail_key = f"snapshots/{snapshot_id}_{timestamp}_thumb.png"
         await self.storage.upload_file(thumbnail_key, thumb_buffer)
 
-        meta = await self.db.create_snapshot_metadata(snapshot_id, image_key, thumbnail_key)
+        meta = await self.db.create_snapshot_metadata(self.canvas_id, snapshot_id, image_key, thumbnail_key, version["last_modified"], version["version"])
         
-        tiles_payload = []
-        grouped = defaultdict(dict)
-        for p in pixels_map.values():
-            tx = p.x // config.tile_size
-            ty = p.y // config.tile_size
-            grouped[f"{tx}_{ty}"][f"{p.x}_{p.y}"] = p.model_dump()
-            
-        for tile_id, p_dict in grouped.items():
-            tiles_payload.append({
-                "canvas_id": f"main#{tile_id}",
-                "pixels": p_dict
-            })
-            
-        await self.db.create_snapshot_tiles(snapshot_id, tiles_payload)
+        await self.db.create_snapshot_tiles(snapshot_id, self._snapshot_tiles(pixels_map))
 
-        image_url = self.storage.get_file_url(image_key)
-        thumbnail_url = self.storage.get_file_url(thumbnail_key)
+        image_url = await self.storage.get_signed_url(image_key, config.signed_url_ttl)
+        thumbnail_url = await self.storage.get_signed_url(thumbnail_key, config.signed_url_ttl)
 
         return {
             "snapshot_id": snapshot_id,
             "image_url": image_url,
             "thumbnail_url": thumbnail_url,
-            "created_at": meta["created_at"]
+            "created_at": meta["created_at"],
+            "skipped": False,
         }
     
-def get_canvas_service(db: DBAdapter = Depends(get_db_adapter), storage: StorageAdapter = Depends(get_storage_adapter)) -> CanvasService:
-    return CanvasService(db, storage)
+def get_canvas_id(request: Request) -> str:
+    # Canvas routes are mounted at /canvas for the default canvas and at /canvases/{canvas_id}
+    canvas_id = request.path_params.get("canvas_id", config.default_canvas_id)
+    if not is_known_canvas(canvas_id):
+        raise HTTPException(status_code=404, detail="Canvas not found")
+    return canvas_id
+
+def get_canvas_service(
+    canvas_id: str = Depends(get_canvas_id),
+    db: DBAdapter = Depends(get_db_adapter),
+    storage: StorageAdapter = Depends(get_storage_adapter),
+) -> CanvasService:
+    return CanvasService(db, storage, canvas_id)
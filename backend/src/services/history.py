@@ -0,0 +1,236 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Depends
+
+from adapters.db import DBAdapter, Region, canvas_tile_ids, get_db_adapter
+from models import HistoryEntry, PixelData
+from config import config
+
+# Snapshots record the newest tile modification they contain; entries older than this
+# before the snapshot was taken are already part of it
+SNAPSHOT_REPLAY_MARGIN = 300
+
+def _tile_id(x: int, y: int) -> str:
+    return f"{x // config.tile_size}_{y // config.tile_size}"
+
+def _to_epoch(value) -> int:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+class HistoryRecorder:
+    def __init__(self):
+        self.db: Optional[DBAdapter] = None
+        self._buffer: List[HistoryEntry] = []
+        self._last_seq = 0
+        self._wakeup = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def init_db(self, db: DBAdapter):
+        self.db = db
+
+    async def start(self):
+        if not self.db:
+            raise RuntimeError("Database adapter not initialized")
+
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def _next_seq(self) -> int:
+        # Strictly increasing within this process, roughly ordered across instances
+        self._last_seq = max(self._last_seq + 1, time.time_ns())
+        return self._last_seq
+
+    def _append(self, entry: HistoryEntry):
+        self._buffer.append(entry)
+        if len(self._buffer) >= config.history_batch_size:
+            self._wakeup.set()
+
+    def record_pixels(self, pixels: Iterable[PixelData], timestamp: Optional[int] = None):
+        for p in pixels:
+            self._append(HistoryEntry(
+                tile_id=_tile_id(p.x, p.y),
+                timestamp=timestamp if timestamp is not None else p.timestamp,
+                seq=self._next_seq(),
+                x=p.x,
+                y=p.y,
+                color=p.color,
+                userId=p.userId,
+            ))
+
+    def record_reset(self, tile_ids: Iterable[str], timestamp: int):
+        for tile_id in tile_ids:
+            self._append(HistoryEntry(tile_id=tile_id, timestamp=timestamp, seq=self._next_seq()))
+
+    async def flush(self):
+        if not self.db:
+            return
+
+        while self._buffer:
+            batch = self._buffer[:config.history_batch_size]
+            self._buffer = self._buffer[config.history_batch_size:]
+            try:
+                await self.db.append_history(batch)
+            except asyncio.CancelledError:
+                self._buffer = batch + self._buffer
+                raise
+            except Exception as e:
+                print(f"History flush failed, retrying later: {e}")
+                # Keep the entries for the next attempt, but don't grow without bound
+                limit = config.history_batch_size * 100
+                self._buffer = (batch + self._buffer)[-limit:]
+                return
+
+    async def _flush_loop(self):
+        while not self._stopping:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=config.history_flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                if self._stopping:
+                    break
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"History flush loop error: {e}")
+                await asyncio.sleep(1)
+
+    async def shutdown(self):
+        # Let a write already under way finish; cancelling it mid-write would lose its batch
+        self._stopping = True
+        self._wakeup.set()
+        if self._flush_task:
+            done, _ = await asyncio.wait([self._flush_task], timeout=config.history_shutdown_timeout)
+            if not done:
+                # Stuck on the database; a cancelled write puts its batch back for the last flush
+                self._flush_task.cancel()
+                await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+recorder = HistoryRecorder()
+
+class HistoryService:
+    # Placement history is kept for the default canvas only
+    def __init__(self, db: DBAdapter):
+        self.db = db
+        self.canvas_id = config.default_canvas_id
+
+    async def _find_snapshot_base(self, at: int) -> Optional[Dict]:
+        page_size = 50
+        offset = 0
+        while True:
+            snapshots = await self.db.get_snapshots(self.canvas_id, limit=page_size, offset=offset)
+            for snapshot in snapshots:
+                created_at = _to_epoch(snapshot["created_at"])
+                if created_at > at:
+                    continue
+                since = created_at - SNAPSHOT_REPLAY_MARGIN
+                if snapshot.get("canvas_last_modified") is not None:
+                    since = max(int(snapshot["canvas_last_modified"]), since)
+                return {"snapshot_id": snapshot["snapshot_id"], "since": since}
+            if len(snapshots) < page_size:
+                return None
+            offset += page_size
+
+    async def _load_base(self, at: int, tile_ids: List[str]) -> Tuple[Dict, Dict[str, Dict]]:
+        checkpoint = await self.db.get_history_checkpoint(at, tile_ids)
+        snapshot = await self._find_snapshot_base(at)
+
+        if snapshot and (not checkpoint or snapshot["since"] > checkpoint["timestamp"]):
+            data = await self.db.get_snapshot_by_id(snapshot["snapshot_id"])
+            if data:
+                base = {"type": "snapshot", "id": snapshot["snapshot_id"], "timestamp": snapshot["since"]}
+                return base, dict(data.get("pixels", {}))
+
+        if checkpoint:
+            return {"type": "checkpoint", "timestamp": checkpoint["timestamp"]}, dict(checkpoint["pixels"])
+
+        raise ValueError("No history available at the requested time")
+
+    def _replay(self, pixels: Dict[str, Dict], entries: List[HistoryEntry]):
+        for entry in entries:
+            if entry.color is None:
+                tx, ty = (int(v) for v in entry.tile_id.split("_"))
+                for y in range(ty * config.tile_size, (ty + 1) * config.tile_size):
+                    for x in range(tx * config.tile_size, (tx + 1) * config.tile_size):
+                        pixels.pop(f"{x}_{y}", None)
+            else:
+                pixels[f"{entry.x}_{entry.y}"] = {
+                    "x": entry.x,
+                    "y": entry.y,
+                    "color": entry.color,
+                    "userId": entry.userId,
+                    "timestamp": entry.timestamp,
+                }
+
+    async def _reconstruct_pixels(self, at: int, tile_ids: List[str]) -> Tuple[Dict, Dict[str, Dict], int]:
+        # Placements past the retention are gone (or partly gone while DynamoDB's TTL catches
+        # up), so replaying them onto a base would give a canvas that never existed
+        if at < int(time.time()) - config.history_retention:
+            raise ValueError("Requested time is older than the kept history")
+        base, pixels = await self._load_base(at, tile_ids)
+        # The base timestamp is inclusive; re-applying entries it already contains is harmless
+        entries = await self.db.get_history(base["timestamp"], at, tile_ids)
+        self._replay(pixels, entries)
+        return base, pixels, len(entries)
+
+    async def reconstruct(self, at: int, region: Optional[Region] = None) -> Dict:
+        tile_ids = canvas_tile_ids(region)
+        base, pixels, replayed = await self._reconstruct_pixels(at, tile_ids)
+
+        if region:
+            x, y, w, h = region
+            pixels = {
+                k: p for k, p in pixels.items()
+                if x <= p["x"] < x + w and y <= p["y"] < y + h
+            }
+
+        return {
+            "at": at,
+            "canvas_width": config.canvas_width,
+            "canvas_height": config.canvas_height,
+            "region": list(region) if region else None,
+            "base": base,
+            "replayed": replayed,
+            "pixels": pixels,
+        }
+
+    async def compact(self) -> Dict:
+        now = int(time.time())
+        # Leave room for batches still sitting in other instances' buffers
+        target = now - max(60, int(config.history_flush_interval * 10))
+        tile_ids = canvas_tile_ids()
+
+        result = {"checkpoint": None, "deleted": 0}
+
+        latest = await self.db.get_history_checkpoint(target, tile_ids)
+        if not latest or target - latest["timestamp"] >= config.history_checkpoint_interval:
+            try:
+                _, pixels, _ = await self._reconstruct_pixels(target, tile_ids)
+            except ValueError:
+                # Nothing to replay from yet; seed the log with the live canvas
+                target = now
+                live = await self.db.get_canvas_state(self.canvas_id)
+                pixels = {k: p.model_dump() for k, p in live.items()}
+
+            tiles: Dict[str, Dict[str, Dict]] = defaultdict(dict)
+            for tile_id in tile_ids:
+                tiles[tile_id] = {}
+            for key, p in pixels.items():
+                tiles[_tile_id(p["x"], p["y"])][key] = p
+
+            await self.db.save_history_checkpoint(target, tiles)
+            result["checkpoint"] = target
+
+        result["deleted"] = await self.db.delete_history(now - config.history_retention)
+        return result
+
+def get_history_service(db: DBAdapter = Depends(get_db_adapter)) -> HistoryService:
+    return HistoryService(db)
@@ -0,0 +1,102 @@
+import asyncio
+import hashlib
+from io import BytesIO
+import math
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from PIL import Image
+
+from config import config
+from utils.cache import SingleFlight, TTLCache
+
+FORMATS = {
+    "png": ("PNG", "image/png", {}),
+    # Lossless keeps single pixels crisp and is usually smaller than PNG for canvas art
+    "webp": ("WEBP", "image/webp", {"lossless": True}),
+}
+
+class LiveImage:
+    __slots__ = ("body", "media_type", "etag", "generation", "rendered_at")
+
+    def __init__(self, body: bytes, media_type: str, generation: int, rendered_at: float):
+        self.body = body
+        self.media_type = media_type
+        self.etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+        self.generation = generation
+        self.rendered_at = rendered_at
+
+def output_size(scale: float) -> Tuple[int, int]:
+    return (
+        max(1, round(config.canvas_width * scale)),
+        max(1, round(config.canvas_height * scale)),
+    )
+
+def _encode(img: Image.Image, size: Tuple[int, int], fmt: str) -> bytes:
+    if img.size != size:
+        # Nearest keeps pixels square when enlarging; box averages them when shrinking
+        grow = size[0] >= img.width
+        img = img.resize(size, Image.Resampling.NEAREST if grow else Image.Resampling.BOX)
+    pil_format, _, options = FORMATS[fmt]
+    buffer = BytesIO()
+    img.save(buffer, format=pil_format, **options)
+    return buffer.getvalue()
+
+class LiveImageCache:
+    # One canvas's renders. Change events bump the generation; renders remember the one they were made from.
+    def __init__(self):
+        self.generation = 0
+        self._base: Optional[Tuple[int, float, Image.Image]] = None
+        self._renders: TTLCache[LiveImage] = TTLCache(config.live_image_cache_size, config.live_image_max_age)
+        self._base_flight: SingleFlight[Tuple[int, float, Image.Image]] = SingleFlight(0)
+        self._render_flight: SingleFlight[LiveImage] = SingleFlight(0)
+
+    def mark_changed(self):
+        self.generation += 1
+
+    def _fresh(self, generation: int, rendered_at: float) -> bool:
+        # Changing canvases are re-rendered at most once per interval. Unchanged ones are kept up to
+        # the max age in case a change event was missed.
+        age = time.monotonic() - rendered_at
+        if age < config.live_image_interval:
+            return True
+        return generation == self.generation and age < config.live_image_max_age
+
+    async def _load_base(self, render: Callable[[], Awaitable[Image.Image]]) -> Tuple[int, float, Image.Image]:
+        if self._base and self._fresh(self._base[0], self._base[1]):
+            return self._base
+
+        generation = self.generation
+        img = await render()
+        self._base = (generation, time.monotonic(), img)
+        return self._base
+
+    async def get(self, fmt: str, scale: float, render: Callable[[], Awaitable[Image.Image]]) -> LiveImage:
+        size = output_size(scale)
+        key = (fmt, size)
+        cached = self._renders.get(key)
+        if cached and self._fresh(cached.generation, cached.rendered_at):
+            return cached
+
+        async def _render() -> LiveImage:
+            # Every size and format is cut from one full-resolution render of the same generation
+            generation, rendered_at, img = (await self._base_flight.get("live", lambda: self._load_base(render)))[0]
+            body = await asyncio.to_thread(_encode, img, size, fmt)
+            image = LiveImage(body, FORMATS[fmt][1], generation, rendered_at)
+            self._renders.set(key, image)
+            return image
+
+        return (await self._render_flight.get(key, _render))[0]
+
+    def nbytes(self) -> int:
+        size = sum(len(image.body) for image in self._renders.values() if image)
+        if self._base:
+            img = self._base[2]
+            size += img.width * img.height * len(img.getbands())
+        return size
+
+def cache_headers(image: LiveImage) -> Dict[str, str]:
+    return {
+        "ETag": image.etag,
+        "Cache-Control": f"public, max-age={math.ceil(config.live_image_interval)}",
+    }
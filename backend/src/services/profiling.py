@@ -0,0 +1,108 @@
+import asyncio
+from collections import Counter
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from config import config
+
+_lock = asyncio.Lock()
+
+class ProfilerBusyError(Exception):
+    pass
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})"
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    # Folded stacks (flamegraph.pl, speedscope) go root first, separated by semicolons
+    return ";".join(reversed(stack))
+
+def _sample(thread_ids: Optional[List[int]], interval: float, stop: threading.Event, stacks: Counter):
+    own_id = threading.get_ident()
+    while not stop.wait(interval):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or (thread_ids and thread_id not in thread_ids):
+                continue
+            stacks[_collapse(frame)] += 1
+
+async def _exclusive():
+    if _lock.locked():
+        raise ProfilerBusyError("Another profile is already running")
+    await _lock.acquire()
+
+async def profile_cpu(duration: float, interval: float, all_threads: bool = False) -> Dict:
+    # Samples stacks from a side thread, so it sees the event loop even while it is blocked
+    await _exclusive()
+    try:
+        duration = min(duration, config.profile_max_duration)
+        interval = max(interval, config.profile_min_interval)
+
+        stacks: Counter = Counter()
+        stop = threading.Event()
+        thread_ids = None if all_threads else [threading.get_ident()]
+        sampler = threading.Thread(target=_sample, args=(thread_ids, interval, stop, stacks), daemon=True)
+
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+
+        return {
+            "duration": time.perf_counter() - started,
+            "samples": sum(stacks.values()),
+            "folded": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+        }
+    finally:
+        _lock.release()
+
+async def profile_memory(duration: float, top: int, frames: int) -> Dict:
+    await _exclusive()
+    try:
+        duration = min(duration, config.profile_max_duration)
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(frames)
+
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(duration)
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+
+        # Ignore the profiler's own bookkeeping
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        diff = await asyncio.to_thread(
+            lambda: after.filter_traces(filters).compare_to(before.filter_traces(filters), "traceback")
+        )
+
+        return {
+            "duration": duration,
+            "traced_current": current,
+            "traced_peak": peak,
+            "top": [
+                {
+                    "size_diff": stat.size_diff,
+                    "size": stat.size,
+                    "count_diff": stat.count_diff,
+                    "count": stat.count,
+                    "traceback": stat.traceback.format(),
+                }
+                for stat in diff[:top]
+            ],
+        }
+    finally:
+        _lock.release()
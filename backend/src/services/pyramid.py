@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+from io import BytesIO
+import json
+import math
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from adapters.storage import StorageAdapter
+from config import config
+
+LIVE_PYRAMID_ID = "live"
+
+# Tiles are stored under their content hash, so a changed tile gets a new URL and no cache can
+# serve a stale one. Pyramids built before that kept one key per position.
+TILE_PATH = "{z}/{x}_{y}.{v}.png"
+LEGACY_TILE_PATH = "{z}/{x}_{y}.png"
+
+def _tile_path(manifest: Dict, tile_key: str, digest: str) -> str:
+    z, position = tile_key.split("/")
+    x, y = position.split("_")
+    path = TILE_PATH if manifest.get("tile_path") == TILE_PATH else LEGACY_TILE_PATH
+    return path.format(z=z, x=x, y=y, v=digest)
+
+def live_pyramid_id(canvas_id: str) -> str:
+    # The default canvas keeps the id it had before there were others
+    return LIVE_PYRAMID_ID if canvas_id == config.default_canvas_id else f"{LIVE_PYRAMID_ID}-{canvas_id}"
+
+class LivePyramid:
+    # One canvas's live pyramid as this instance last built or read it
+    def __init__(self, canvas_id: str):
+        self.canvas_id = canvas_id
+        self.pyramid_id = live_pyramid_id(canvas_id)
+        self.manifest: Optional[Dict] = None
+        self.refreshed_at = 0.0
+        self.refresh_task: Optional[asyncio.Task] = None
+
+def _build_levels(img: Image.Image, tile_size: int) -> List[Image.Image]:
+    # Index 0 is the most zoomed-out level (fits in a single tile), the last one is full resolution
+    levels = [img]
+    while levels[-1].width > tile_size or levels[-1].height > tile_size:
+        prev = levels[-1]
+        size = (max(1, math.ceil(prev.width / 2)), max(1, math.ceil(prev.height / 2)))
+        levels.append(prev.resize(size, Image.Resampling.BOX))
+    levels.reverse()
+    return levels
+
+def _cut_tiles(levels: List[Image.Image], tile_size: int) -> Dict[str, Tuple[Image.Image, str]]:
+    tiles = {}
+    for z, level in enumerate(levels):
+        for ty in range(math.ceil(level.height / tile_size)):
+            for tx in range(math.ceil(level.width / tile_size)):
+                box = (
+                    tx * tile_size,
+                    ty * tile_size,
+                    min(level.width, (tx + 1) * tile_size),
+                    min(level.height, (ty + 1) * tile_size),
+                )
+                tile = level.crop(box)
+                digest = hashlib.blake2b(tile.tobytes(), digest_size=8).hexdigest()
+                tiles[f"{z}/{tx}_{ty}"] = (tile, digest)
+    return tiles
+
+def _render_pyramid(img: Image.Image, tile_size: int, previous_hashes: Dict[str, str]) -> Tuple[List[Dict], Dict[str, str], List[Tuple[str, bytes]]]:
+    levels = _build_levels(img, tile_size)
+    tiles = _cut_tiles(levels, tile_size)
+
+    hashes = {}
+    changed = []
+    for tile_key, (tile, digest) in tiles.items():
+        hashes[tile_key] = digest
+        if previous_hashes.get(tile_key) == digest:
+            continue
+        buffer = BytesIO()
+        tile.save(buffer, format="PNG")
+        changed.append((tile_key, buffer.getvalue()))
+
+    level_info = [
+        {
+            "z": z,
+            "width": level.width,
+            "height": level.height,
+            "columns": math.ceil(level.width / tile_size),
+            "rows": math.ceil(level.height / tile_size),
+        }
+        for z, level in enumerate(levels)
+    ]
+    return level_info, hashes, changed
+
+class PyramidService:
+    def __init__(self, storage: StorageAdapter):
+        self.storage = storage
+
+    def _prefix(self, pyramid_id: str) -> str:
+        return f"pyramids/{pyramid_id}"
+
+    def _manifest_key(self, pyramid_id: str) -> str:
+        return f"{self._prefix(pyramid_id)}/manifest.json"
+
+    async def get_manifest(self, pyramid_id: str) -> Optional[Dict]:
+        try:
+            data = await self.storage.download_file(self._manifest_key(pyramid_id))
+        except FileNotFoundError:
+            return None
+        return json.loads(data)
+
+    async def build(self, pyramid_id: str, img: Image.Image, previous: Optional[Dict] = None, canvas_id: Optional[str] = None) -> Dict:
+        tile_size = config.pyramid_tile_size
+        previous = previous or {}
+        previous_hashes = {}
+        if previous.get("tile_size") == tile_size and previous.get("tile_path") == TILE_PATH:
+            previous_hashes = previous.get("tiles", {})
+
+        level_info, hashes, changed = await asyncio.get_running_loop().run_in_executor(
+            None, _render_pyramid, img.copy(), tile_size, previous_hashes
+        )
+
+        prefix = self._prefix(pyramid_id)
+        manifest = {
+            "pyramid_id": pyramid_id,
+            "canvas_id": canvas_id or config.default_canvas_id,
+            "tile_size": tile_size,
+            "width": img.width,
+            "height": img.height,
+            "levels": level_info,
+            "tile_path": TILE_PATH,
+            "url_template": self.storage.get_file_url(f"{prefix}/") + TILE_PATH,
+            "tiles": hashes,
+            "generated_at": int(time.time()),
+        }
+        paths = {_tile_path(manifest, k, d) for k, d in hashes.items()}
+        sem = asyncio.Semaphore(config.chunk_write_concurrency)
+
+        async def _upload(tile_key: str, data: bytes):
+            async with sem:
+                await self.storage.upload_file(f"{prefix}/{_tile_path(manifest, tile_key, hashes[tile_key])}", BytesIO(data))
+
+        async def _delete(path: str):
+            async with sem:
+                try:
+                    await self.storage.delete_file(f"{prefix}/{path}")
+                except Exception as e:
+                    print(f"Couldn't delete pyramid tile {prefix}/{path}: {e}")
+
+        await asyncio.gather(*[_upload(k, d) for k, d in changed])
+
+        # Tiles this build replaces stay until the next one, so clients holding the previous
+        # manifest can still load them; the ones the previous build replaced go now
+        manifest["retired"] = sorted(
+            {_tile_path(previous, k, d) for k, d in previous.get("tiles", {}).items()} - paths
+        )
+        await self.storage.upload_file(
+            self._manifest_key(pyramid_id),
+            BytesIO(json.dumps(manifest).encode()),
+        )
+        await asyncio.gather(*[_delete(p) for p in set(previous.get("retired", [])) - paths])
+        return manifest
+
+    async def signed_manifest(self, manifest: Dict) -> Dict:
+        # Snapshot pyramids are private like the snapshots themselves, so each tile gets its own link
+        prefix = self._prefix(manifest["pyramid_id"])
+        tile_urls = {}
+        for tile_key, digest in manifest.get("tiles", {}).items():
+            path = _tile_path(manifest, tile_key, digest)
+            tile_urls[tile_key] = await self.storage.get_signed_url(f"{prefix}/{path}", config.signed_url_ttl)
+        signed = {k: v for k, v in manifest.items() if k not in ("url_template", "tile_path", "tiles", "retired")}
+        return {**signed, "tile_urls": tile_urls}
+
+    async def _refresh_live(self, live: LivePyramid, render: Callable[[], Awaitable[Image.Image]]) -> Dict:
+        img = await render()
+
+        # Another instance may have refreshed the shared pyramid since we last looked
+        previous = await self.get_manifest(live.pyramid_id) or live.manifest
+        live.manifest = await self.build(live.pyramid_id, img, previous, live.canvas_id)
+        live.refreshed_at = time.monotonic()
+        return live.manifest
+
+    async def get_live_manifest(self, live: LivePyramid, render: Callable[[], Awaitable[Image.Image]]) -> Dict:
+        if live.manifest and time.monotonic() - live.refreshed_at < config.pyramid_refresh_interval:
+            return live.manifest
+
+        # Concurrent requests wait on the same refresh instead of rebuilding in parallel
+        if live.refresh_task is None or live.refresh_task.done():
+            live.refresh_task = asyncio.create_task(self._refresh_live(live, render))
+        return await asyncio.shield(live.refresh_task)
+
+def public_manifest(manifest: Dict) -> Dict:
+    # Tile hashes stay in: they fill the {v} of the url template
+    return {k: v for k, v in manifest.items() if k != "retired"}
@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config import config
+from models import PixelData
+from services.live_image import LiveImageCache
+from services.pyramid import LivePyramid
+from utils.cache import SingleFlight, TTLCache
+from utils.metrics import Counter, Gauge, registry
+
+# Rough sizes for caches that hold Python objects rather than bytes
+PIXEL_DETAILS_ENTRY_BYTES = 512
+PYRAMID_TILE_ENTRY_BYTES = 128
+RESIDENT_OVERHEAD_BYTES = 16 * 1024
+
+canvas_evictions = registry.register(Counter(
+    "resident_canvas_evictions_total", "Canvases whose caches were dropped to stay within the memory budget",
+))
+
+class ResidentCanvas:
+    # Everything this instance caches for one canvas; dropping it frees all of it at once
+    def __init__(self, canvas_id: str):
+        self.canvas_id = canvas_id
+        self.state: SingleFlight[bytes] = SingleFlight(config.canvas_state_max_age)
+        self.state_bytes = 0
+        self.pixel_details: TTLCache[PixelData] = TTLCache(config.pixel_details_cache_size, config.pixel_details_cache_ttl)
+        self.live_image = LiveImageCache()
+        self.pyramid = LivePyramid(canvas_id)
+
+    def nbytes(self) -> int:
+        size = RESIDENT_OVERHEAD_BYTES + self.state_bytes + self.live_image.nbytes()
+        size += len(self.pixel_details) * PIXEL_DETAILS_ENTRY_BYTES
+        if self.pyramid.manifest:
+            size += len(self.pyramid.manifest.get("tiles", {})) * PYRAMID_TILE_ENTRY_BYTES
+        return size
+
+class ResidentCanvases:
+    # Recently used canvases, least recently used first. Entries are created empty on first use and
+    # fill lazily; once the estimated total passes the budget the oldest are dropped.
+    def __init__(self, budget: int):
+        self.budget = budget
+        self._canvases: OrderedDict[str, ResidentCanvas] = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+
+    def get(self, canvas_id: str) -> ResidentCanvas:
+        resident = self._canvases.get(canvas_id)
+        if resident is None:
+            resident = self._canvases[canvas_id] = ResidentCanvas(canvas_id)
+        self._canvases.move_to_end(canvas_id)
+        self.account(resident)
+        return resident
+
+    def peek(self, canvas_id: str) -> Optional[ResidentCanvas]:
+        # For change events: a canvas that isn't resident has nothing to invalidate
+        return self._canvases.get(canvas_id)
+
+    def account(self, resident: ResidentCanvas):
+        # Caches grow when their loads finish, so callers re-measure after loading. Only the entry
+        # being used is measured; the others can only have shrunk since.
+        if self._canvases.get(resident.canvas_id) is not resident:
+            return
+        size = resident.nbytes()
+        self.total_bytes += size - self._sizes.get(resident.canvas_id, 0)
+        self._sizes[resident.canvas_id] = size
+
+        while self.total_bytes > self.budget and len(self._canvases) > 1:
+            canvas_id, _ = self._canvases.popitem(last=False)
+            self.total_bytes -= self._sizes.pop(canvas_id, 0)
+            canvas_evictions.inc()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {"canvas_id": canvas_id, "bytes": self._sizes.get(canvas_id, 0)}
+            for canvas_id in reversed(self._canvases)
+        ]
+
+    def __len__(self) -> int:
+        return len(self._canvases)
+
+resident_canvases = ResidentCanvases(config.canvas_memory_budget)
+
+registry.register(Gauge("resident_canvases", "Canvases with caches on this instance", callback=lambda: len(resident_canvases)))
+registry.register(Gauge(
+    "resident_canvas_bytes", "Estimated memory held by resident canvas caches", callback=lambda: resident_canvases.total_bytes,
+))
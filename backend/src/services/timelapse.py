@@ -0,0 +1,240 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import hashlib
+from io import BytesIO
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Depends
+from PIL import Image
+
+from adapters.db import DBAdapter, get_db_adapter
+from adapters.storage import StorageAdapter, get_storage_adapter, iter_file
+from config import config
+from services.canvas import get_canvas_id
+
+TIMELAPSE_FORMATS = {"webp": "WEBP", "gif": "GIF"}
+
+FrameKey = Tuple[str, int, int]
+
+class FrameCache:
+    def __init__(self, max_frames: int):
+        self.max_frames = max_frames
+        self._frames: OrderedDict[FrameKey, Image.Image] = OrderedDict()
+
+    def get(self, key: FrameKey) -> Optional[Image.Image]:
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+        return frame
+
+    def put(self, key: FrameKey, frame: Image.Image):
+        self._frames[key] = frame
+        self._frames.move_to_end(key)
+        while len(self._frames) > self.max_frames:
+            self._frames.popitem(last=False)
+
+# Shared across requests so overlapping ranges reuse frames that were already decoded
+_frame_cache = FrameCache(config.timelapse_frame_cache_size)
+_executor = ThreadPoolExecutor(max_workers=config.timelapse_workers, thread_name_prefix="timelapse")
+_jobs: Dict[str, asyncio.Task] = {}
+
+def _decode_frame(data: bytes, size: Tuple[int, int]) -> Image.Image:
+    with Image.open(BytesIO(data)) as img:
+        img = img.convert("RGB")
+        if img.size == size:
+            return img
+        # Keep pixel edges crisp when upscaling, average them out when shrinking
+        upscaling = size[0] >= img.width
+        resample = Image.Resampling.NEAREST if upscaling else Image.Resampling.BOX
+        return img.resize(size, resample)
+
+def _encode_timelapse(frames: List[Image.Image], fmt: str, frame_duration: int) -> BytesIO:
+    buffer = BytesIO()
+    options = {"lossless": True} if fmt == "webp" else {"optimize": False}
+    frames[0].save(
+        buffer,
+        format=TIMELAPSE_FORMATS[fmt],
+        save_all=True,
+        append_images=frames[1:],
+        duration=frame_duration,
+        loop=0,
+        **options,
+    )
+    buffer.seek(0)
+    return buffer
+
+def _naive(value: datetime) -> datetime:
+    # Snapshots are stamped with naive local times, so aware values are converted to match
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+def _parse_created_at(value) -> datetime:
+    return _naive(datetime.fromisoformat(value) if isinstance(value, str) else value)
+
+class TimelapseService:
+    def __init__(self, db: DBAdapter, storage: StorageAdapter, canvas_id: str = config.default_canvas_id):
+        self.db = db
+        self.storage = storage
+        self.canvas_id = canvas_id
+
+    async def _get_snapshots_in_range(self, start: Optional[datetime], end: Optional[datetime]) -> List[Dict]:
+        total = await self.db.get_snapshot_count(self.canvas_id)
+        snapshots = await self.db.get_snapshots(self.canvas_id, limit=max(total, 1), offset=0)
+
+        start = _naive(start) if start else None
+        end = _naive(end) if end else None
+        selected = []
+        for snapshot in snapshots:
+            created_at = _parse_created_at(snapshot["created_at"])
+            if start and created_at < start:
+                continue
+            if end and created_at > end:
+                continue
+            selected.append({**snapshot, "created_at": created_at})
+
+        selected.sort(key=lambda s: s["created_at"])
+        return selected
+
+    def _get_timelapse_key(self, snapshots: List[Dict], width: int, fmt: str, frame_duration: int) -> str:
+        digest = hashlib.sha256()
+        for snapshot in snapshots:
+            digest.update(snapshot["snapshot_id"].encode())
+        digest.update(f"|{width}|{frame_duration}".encode())
+        return f"timelapses/{digest.hexdigest()[:24]}.{fmt}"
+
+    async def _load_frame(self, snapshot: Dict, size: Tuple[int, int]) -> Image.Image:
+        key = (snapshot["snapshot_id"], size[0], size[1])
+        frame = _frame_cache.get(key)
+        if frame is not None:
+            return frame
+
+        data = await self.storage.download_file(snapshot["image_key"])
+        frame = await asyncio.get_running_loop().run_in_executor(_executor, _decode_frame, data, size)
+        _frame_cache.put(key, frame)
+        return frame
+
+    async def _render(self, key: str, snapshots: List[Dict], size: Tuple[int, int], fmt: str, frame_duration: int):
+        # Only a small window of encoded snapshots is downloaded at any time; the decoded,
+        # scaled frames are what the animated encoders need to hold
+        window = config.timelapse_workers * 2
+        pending: OrderedDict[int, asyncio.Task] = OrderedDict()
+        frames: List[Image.Image] = []
+
+        try:
+            for i, snapshot in enumerate(snapshots):
+                pending[i] = asyncio.create_task(self._load_frame(snapshot, size))
+                if len(pending) >= window:
+                    _, task = pending.popitem(last=False)
+                    frames.append(await task)
+            while pending:
+                _, task = pending.popitem(last=False)
+                frames.append(await task)
+        finally:
+            for task in pending.values():
+                task.cancel()
+
+        buffer = await asyncio.get_running_loop().run_in_executor(
+            _executor, _encode_timelapse, frames, fmt, frame_duration
+        )
+        await self.storage.open_write(key, iter_file(buffer))
+
+    def _status_key(self, key: str) -> str:
+        return f"{key}.status"
+
+    async def _read_status(self, key: str) -> Optional[Dict]:
+        # Written by whichever instance renders, so any instance can answer a poll
+        try:
+            status = json.loads(await self.storage.download_file(self._status_key(key)))
+        except FileNotFoundError:
+            return None
+        if status["status"] == "pending" and time.time() - status["started_at"] > config.timelapse_job_timeout:
+            return {"status": "failed"}
+        return status
+
+    async def _write_status(self, key: str, status: Dict):
+        await self.storage.upload_file(self._status_key(key), BytesIO(json.dumps(status).encode()))
+
+    async def _run(self, key: str, snapshots: List[Dict], size: Tuple[int, int], fmt: str, frame_duration: int):
+        try:
+            await self._write_status(key, {"status": "pending", "started_at": time.time()})
+            await self._render(key, snapshots, size, fmt, frame_duration)
+        except Exception as e:
+            print(f"Timelapse {key} failed: {e}")
+            status = {"status": "failed"}
+        else:
+            status = None
+
+        try:
+            if status:
+                await self._write_status(key, status)
+            else:
+                # The output itself now says ready
+                await self.storage.delete_file(self._status_key(key))
+        except Exception as e:
+            print(f"Couldn't record status of timelapse {key}: {e}")
+
+    async def create_timelapse(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        width: int = 256,
+        fmt: str = "webp",
+        frame_duration: int = 200,
+    ) -> Dict:
+        if fmt not in TIMELAPSE_FORMATS:
+            raise ValueError(f"Unsupported timelapse format: {fmt}")
+
+        snapshots = await self._get_snapshots_in_range(start, end)
+        if not snapshots:
+            raise ValueError("No snapshots in the requested range")
+
+        key = self._get_timelapse_key(snapshots, width, fmt, frame_duration)
+        result = {
+            "timelapse_id": key.split("/", 1)[1],
+            "frames": len(snapshots),
+            "url": await self.storage.get_signed_url(key, config.signed_url_ttl),
+        }
+
+        if await self.storage.file_exists(key):
+            return {**result, "status": "ready"}
+        if key in _jobs:
+            return {**result, "status": "pending"}
+
+        # Another instance may already be rendering it; failed or abandoned renders are retried
+        status = await self._read_status(key)
+        if status and status["status"] == "pending":
+            return {**result, "status": "pending"}
+        # Checked again, since reading the status gave other requests a chance to start the job
+        if key not in _jobs:
+            first = snapshots[0]
+            height = max(1, round(width * first["canvas_height"] / first["canvas_width"]))
+            task = asyncio.create_task(self._run(key, snapshots, (width, height), fmt, frame_duration))
+            _jobs[key] = task
+            task.add_done_callback(lambda t: _jobs.pop(key, None))
+
+        return {**result, "status": "pending"}
+
+    async def get_timelapse_status(self, timelapse_id: str) -> Optional[Dict]:
+        key = f"timelapses/{timelapse_id}"
+        result = {"timelapse_id": timelapse_id, "url": await self.storage.get_signed_url(key, config.signed_url_ttl)}
+
+        if await self.storage.file_exists(key):
+            return {**result, "status": "ready"}
+        if key in _jobs:
+            return {**result, "status": "pending"}
+
+        status = await self._read_status(key)
+        if status is None:
+            return None
+        return {**result, "status": status["status"]}
+
+def get_timelapse_service(
+    canvas_id: str = Depends(get_canvas_id),
+    db: DBAdapter = Depends(get_db_adapter),
+    storage: StorageAdapter = Depends(get_storage_adapter),
+) -> TimelapseService:
+    # Timelapse ids are derived from snapshot ids, which are unique across canvases
+    return TimelapseService(db, storage, canvas_id)
@@ -0,0 +1,118 @@
+import asyncio
+from io import BytesIO
+import json
+from typing import Dict, Optional
+import uuid
+
+from fastapi import Depends
+from PIL import Image
+
+from adapters.storage import StorageAdapter, get_storage_adapter
+from config import config
+from services.canvas import CanvasService, get_canvas_service
+from utils.cache import TTLCache
+
+# Clients upload straight to storage; the API only reads the object back when asked to apply it
+UPLOAD_PREFIX = "uploads"
+
+_jobs: Dict[str, asyncio.Task] = {}
+_results: TTLCache[Dict] = TTLCache(10000, config.upload_status_ttl)
+
+def _decode(data: bytes, canvas: CanvasService) -> Dict[str, Dict]:
+    img = Image.open(BytesIO(data))
+    return canvas.image_to_pixels(img)
+
+class ImageUploadService:
+    def __init__(self, canvas: CanvasService, storage: StorageAdapter):
+        self.canvas = canvas
+        self.storage = storage
+
+    def _key(self, user_id: str, upload_id: str) -> str:
+        # Scoped by user, so an upload can only be applied by whoever requested it
+        return f"{UPLOAD_PREFIX}/{user_id}/{upload_id}"
+
+    def _status_key(self, key: str) -> str:
+        # Outside the signed upload key, so clients can't write it; expires with the upload prefix
+        return f"{key}.json"
+
+    async def create_upload(self, user_id: str, content_type: str, size: int) -> Dict:
+        if not content_type.startswith("image/"):
+            raise ValueError("File must be an image")
+        if size > config.upload_max_size:
+            raise ValueError(f"File must be at most {config.upload_max_size} bytes")
+
+        upload_id = uuid.uuid4().hex
+        target = await self.storage.create_upload(
+            self._key(user_id, upload_id), content_type, config.upload_max_size, config.upload_url_ttl,
+        )
+        return {
+            "upload_id": upload_id,
+            "url": target.url,
+            "fields": target.fields,
+            "expires_in": config.upload_url_ttl,
+        }
+
+    async def _apply(self, key: str, user_id: str):
+        try:
+            # Bounded by the upload size limit; the decoder needs the whole file anyway
+            chunks = [chunk async for chunk in self.storage.open_read(key)]
+            pixels = await asyncio.to_thread(_decode, b"".join(chunks), self.canvas)
+            result = await self.canvas.bulk_place_pixels(pixels, user_id)
+            outcome = {"status": "ready", "pixels_updated": result["pixels_updated"]}
+        except Exception as e:
+            print(f"Image upload {key} failed: {e}")
+            outcome = {"status": "failed", "error": str(e)}
+
+        _results.set(key, outcome)
+        # Polls may reach any instance, so the outcome is stored before the upload goes away
+        try:
+            await self.storage.upload_file(self._status_key(key), BytesIO(json.dumps(outcome).encode()))
+        except Exception as e:
+            print(f"Couldn't record outcome of upload {key}: {e}")
+            return
+        try:
+            await self.storage.delete_file(key)
+        except Exception as e:
+            print(f"Couldn't delete upload {key}: {e}")
+
+    async def apply_upload(self, user_id: str, upload_id: str) -> Optional[Dict]:
+        key = self._key(user_id, upload_id)
+        status = await self.get_status(user_id, upload_id)
+        if status is None:
+            return None
+        # Another request may have started the job while we checked storage
+        if key in _jobs:
+            return {"upload_id": upload_id, "status": "pending"}
+        if status["status"] != "uploaded":
+            return status
+
+        task = asyncio.create_task(self._apply(key, user_id))
+        _jobs[key] = task
+        task.add_done_callback(lambda t: _jobs.pop(key, None))
+        return {"upload_id": upload_id, "status": "pending"}
+
+    async def get_status(self, user_id: str, upload_id: str) -> Optional[Dict]:
+        # Running jobs are only known to the instance applying them; finished ones are in storage
+        key = self._key(user_id, upload_id)
+        if key in _jobs:
+            return {"upload_id": upload_id, "status": "pending"}
+
+        result = _results.get(key)
+        if result:
+            return {"upload_id": upload_id, **result}
+
+        # The outcome is written before the upload is deleted, so checking in this order can't miss both
+        if await self.storage.file_exists(key):
+            return {"upload_id": upload_id, "status": "uploaded"}
+        try:
+            result = json.loads(await self.storage.download_file(self._status_key(key)))
+        except FileNotFoundError:
+            return None
+        _results.set(key, result)
+        return {"upload_id": upload_id, **result}
+
+def get_image_upload_service(
+    canvas: CanvasService = Depends(get_canvas_service),
+    storage: StorageAdapter = Depends(get_storage_adapter),
+) -> ImageUploadService:
+    return ImageUploadService(canvas, storage)
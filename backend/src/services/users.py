@@ -0,0 +1,71 @@
+import asyncio
+from typing import Dict, List, Optional, Set
+
+from fastapi import Depends
+
+from adapters.auth import AuthAdapter, User, get_auth_adapter
+from config import config
+from utils.cache import TTLCache
+
+_profiles: TTLCache[User] = TTLCache(config.user_profile_cache_size, config.user_profile_cache_ttl)
+_inflight: Dict[str, asyncio.Future] = {}
+_load_tasks: Set[asyncio.Task] = set()
+
+class UserProfileService:
+    def __init__(self, auth: AuthAdapter):
+        self.auth = auth
+
+    async def _load(self, user_ids: List[str]):
+        try:
+            users = await self.auth.get_users_by_ids(user_ids)
+        except Exception as e:
+            for user_id in user_ids:
+                future = _inflight.pop(user_id)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for user_id in user_ids:
+            user = users.get(user_id)
+            # Unknown ids are remembered too, so asking for made-up ids again doesn't reach the backend
+            _profiles.set(user_id, user, ttl=None if user else config.user_profile_negative_cache_ttl)
+            future = _inflight.pop(user_id)
+            if not future.done():
+                future.set_result(user)
+
+    async def get_users(self, user_ids: List[str], max_misses: Optional[int] = None) -> Dict[str, Optional[User]]:
+        # Ids past max_misses that would need a backend lookup are left out of the result
+        result: Dict[str, Optional[User]] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        missing = []
+
+        for user_id in dict.fromkeys(user_ids):
+            hit, user = _profiles.lookup(user_id)
+            if hit:
+                result[user_id] = user
+            elif user_id in _inflight:
+                # Someone is already fetching this one; share their result
+                waiting[user_id] = _inflight[user_id]
+            elif max_misses is None or len(missing) < max_misses:
+                future = asyncio.get_running_loop().create_future()
+                _inflight[user_id] = future
+                waiting[user_id] = future
+                missing.append(user_id)
+
+        if missing:
+            # Runs on its own so a cancelled request doesn't strand the others waiting on it
+            task = asyncio.create_task(self._load(missing))
+            _load_tasks.add(task)
+            task.add_done_callback(_load_tasks.discard)
+
+        for user_id, future in waiting.items():
+            # Shielded: cancelling one waiter must not cancel the shared future
+            result[user_id] = await asyncio.shield(future)
+
+        return result
+
+    async def get_user(self, user_id: str) -> Optional[User]:
+        return (await self.get_users([user_id]))[user_id]
+
+def get_user_profile_service(auth: AuthAdapter = Depends(get_auth_adapter)) -> UserProfileService:
+    return UserProfileService(auth)
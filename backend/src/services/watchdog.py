@@ -0,0 +1,107 @@
+import asyncio
+from collections import deque
+import sys
+import threading
+import time
+import traceback
+from typing import Deque, Dict, List, Optional
+
+from config import config
+from utils.metrics import Counter, Gauge, Histogram, registry
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_QUANTILES = (0.5, 0.9, 0.99, 1.0)
+
+loop_lag = registry.register(Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer that was due", buckets=LAG_BUCKETS,
+))
+loop_lag_quantiles = registry.register(Gauge(
+    "event_loop_lag_quantile_seconds", "Event loop lag over the recent window", ("quantile",),
+))
+loop_stalls = registry.register(Counter(
+    "event_loop_stalls_total", "Times the event loop was blocked for longer than the stall threshold",
+))
+
+class LoopWatchdog:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+
+        # Written by the loop, read by the watchdog thread; float assignment is atomic enough here
+        self._last_beat = time.monotonic()
+        self._window: Deque[float] = deque(maxlen=config.loop_lag_window)
+        self.stalls: Deque[Dict] = deque(maxlen=config.loop_stall_history)
+
+    async def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._measure_loop())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def _measure_loop(self):
+        interval = config.loop_lag_interval
+        ticks = 0
+        while True:
+            try:
+                expected = time.monotonic() + interval
+                await asyncio.sleep(interval)
+                now = time.monotonic()
+                self._last_beat = now
+
+                lag = max(0.0, now - expected)
+                loop_lag.observe(lag)
+                self._window.append(lag)
+
+                ticks += 1
+                if ticks % 10 == 0:
+                    self._update_quantiles()
+            except asyncio.CancelledError:
+                break
+
+    def _update_quantiles(self):
+        values = sorted(self._window)
+        if not values:
+            return
+        for q in LAG_QUANTILES:
+            loop_lag_quantiles.set(values[min(len(values) - 1, int(q * len(values)))], quantile=str(q))
+
+    def _watch(self):
+        threshold = config.loop_stall_threshold
+        reported_beat = None
+        while not self._stop.wait(threshold / 4):
+            beat = self._last_beat
+            blocked_for = time.monotonic() - beat - config.loop_lag_interval
+            # One sample per stall: the loop hasn't ticked since we last reported
+            if blocked_for < threshold or beat == reported_beat:
+                continue
+
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = traceback.format_stack(frame) if frame else []
+            self._record_stall(blocked_for, stack)
+
+    def _record_stall(self, blocked_for: float, stack: List[str]):
+        loop_stalls.inc()
+        self.stalls.append({
+            "detected_at": time.time(),
+            "blocked_for": round(blocked_for, 4),
+            "stack": stack,
+        })
+        where = stack[-1].strip().splitlines()[0] if stack else "unknown location"
+        print(f"Event loop blocked for at least {blocked_for * 1000:.0f}ms at {where}")
+
+    def recent_stalls(self) -> List[Dict]:
+        return list(self.stalls)
+
+    async def shutdown(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+        if self._thread:
+            await asyncio.to_thread(self._thread.join)
+
+watchdog = LoopWatchdog()
@@ -1,10 +1,61 @@
-from typing import Optional
+from datetime import datetime
+import hashlib
+from typing import Dict, Optional
 
 from fastapi import Cookie, Depends, HTTPException, Header
 from fastapi.security import OAuth2PasswordBearer
 
-from adapters.auth import AuthAdapter, User, get_auth_adapter
+from adapters.auth import AuthAdapter, TokenSession, User, get_auth_adapter
+from adapters.revocations import RevocationStore, get_revocation_store
 from config import config
+from utils.cache import TTLCache
+from utils.cognito import token_expiry
+from wsmanager import manager as websocket
+
+_user_cache: TTLCache[User] = TTLCache(config.auth_cache_size, config.auth_cache_ttl)
+
+def _token_key(token: str) -> str:
+    # Raw tokens are never kept in memory longer than the request or sent over pub/sub
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _cache_ttl(session: Optional[TokenSession]) -> float:
+    if not session:
+        # Remember rejected tokens briefly so retries with a bad token stay cheap too
+        return config.auth_negative_cache_ttl
+    if not session.expires_at:
+        return config.auth_cache_ttl
+    # Never past the token's own expiry
+    remaining = (session.expires_at - datetime.now()).total_seconds()
+    return max(0.0, min(config.auth_cache_ttl, remaining))
+
+def _revocation_ttl(token: str) -> float:
+    # Until the token would have been rejected anyway; locally verified tokens get the leeway too
+    expires_at = token_expiry(token)
+    if not expires_at:
+        return config.auth_revocation_ttl
+    return (expires_at - datetime.now()).total_seconds() + config.cognito_token_leeway
+
+async def revoke_cached_token(token: str):
+    key = _token_key(token)
+    _user_cache.delete(key)
+    ttl = _revocation_ttl(token)
+    if ttl > 0:
+        try:
+            await get_revocation_store().revoke(key, ttl)
+        except Exception as e:
+            print(f"Token revocation failed: {e}")
+    try:
+        await websocket.broadcast({
+            "intent": "token_revoked",
+            "internal": True,
+            "payload": {"token_hash": key},
+        })
+    except Exception as e:
+        print(f"Token revocation broadcast failed: {e}")
+
+async def handle_token_revoked(message: Dict):
+    if message.get("intent") == "token_revoked":
+        _user_cache.delete(message["payload"]["token_hash"])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth_token", auto_error=False)
 
@@ -16,12 +67,23 @@ async def get_token(
 
 async def get_current_user(
     token: str = Depends(get_token),
-    auth: AuthAdapter = Depends(get_auth_adapter)
+    auth: AuthAdapter = Depends(get_auth_adapter),
+    revocations: RevocationStore = Depends(get_revocation_store),
 ) -> Optional[User]:
     if not token:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    user = await auth.get_user_from_token(token)
+    # Revocations drop cached users on every instance, so only a miss needs the shared store
+    key = _token_key(token)
+    hit, user = _user_cache.lookup(key)
+    if not hit:
+        session = await auth.get_session_from_token(token)
+        # Checked after verifying, so a sign-out while this request was verifying isn't cached over
+        if session and await revocations.is_revoked(key):
+            session = None
+        user = session.user if session else None
+        _user_cache.set(key, user, ttl=_cache_ttl(session))
+
     if not user:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
     
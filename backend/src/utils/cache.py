@@ -0,0 +1,103 @@
+import asyncio
+from collections import OrderedDict
+import time
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Optional, Set, Tuple, TypeVar
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+class TTLCache(Generic[V]):
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+
+    def lookup(self, key: Hashable) -> Tuple[bool, Optional[V]]:
+        # Returns (hit, value) so that a cached None can be told apart from a miss
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            return False, None
+
+        expires_at, value = entry # type: ignore
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, value
+
+    def get(self, key: Hashable) -> Optional[V]:
+        return self.lookup(key)[1]
+
+    def set(self, key: Hashable, value: Optional[V], ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def delete_many(self, keys: Iterable[Hashable]):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def values(self) -> List[Optional[V]]:
+        # Includes entries past their ttl that haven't been looked up since
+        return [value for _, value in self._entries.values()]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SingleFlight(Generic[V]):
+    # Callers asking for a key while it loads, or up to max_age seconds after, share one result
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self._results: Dict[Hashable, Tuple[float, V]] = {}
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def get(self, key: Hashable, load: Callable[[], Awaitable[V]]) -> Tuple[V, str]:
+        # Returns the value and whether it was "loaded", "coalesced" onto a running load or "cached"
+        entry = self._results.get(key)
+        if entry and time.monotonic() - entry[0] < self.max_age:
+            return entry[1], "cached"
+
+        future = self._inflight.get(key)
+        if future:
+            return await asyncio.shield(future), "coalesced"
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        # Runs on its own so a cancelled request doesn't strand the others waiting on it
+        task = asyncio.create_task(self._load(key, load, future))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(future), "loaded"
+
+    async def _load(self, key: Hashable, load: Callable[[], Awaitable[V]], future: asyncio.Future):
+        try:
+            value = await load()
+        except Exception as e:
+            future.set_exception(e)
+            # Every waiter may have been cancelled; don't log it as never retrieved
+            future.exception()
+        else:
+            # A forget() while loading means this result may predate the change
+            if self._inflight.get(key) is future:
+                now = time.monotonic()
+                self._results = {k: r for k, r in self._results.items() if now - r[0] < self.max_age}
+                self._results[key] = (now, value)
+            future.set_result(value)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def forget(self, key: Hashable):
+        self._results.pop(key, None)
+        self._inflight.pop(key, None)
@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime
+import json
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+import jwt
+
+from config import config
+
+JWKSFetcher = Callable[[], Awaitable[Dict]]
+
+class JWKSUnavailableError(Exception):
+    pass
+
+class CognitoTokenVerifier:
+    def __init__(self, region: str, user_pool_id: str, client_id: str, fetch_jwks: Optional[JWKSFetcher] = None):
+        self.issuer = f"https://cognito-idp.{region}.amazonaws.com/{user_pool_id}"
+        self.jwks_url = f"{self.issuer}/.well-known/jwks.json"
+        self.client_id = client_id
+        self._fetch_jwks = fetch_jwks or self._fetch_remote_jwks
+
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._fetched_at: float = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def _fetch_remote_jwks(self) -> Dict:
+        async with httpx.AsyncClient(timeout=5) as client:
+            response = await client.get(self.jwks_url)
+            response.raise_for_status()
+            return response.json()
+
+    async def _refresh(self):
+        jwks = await self._fetch_jwks()
+        keys = {}
+        for key_data in jwks.get("keys", []):
+            try:
+                keys[key_data["kid"]] = jwt.PyJWK(key_data)
+            except (jwt.PyJWKError, KeyError) as e:
+                print(f"Skipping unusable JWKS key: {e}")
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+
+    async def _get_key(self, kid: str) -> Optional[jwt.PyJWK]:
+        if kid in self._keys:
+            return self._keys[kid]
+
+        # Unknown kid: the pool may have rotated keys, but don't let forged kids hammer the endpoint
+        if self._keys and time.monotonic() - self._fetched_at < config.cognito_jwks_refresh_interval:
+            return None
+
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+        try:
+            await asyncio.shield(self._refresh_task)
+        except Exception as e:
+            raise JWKSUnavailableError(f"Failed to fetch JWKS: {e}") from e
+
+        return self._keys.get(kid)
+
+    async def verify(self, token: str) -> Optional[Dict]:
+        # Returns the claims of a valid access token, None if the token is invalid.
+        # Raises JWKSUnavailableError when the token can't be checked locally.
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError:
+            return None
+
+        kid = header.get("kid")
+        if not kid:
+            return None
+
+        key = await self._get_key(kid)
+        if not key:
+            return None
+
+        try:
+            claims = jwt.decode(
+                token,
+                key=key,
+                algorithms=["RS256"],
+                issuer=self.issuer,
+                leeway=config.cognito_token_leeway,
+                # Cognito access tokens carry client_id instead of aud
+                options={"require": ["exp", "iss", "sub"], "verify_aud": False},
+            )
+        except jwt.InvalidTokenError:
+            return None
+
+        if claims.get("token_use") != "access" or claims.get("client_id") != self.client_id:
+            return None
+
+        return claims
+
+def token_expiry(token: str) -> Optional[datetime]:
+    # Read without verifying the signature; only for tokens that have already been accepted
+    try:
+        claims = jwt.decode(token, options={"verify_signature": False})
+    except jwt.InvalidTokenError:
+        return None
+    exp = claims.get("exp")
+    return datetime.fromtimestamp(exp) if isinstance(exp, (int, float)) else None
+
+def load_jwks(path: str) -> JWKSFetcher:
+    # For offline setups: serve the key set from a local file instead of Cognito
+    async def _fetch() -> Dict:
+        with open(path) as f:
+            return json.load(f)
+    return _fetch
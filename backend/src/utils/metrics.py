@@ -0,0 +1,248 @@
+from abc import ABC, abstractmethod
+import bisect
+from contextlib import contextmanager
+import functools
+import inspect
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow bulk operations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        pass
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+            for key, v in self._values.items()
+        ]
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[str]:
+        if self._callback:
+            # Read at scrape time so the hot path doesn't have to keep it up to date
+            return [f"{self.name} {_format_value(self._callback())}"]
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}"
+            for key, v in self._values.items()
+        ]
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: non-cumulative bucket counts (last one is +Inf), sum, count
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            self._series[key] = series
+        counts, totals = series
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += value
+        totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, (total, count)) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {int(count)}")
+        return lines
+
+M = TypeVar("M", bound=Metric)
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"),
+))
+db_operation_duration = registry.register(Histogram(
+    "db_operation_duration_seconds", "Database adapter call latency", ("backend", "operation", "outcome"),
+))
+auth_operation_duration = registry.register(Histogram(
+    "auth_operation_duration_seconds", "Auth adapter call latency", ("backend", "operation", "outcome"),
+))
+storage_operation_duration = registry.register(Histogram(
+    "storage_operation_duration_seconds", "Storage adapter call latency", ("backend", "operation", "outcome"),
+))
+storage_bytes = registry.register(Counter(
+    "storage_bytes_total", "Bytes moved to and from storage", ("backend", "direction"),
+))
+pubsub_publish_duration = registry.register(Histogram(
+    "pubsub_publish_duration_seconds", "Time to publish a message to the broadcast channel",
+))
+pubsub_receive_lag = registry.register(Histogram(
+    "pubsub_receive_lag_seconds", "Delay between publishing a message and receiving it on this instance",
+))
+websocket_fanout_duration = registry.register(Histogram(
+    "websocket_fanout_duration_seconds", "Time to deliver one broadcast to every local socket",
+))
+websocket_dropped = registry.register(Counter(
+    "websocket_dropped_total", "Sockets dropped because a send failed",
+))
+
+def instrument(adapter, histogram: Histogram, backend: str, on_result: Optional[Callable[[str, tuple, object], None]] = None):
+    # Wraps the adapter's public coroutine methods on the instance; the class stays untouched
+    for name, method in inspect.getmembers(adapter, inspect.iscoroutinefunction):
+        if name.startswith("_"):
+            continue
+
+        def _wrap(name=name, method=method):
+            @functools.wraps(method)
+            async def _timed(*args, **kwargs):
+                start = time.perf_counter()
+                outcome = "error"
+                try:
+                    result = await method(*args, **kwargs)
+                    outcome = "ok"
+                finally:
+                    histogram.observe(time.perf_counter() - start, backend=backend, operation=name, outcome=outcome)
+                if on_result:
+                    on_result(name, args, result)
+                return result
+            return _timed
+
+        setattr(adapter, name, _wrap())
+    return adapter
+
+def instrument_storage(adapter, backend: str):
+    def _count_bytes(operation: str, args: tuple, result):
+        if operation in ("upload_file", "open_write") and result is not None:
+            storage_bytes.inc(result.size, backend=backend, direction="upload")
+        elif operation == "download_file":
+            storage_bytes.inc(len(result), backend=backend, direction="download")
+
+    # Async generators aren't coroutine functions, so streamed reads are counted chunk by chunk
+    open_read = adapter.open_read
+
+    @functools.wraps(open_read)
+    async def _counted_read(*args, **kwargs):
+        async for chunk in open_read(*args, **kwargs):
+            storage_bytes.inc(len(chunk), backend=backend, direction="download")
+            yield chunk
+
+    adapter.open_read = _counted_read
+    return instrument(adapter, storage_operation_duration, backend, _count_bytes)
+
+class MetricsMiddleware:
+    # Plain ASGI middleware; BaseHTTPMiddleware would add a task and a queue per request
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            # The router stores the matched route in the shared scope; keeps label cardinality bounded
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status),
+            )
@@ -0,0 +1,103 @@
+from typing import Dict, Iterable, List
+
+from pymongo import IndexModel
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.errors import OperationFailure
+from pymongo.monitoring import ConnectionCheckOutFailedReason, ConnectionPoolListener
+
+QueryShape = Dict
+
+# IndexOptionsConflict and IndexKeySpecsConflict: an index of the same name exists with another spec
+INDEX_CONFLICT_CODES = (85, 86)
+
+async def ensure_indexes(collection: AsyncCollection, indexes: List[IndexModel], replace_conflicting: bool = False):
+    # create_indexes is a no-op for indexes that already exist with the same spec
+    try:
+        await collection.create_indexes(indexes)
+    except OperationFailure as e:
+        if replace_conflicting and e.code in INDEX_CONFLICT_CODES:
+            await _replace_indexes(collection, indexes)
+            return
+        # Usually an existing index with different options or duplicates blocking a unique index
+        print(f"Index creation on {collection.name} failed: {e}")
+
+def _same_spec(info: Dict, document: Dict) -> bool:
+    if [tuple(k) for k in info["key"]] != list(document["key"].items()):
+        return False
+    return all(info.get(option) == document.get(option) for option in ("unique", "sparse", "expireAfterSeconds"))
+
+async def _replace_indexes(collection: AsyncCollection, indexes: List[IndexModel]):
+    # Only the conflicting indexes are dropped, so the others keep enforcing their constraints
+    existing = await collection.index_information()
+    for index in indexes:
+        name = index.document["name"]
+        if name in existing and not _same_spec(existing[name], index.document):
+            print(f"Replacing index {name} on {collection.name}")
+            await collection.drop_index(name)
+    try:
+        await collection.create_indexes(indexes)
+    except OperationFailure as e:
+        print(f"Index creation on {collection.name} failed: {e}")
+
+def _plan_stages(plan: Dict) -> Iterable[str]:
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+async def check_query_plans(collection: AsyncCollection, queries: List[QueryShape]):
+    # Logs representative queries that the planner would still answer with a collection scan
+    for query in queries:
+        cursor = collection.find(query["filter"], query.get("projection"))
+        if "sort" in query:
+            cursor = cursor.sort(query["sort"])
+        try:
+            explain = await cursor.explain()
+        except OperationFailure as e:
+            print(f"Couldn't explain query on {collection.name}: {e}")
+            continue
+
+        stages = set(_plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {})))
+        if "COLLSCAN" in stages:
+            print(f"COLLSCAN on {collection.name} for filter={query['filter']} sort={query.get('sort')}")
+
+class PoolListener(ConnectionPoolListener):
+    # Feeds the driver's pool events into a connections.PoolStats; the driver sums pools across servers
+    def __init__(self, stats):
+        self.stats = stats
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.stats.opened()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.stats.closed()
+
+    def connection_check_out_started(self, event):
+        self.stats.checkout_started()
+
+    def connection_check_out_failed(self, event):
+        self.stats.checkout_failed(event.reason == ConnectionCheckOutFailedReason.TIMEOUT)
+
+    def connection_checked_out(self, event):
+        self.stats.checked_out(event.duration or 0.0)
+
+    def connection_checked_in(self, event):
+        self.stats.checked_in()
@@ -0,0 +1,54 @@
+import random
+import time
+import uuid
+from typing import Dict, Optional
+
+from config import config
+from utils.cache import TTLCache
+from utils.metrics import Histogram, registry
+
+DELIVERY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+delivery_stage = registry.register(Histogram(
+    "canvas_event_delivery_seconds",
+    "Time from the start of a canvas write until the event reached each stage",
+    ("intent", "stage", "hop"),
+    buckets=DELIVERY_BUCKETS,
+))
+
+# Traces delivered through this instance, so that client acks can be matched to their origin time
+_delivered: TTLCache[Dict] = TTLCache(config.trace_cache_size, config.trace_ack_timeout)
+
+def new_trace() -> Dict:
+    return {
+        "id": uuid.uuid4().hex[:16],
+        "origin": config.instance_id,
+        "t0": time.time(),
+        "mono": time.monotonic(),
+        "ack": random.random() < config.trace_ack_sample_rate,
+    }
+
+def _hop(trace: Dict) -> str:
+    return "local" if trace.get("origin") == config.instance_id else "remote"
+
+def elapsed(trace: Dict) -> float:
+    # Monotonic time is only comparable on the instance that started the trace
+    if _hop(trace) == "local":
+        return time.monotonic() - trace["mono"]
+    return max(0.0, time.time() - trace["t0"])
+
+def observe(trace: Optional[Dict], intent: str, stage: str):
+    if trace:
+        delivery_stage.observe(elapsed(trace), intent=intent, stage=stage, hop=_hop(trace))
+
+def client_trace(trace: Dict, intent: str) -> Optional[Dict]:
+    # Clients only see the id, and only for the sampled events they are asked to ack
+    if not trace.get("ack"):
+        return None
+    _delivered.set(trace["id"], {**trace, "intent": intent})
+    return {"id": trace["id"], "ack": True}
+
+def record_ack(trace_id: str):
+    hit, trace = _delivered.lookup(trace_id)
+    if hit and trace:
+        observe(trace, trace["intent"], "client_ack")
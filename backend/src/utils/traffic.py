@@ -0,0 +1,203 @@
+import asyncio
+import base64
+from datetime import datetime, timezone
+import gzip
+import hashlib
+import hmac
+import json
+from pathlib import Path
+import re
+import secrets
+import time
+from typing import Dict, List, Optional
+
+from config import config
+
+FORMAT = "canvas-traffic"
+VERSION = 1
+
+# POST bodies worth keeping so the request can be sent again
+BODY_KINDS = ("place", "overwrite", "read")
+
+# The default canvas's routes and the same routes for any other canvas
+CANVAS_PATH = re.compile(r"/api/(?:canvas|canvases/[^/]+)(/.*)")
+
+def classify(method: str, path: str, scope_type: str = "http") -> Optional[str]:
+    if scope_type == "websocket":
+        return "connect" if path == "/api/ws" else None
+
+    match = CANVAS_PATH.fullmatch(path)
+    if not match:
+        return None
+    route = match.group(1)
+
+    if method == "POST":
+        if route == "/":
+            return "place"
+        if route == "/overwrite":
+            return "overwrite"
+        if route == "/pixel/batch":
+            return "read"
+        return None
+
+    if method == "GET" and (
+        route in ("/", "/tiles", "/pyramid", "/image.png", "/image.webp")
+        or route.startswith("/pixel/")
+    ):
+        return "read"
+    return None
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+def _token(scope) -> Optional[str]:
+    authorization = _header(scope, b"authorization")
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    for part in (_header(scope, b"cookie") or "").split(";"):
+        name, _, value = part.strip().partition("=")
+        if name == "auth_token":
+            return value
+    return None
+
+class TrafficRecorder:
+    def __init__(self):
+        self.path: Optional[Path] = None
+        self._buffer: List[Dict] = []
+        self._started = 0.0
+        # Clients are recorded under a pseudonym that only means something within one recording
+        self._salt = secrets.token_bytes(16)
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        return self.path is not None
+
+    async def start(self, directory: str):
+        stamp = datetime.now(timezone.utc)
+        path = Path(directory) / f"{config.instance_id}-{stamp:%Y%m%d%H%M%S}.jsonl.gz"
+        header = {
+            "format": FORMAT,
+            "version": VERSION,
+            "instance_id": config.instance_id,
+            "started_at": stamp.timestamp(),
+            "canvas_width": config.canvas_width,
+            "canvas_height": config.canvas_height,
+        }
+        await asyncio.to_thread(self._write, path, [header], True)
+
+        self.path = path
+        self._started = time.monotonic()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        print(f"Recording traffic to {path}")
+
+    def client_id(self, scope) -> str:
+        token = _token(scope)
+        if not token:
+            return ""
+        return hmac.new(self._salt, token.encode(), hashlib.sha256).hexdigest()[:12]
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    def record(self, event: Dict):
+        if self.active:
+            self._buffer.append(event)
+
+    def _write(self, path: Path, lines: List[Dict], create: bool = False):
+        if create:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        # Each flush appends a gzip member; readers see one continuous stream
+        with gzip.open(path, "wt" if create else "at", encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+    async def flush(self):
+        if not self.path or not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, self.path, batch)
+        except Exception as e:
+            print(f"Traffic recording flush failed: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.sleep(config.traffic_flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Traffic recording loop error: {e}")
+
+    async def shutdown(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+        await self.flush()
+        self.path = None
+
+recorder = TrafficRecorder()
+
+class TrafficRecordingMiddleware:
+    # Plain ASGI so request bodies can be copied as they stream through
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or not recorder.active:
+            await self.app(scope, receive, send)
+            return
+
+        kind = classify(scope.get("method", "GET"), scope["path"], scope["type"])
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+
+        event: Dict = {
+            "t": round(recorder.elapsed(), 4),
+            "k": kind,
+            "c": recorder.client_id(scope),
+            "m": scope.get("method", "GET"),
+            "p": scope["path"],
+        }
+        if scope.get("query_string"):
+            event["q"] = scope["query_string"].decode("latin-1")
+
+        body = bytearray()
+        too_large = False
+        status = 0
+
+        async def _receive():
+            nonlocal too_large
+            message = await receive()
+            if message["type"] == "http.request" and kind in BODY_KINDS and not too_large:
+                body.extend(message.get("body", b""))
+                if len(body) > config.traffic_max_body:
+                    too_large = True
+                    body.clear()
+            return message
+
+        async def _send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "websocket.accept":
+                status = 101
+            await send(message)
+
+        try:
+            await self.app(scope, _receive if scope["type"] == "http" else receive, _send)
+        finally:
+            event["s"] = status
+            if scope["type"] == "websocket":
+                event["d"] = round(recorder.elapsed() - event["t"], 4)
+            elif too_large:
+                event["n"] = -1
+            elif body:
+                event["b"] = base64.b64encode(bytes(body)).decode()
+                event["ct"] = _header(scope, b"content-type") or ""
+            recorder.record(event)
@@ -1,23 +1,35 @@
-from typing import Dict, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Set
 from fastapi import WebSocket
 import asyncio
 import json
+import random
+import time
 
 from adapters.pubsub import PubSubAdapter
 from config import config
+from utils import tracing
+from utils.metrics import Gauge, pubsub_publish_duration, pubsub_receive_lag, registry, websocket_dropped, websocket_fanout_duration
 
 class ConnectionManager:
     def __init__(self):
-        self.active: List[WebSocket] = []
+        # Sockets grouped by the canvas they watch; updates only go to that canvas's sockets
+        self.rooms: Dict[str, List[WebSocket]] = {}
         self.pubsub: Optional[PubSubAdapter] = None
         self.channel_name = "canvas_updates"
 
         self._listener_task: Optional[asyncio.Task] = None
         self._heartbeat_task: Optional[asyncio.Task] = None
+        self._stream_tasks: Set[asyncio.Task] = set()
+        self._listeners: List[Callable[[Dict], Awaitable[None]]] = []
+        self.draining = False
 
     def init_pubsub(self, pubsub_adapter: PubSubAdapter):
         self.pubsub = pubsub_adapter
 
+    def add_listener(self, callback: Callable[[Dict], Awaitable[None]]):
+        # In-process consumers of cluster-wide events, called before fan-out to sockets
+        self._listeners.append(callback)
+
     async def start_listening(self):
         if not self.pubsub:
             raise RuntimeError("PubSub adapter not initialized")
@@ -47,31 +59,143 @@ class ConnectionManager:
                 print(f"Heartbeat error: {e}")
                 await asyncio.sleep(5)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, canvas_id: str) -> bool:
+        if self.draining:
+            # Rejected during the handshake so the client retries against another instance
+            await websocket.close(code=1013)
+            return False
         await websocket.accept()
-        self.active.append(websocket)
+        self.rooms.setdefault(canvas_id, []).append(websocket)
+        return True
 
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active:
-            self.active.remove(websocket)
+    def disconnect(self, websocket: WebSocket, canvas_id: str):
+        sockets = self.rooms.get(canvas_id)
+        if sockets and websocket in sockets:
+            sockets.remove(websocket)
+            if not sockets:
+                del self.rooms[canvas_id]
 
     async def _handle_broadcast(self, message: Dict):
-        data = json.dumps(message)
-        to_remove = []
-        for ws in self.active:
+        sent_at = message.pop("sent_at", None)
+        if sent_at is not None:
+            pubsub_receive_lag.observe(max(0.0, time.time() - sent_at))
+
+        intent = message.get("intent", "")
+        trace = message.pop("trace", None)
+        tracing.observe(trace, intent, "received")
+
+        for listener in self._listeners:
             try:
-                await ws.send_text(data)
-            except Exception:
-                to_remove.append(ws)
-        
-        for ws in to_remove:
-            self.disconnect(ws)
+                await listener(message)
+            except Exception as e:
+                print(f"Broadcast listener error: {e}")
+
+        # Coordination messages between instances are not meant for clients
+        if message.get("internal"):
+            return
+
+        if trace:
+            client_trace = tracing.client_trace(trace, intent)
+            if client_trace:
+                message["trace"] = client_trace
+
+        # Heartbeats go to every socket, canvas updates only to that canvas's. Instances from before
+        # there were several canvases publish updates without an id.
+        if intent == "heartbeat":
+            rooms = list(self.rooms)
+        else:
+            rooms = [message.get("canvas_id") or config.default_canvas_id]
+
+        start = time.perf_counter()
+        data = json.dumps(message)
+        dropped = 0
+        for room in rooms:
+            to_remove = []
+            for ws in list(self.rooms.get(room, ())):
+                try:
+                    await ws.send_text(data)
+                except Exception:
+                    to_remove.append(ws)
+
+            for ws in to_remove:
+                self.disconnect(ws, room)
+            dropped += len(to_remove)
+        websocket_dropped.inc(dropped)
+        websocket_fanout_duration.observe(time.perf_counter() - start)
+        tracing.observe(trace, intent, "delivered")
+
+    def handle_client_message(self, text: str):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return
+
+        if isinstance(message, dict) and message.get("intent") == "ack":
+            tracing.record_ack(str(message.get("trace_id", "")))
 
     async def broadcast(self, message: Dict):
         if self.pubsub:
-            await self.pubsub.publish(self.channel_name, message)
+            with pubsub_publish_duration.time():
+                await self.pubsub.publish(self.channel_name, {**message, "sent_at": time.time()})
+
+    def broadcast_stream(self, messages: List[Dict], interval: float):
+        # Publishes the frames in order in the background, spaced out by `interval` seconds
+        async def _stream():
+            for i, message in enumerate(messages):
+                if i > 0 and interval > 0:
+                    await asyncio.sleep(interval)
+                await self.broadcast(message)
+
+        task = asyncio.create_task(_stream())
+        self._stream_tasks.add(task)
+        task.add_done_callback(self._on_stream_done)
+
+    def _on_stream_done(self, task: asyncio.Task):
+        self._stream_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"Broadcast stream failed: {task.exception()}")
+
+    async def drain(self, versions: Dict[str, int]):
+        if self.draining:
+            return
+        self.draining = True
+
+        # Bulk frames already queued go out before clients are told to leave
+        if self._stream_tasks:
+            await asyncio.wait(list(self._stream_tasks), timeout=config.drain_publish_timeout)
+
+        sockets = [(canvas_id, ws) for canvas_id, room in self.rooms.items() for ws in room]
+        if sockets:
+            print(f"Draining {len(sockets)} websocket(s) over {config.drain_window}s")
+
+        # Each client gets its own delay, so reconnects and their canvas reads arrive spread out
+        # instead of all at once. Sockets keep receiving updates until the client moves.
+        closes = []
+        for canvas_id, ws in sockets:
+            delay = random.uniform(0, config.drain_window)
+            payload = {"delay": round(delay, 3), "version": versions.get(canvas_id, 0)}
+            try:
+                await ws.send_text(json.dumps({"intent": "reconnect", "payload": payload}))
+            except Exception:
+                self.disconnect(ws, canvas_id)
+                continue
+            closes.append(self._close_after(ws, canvas_id, delay + config.drain_close_grace))
+        await asyncio.gather(*closes)
+
+    async def _close_after(self, websocket: WebSocket, canvas_id: str, delay: float):
+        await asyncio.sleep(delay)
+        if websocket not in self.rooms.get(canvas_id, ()):
+            return
+        try:
+            await websocket.close(code=1012)
+        except Exception:
+            pass
+        self.disconnect(websocket, canvas_id)
 
     async def shutdown(self):
+        for task in list(self._stream_tasks):
+            task.cancel()
+
         if self._listener_task:
             self._listener_task.cancel()
         if self._heartbeat_task:
@@ -81,3 +205,8 @@ class ConnectionManager:
             await self.pubsub.close()
 
 manager = ConnectionManager()
+
+registry.register(Gauge(
+    "websocket_connections", "Open websocket connections on this instance",
+    callback=lambda: sum(len(room) for room in manager.rooms.values()),
+))
@@ -22,9 +22,14 @@ export class AuthAPIError extends Error {
   }
 }
 
+const usernameBatchSize = 100;
+const usernameBatchDelay = 20;
+
 class AuthAPI {
   private _usernameCache = new Map<string, string>();
   private _pendingRequests = new Map<string, Promise<string | null>>();
+  private _usernameQueue = new Map<string, (username: string | null) => void>();
+  private _usernameFlush: ReturnType<typeof setTimeout> | null = null;
 
   private get baseUrl() {
     return getApiBase();
@@ -138,6 +143,46 @@ class AuthAPI {
     }
   }
 
+  // null when signed out; batch lookups are only open to signed-in users
+  async getUsersByIds(userIds: string[]): Promise<Record<string, { username: string } | null> | null> {
+    try {
+      const res = await fetchWithAuth(`${this.baseUrl}/auth/users`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ user_ids: userIds }),
+      });
+      if (res.status === 401) return null;
+      if (!res.ok) return {};
+      return (await res.json()).users;
+    } catch (err) {
+      console.error("Failed to fetch users:", err);
+      return {};
+    }
+  }
+
+  private async flushUsernameQueue() {
+    const queued = this._usernameQueue;
+    this._usernameQueue = new Map();
+    this._usernameFlush = null;
+
+    const ids = [...queued.keys()];
+    for (let i = 0; i < ids.length; i += usernameBatchSize) {
+      const batch = ids.slice(i, i + usernameBatchSize);
+      const users = await this.getUsersByIds(batch) ?? Object.fromEntries(
+        await Promise.all(batch.map(async id => [id, await this.getUserById(id)] as const))
+      );
+      for (const id of batch) {
+        // Ids the server didn't get to this time are left out and looked up again on the next hover
+        const username = users[id]?.username ?? null;
+        if (username) {
+          this._usernameCache.set(id, username);
+        }
+        this._pendingRequests.delete(id);
+        queued.get(id)!(username);
+      }
+    }
+  }
+
   async getUsernameById(userId: string): Promise<string | null> {
     if (this._usernameCache.has(userId)) {
       return this._usernameCache.get(userId)!;
@@ -147,15 +192,12 @@ class AuthAPI {
       return this._pendingRequests.get(userId)!;
     }
 
-    const promise = this.getUserById(userId).then(res => {
-      this._pendingRequests.delete(userId);
-      if (res) {
-        this._usernameCache.set(userId, res.username);
-        return res.username;
-      }
-      return null;
+    // Lookups made within a short window are sent together in one batch request
+    const promise = new Promise<string | null>(resolve => {
+      this._usernameQueue.set(userId, resolve);
     });
-    
+    this._usernameFlush ??= setTimeout(() => this.flushUsernameQueue(), usernameBatchDelay);
+
     this._pendingRequests.set(userId, promise);
     return promise;
   }
@@ -1,4 +1,4 @@
-import { getApiBase, getWebSocketBase, fetchWithAuth } from "./common";
+import { getApiBase, getCanvasId, getWebSocketBase, fetchWithAuth } from "./common";
 
 export type PixelData = {
   x: number;
@@ -8,10 +8,21 @@ export type PixelData = {
   userId?: string;
 };
 
+// Pixel key ("x_y") to colour; placement details are fetched separately
+export type PixelColors = Record<string, string>;
+
+// version: the canvas version read before the pixels, so they are at least that new
 export type CanvasState = {
   canvas_width: number;
   canvas_height: number;
-  pixels: Record<string, PixelData>;
+  version: number;
+  pixels: PixelColors;
+};
+
+export type CanvasTiles = {
+  tiles: string[];
+  version: number;
+  pixels: PixelColors;
 };
 
 export type Snapshot = {
@@ -30,6 +41,20 @@ export type SnapshotListResponse = {
   offset: number;
 }
 
+export type ImageUpload = {
+  upload_id: string;
+  url: string;
+  fields: Record<string, string>;
+  expires_in: number;
+};
+
+export type ImageUploadStatus = {
+  upload_id: string;
+  status: "uploaded" | "pending" | "ready" | "failed";
+  pixels_updated?: number;
+  error?: string;
+};
+
 export class CanvasAPIError extends Error {
   constructor(message: string, public statusCode?: number) {
     super(message);
@@ -38,24 +63,95 @@ export class CanvasAPIError extends Error {
 }
 
 class CanvasAPI {
+  private _detailsCache = new Map<string, PixelData | null>();
+  private _pendingDetails = new Map<string, Promise<PixelData | null>>();
+
   private get baseUrl() {
     return getApiBase();
   }
 
+  private get canvasUrl() {
+    const canvasId = getCanvasId();
+    return canvasId
+      ? `${this.baseUrl}/canvases/${encodeURIComponent(canvasId)}`
+      : `${this.baseUrl}/canvas`;
+  }
+
   private get webSocketUrl() {
-    return getWebSocketBase();
+    const canvasId = getCanvasId();
+    return canvasId
+      ? `${getWebSocketBase()}?canvas=${encodeURIComponent(canvasId)}`
+      : getWebSocketBase();
   }
 
   async getCanvas(): Promise<CanvasState> {
-    const res = await fetch(`${this.baseUrl}/canvas`);
+    const res = await fetch(this.canvasUrl);
     if (!res.ok) {
       throw new CanvasAPIError("Failed to fetch canvas", res.status);
     }
     return await res.json();
   }
 
+  async getTiles(tileIds: string[]): Promise<CanvasTiles> {
+    const params = new URLSearchParams();
+    for (const id of tileIds) params.append("ids", id);
+
+    const res = await fetch(`${this.canvasUrl}/tiles?${params}`);
+    if (!res.ok) {
+      throw new CanvasAPIError("Failed to fetch canvas tiles", res.status);
+    }
+    return await res.json();
+  }
+
+  async getPixelDetails(x: number, y: number): Promise<PixelData | null> {
+    const key = `${x}_${y}`;
+    if (this._detailsCache.has(key)) {
+      return this._detailsCache.get(key)!;
+    }
+
+    if (this._pendingDetails.has(key)) {
+      return this._pendingDetails.get(key)!;
+    }
+
+    const promise = fetch(`${this.canvasUrl}/pixel/${x}/${y}`)
+      .then(async res => (res.ok ? ((await res.json()) as PixelData) : null))
+      .catch(err => {
+        console.error("Failed to fetch pixel details:", err);
+        return null;
+      })
+      .then(details => {
+        // Skip caching if the pixel changed while the request was in flight
+        if (this._pendingDetails.get(key) === promise) {
+          this._pendingDetails.delete(key);
+          this._detailsCache.set(key, details);
+        }
+        return details;
+      });
+
+    this._pendingDetails.set(key, promise);
+    return promise;
+  }
+
+  setPixelDetails(pixel: PixelData) {
+    const key = `${pixel.x}_${pixel.y}`;
+    this._pendingDetails.delete(key);
+    this._detailsCache.set(key, pixel);
+  }
+
+  invalidatePixelDetails(keys?: Iterable<string>) {
+    if (!keys) {
+      this._detailsCache.clear();
+      this._pendingDetails.clear();
+      return;
+    }
+    for (const key of keys) {
+      this._detailsCache.delete(key);
+      this._pendingDetails.delete(key);
+    }
+  }
+
   async placePixel(x: number, y: number, color: string): Promise<PixelData> {
-    const res = await fetchWithAuth(`${this.baseUrl}/canvas`, {
+    const res = await fetchWithAuth(this.canvasUrl, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       credentials: "include",
@@ -81,7 +177,7 @@ class CanvasAPI {
 
   async getSnapshots(limit: number = 20, offset: number = 0): Promise<SnapshotListResponse> {
     const res = await fetch(
-      `${this.baseUrl}/canvas/snapshot?limit=${limit}&offset=${offset}`
+      `${this.canvasUrl}/snapshot?limit=${limit}&offset=${offset}`
     );
 
     if (!res.ok) {
@@ -91,14 +187,13 @@ class CanvasAPI {
     return await res.json();
   }
 
-  async overwriteWithImage(file: File): Promise<{ message: string; pixels_updated: number }> {
-    const formData = new FormData();
-    formData.append("file", file);
-
-    const res = await fetchWithAuth(`${this.baseUrl}/canvas/overwrite`, {
+  async overwriteWithImage(file: File): Promise<{ pixels_updated: number }> {
+    // The image goes straight to storage; the API only hands out the upload target and applies it
+    const res = await fetchWithAuth(`${this.canvasUrl}/overwrite/upload`, {
       method: "POST",
+      headers: { "Content-Type": "application/json" },
       credentials: "include",
-      body: formData,
+      body: JSON.stringify({ content_type: file.type, size: file.size }),
     });
 
     if (!res.ok) {
@@ -106,11 +201,45 @@ class CanvasAPI {
       throw new CanvasAPIError(text || "Failed to upload image", res.status);
     }
 
+    const upload: ImageUpload = await res.json();
+    const formData = new FormData();
+    for (const [name, value] of Object.entries(upload.fields)) {
+      formData.append(name, value);
+    }
+    // Presigned posts ignore any field after the file
+    formData.append("file", file);
+
+    const uploadRes = await fetch(upload.url, { method: "POST", body: formData });
+    if (!uploadRes.ok) {
+      throw new CanvasAPIError("Failed to upload image", uploadRes.status);
+    }
+
+    const statusUrl = `${this.canvasUrl}/overwrite/upload/${upload.upload_id}`;
+    let status = await this.fetchUploadStatus(statusUrl, "POST");
+    while (status.status === "pending" || status.status === "uploaded") {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      status = await this.fetchUploadStatus(statusUrl, "GET");
+    }
+
+    if (status.status === "failed") {
+      throw new CanvasAPIError(status.error || "Failed to apply image", 422);
+    }
+    return { pixels_updated: status.pixels_updated ?? 0 };
+  }
+
+  private async fetchUploadStatus(url: string, method: string): Promise<ImageUploadStatus> {
+    const res = await fetchWithAuth(url, { method, credentials: "include" });
+
+    if (!res.ok) {
+      const text = await res.text();
+      throw new CanvasAPIError(text || "Failed to apply image", res.status);
+    }
+
     return await res.json();
   }
 
   getDownloadUrl(snapshotId: string): string {
-    return `${this.baseUrl}/canvas/snapshot/${snapshotId}/download`;
+    return `${this.canvasUrl}/snapshot/${snapshotId}/download`;
   }
 }
 
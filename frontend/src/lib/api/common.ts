@@ -2,6 +2,12 @@ export function getApiBase(): string {
   return "/api";
 }
 
+// Canvases other than the default one are opened with ?canvas=<id>
+export function getCanvasId(): string | null {
+  if (typeof window === "undefined") return null;
+  return new URLSearchParams(window.location.search).get("canvas");
+}
+
 export function getWebSocketBase(): string {
   return getApiBase() + "/ws";
 }
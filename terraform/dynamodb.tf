@@ -9,6 +9,17 @@ resource "aws_dynamodb_table" "canvas_state" {
   }
 }
 
+resource "aws_dynamodb_table" "canvas_meta" {
+  name         = "${var.project_name}-canvas-meta"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "canvas_id"
+
+  attribute {
+    name = "canvas_id"
+    type = "S"
+  }
+}
+
 resource "aws_dynamodb_table" "snapshots" {
   name         = "${var.project_name}-snapshots"
   billing_mode = "PAY_PER_REQUEST"
@@ -36,3 +47,25 @@ resource "aws_dynamodb_table" "snapshot_tiles" {
     type = "S"
   }
 }
+
+resource "aws_dynamodb_table" "pixel_history" {
+  name         = "${var.project_name}-pixel-history"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "partition"
+  range_key    = "sort_key"
+
+  attribute {
+    name = "partition"
+    type = "S"
+  }
+
+  attribute {
+    name = "sort_key"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
@@ -38,6 +38,10 @@ resource "aws_ecs_task_definition" "backend" {
         name  = "DYNAMODB_CANVAS_TABLE"
         value = aws_dynamodb_table.canvas_state.name
       },
+      {
+        name  = "DYNAMODB_CANVAS_META_TABLE"
+        value = aws_dynamodb_table.canvas_meta.name
+      },
       {
         name  = "DYNAMODB_SNAPSHOTS_TABLE"
         value = aws_dynamodb_table.snapshots.name
@@ -46,6 +50,10 @@ resource "aws_ecs_task_definition" "backend" {
         name  = "DYNAMODB_SNAPSHOT_TILES_TABLE"
         value = aws_dynamodb_table.snapshot_tiles.name
       },
+      {
+        name  = "DYNAMODB_HISTORY_TABLE"
+        value = aws_dynamodb_table.pixel_history.name
+      },
       {
         name  = "COGNITO_USER_POOL_ID"
         value = aws_cognito_user_pool.main.id
@@ -70,6 +78,10 @@ resource "aws_ecs_task_definition" "backend" {
         name  = "CANVAS_HEIGHT"
         value = tostring(var.canvas_height)
       },
+      {
+        name  = "CANVASES"
+        value = join(",", var.canvases)
+      },
       {
         name  = "MAX_SNAPSHOTS"
         value = tostring(var.max_snapshots)
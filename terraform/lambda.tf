@@ -16,8 +16,11 @@ resource "aws_lambda_function" "snapshot_scheduler" {
 
   environment {
     variables = {
-      API_URL    = "http://${aws_lb.main.dns_name}"
-      SYSTEM_KEY = random_password.system_key.result
+      API_URL               = "http://${aws_lb.main.dns_name}"
+      SYSTEM_KEY            = random_password.system_key.result
+      MIN_SNAPSHOT_INTERVAL = tostring(var.min_snapshot_interval)
+      MAX_SNAPSHOT_INTERVAL = tostring(var.max_snapshot_interval)
+      BURST_CHANGES         = tostring(var.snapshot_burst_changes)
     }
   }
 }
@@ -3,38 +3,73 @@ import json
 import urllib.request
 import urllib.error
 
+def _request(url, system_key, method="GET"):
+    req = urllib.request.Request(
+        url,
+        method=method,
+        headers={
+            "Authorization": f"Bearer {system_key}",
+            "Content-Type": "application/json"
+        }
+    )
+
+    with urllib.request.urlopen(req) as response:
+        return response.getcode(), json.loads(response.read().decode())
+
+def _desired_interval(activity, min_interval, max_interval, burst_changes):
+    # Scale linearly from the slowest cadence towards the fastest as placements pile up
+    load = min(1.0, activity["changes_since_snapshot"] / burst_changes)
+    return int(max_interval - (max_interval - min_interval) * load)
+
 def handler(event, context):
     api_url = os.environ.get("API_URL")
     if not api_url:
         raise ValueError("API_URL environment variable not set")
-        
+
     api_url = api_url.rstrip("/")
-    endpoint = f"{api_url}/api/canvas/snapshot"
-    
+
     system_key = os.environ.get("SYSTEM_KEY")
     if not system_key:
         raise ValueError("SYSTEM_KEY environment variable not set")
 
-    print(f"Triggering snapshot at {endpoint}...")
-
-    req = urllib.request.Request(
-        endpoint, 
-        method="POST",
-        headers={
-            "Authorization": f"Bearer {system_key}",
-            "Content-Type": "application/json"
-        }
-    )
+    min_interval = int(os.environ.get("MIN_SNAPSHOT_INTERVAL", 300))
+    max_interval = int(os.environ.get("MAX_SNAPSHOT_INTERVAL", 21600))
+    burst_changes = max(1, int(os.environ.get("BURST_CHANGES", 1000)))
 
     try:
-        with urllib.request.urlopen(req) as response:
-            status = response.getcode()
-            body = response.read().decode()
+        # Two item reads on the backend: the canvas version counter and the latest snapshot
+        _, activity = _request(f"{api_url}/api/canvas/activity", system_key)
+        interval = _desired_interval(activity, min_interval, max_interval, burst_changes)
+
+        last_snapshot_at = activity.get("last_snapshot_at")
+        if last_snapshot_at is not None:
+            elapsed = activity["now"] - last_snapshot_at
+            if activity["changes_since_snapshot"] <= 0 or elapsed < interval:
+                print(f"Skipping snapshot: {activity['changes_since_snapshot']} changes in {elapsed}s since last one, target interval {interval}s")
+                return {
+                    "statusCode": 200,
+                    "body": {"skipped": True, "interval": interval, "activity": activity}
+                }
+
+        try:
+            # History only grows with placements, so it only needs compacting when a snapshot is due
+            _, compaction = _request(f"{api_url}/api/canvas/history/compact", system_key, method="POST")
+            print(f"History compaction: {compaction}")
+        except Exception as e:
+            print(f"History compaction failed: {str(e)}")
+
+        endpoint = f"{api_url}/api/canvas/snapshot?if_changed=true"
+        print(f"Triggering snapshot at {endpoint} (target interval {interval}s)...")
+
+        status, body = _request(endpoint, system_key, method="POST")
+        if body.get("skipped"):
+            print("Canvas unchanged since last snapshot, nothing to do")
+        else:
             print(f"Snapshot triggered successfully. Status: {status}")
-            return {
-                "statusCode": status,
-                "body": json.loads(body)
-            }
+        return {
+            "statusCode": status,
+            "body": body
+        }
     except urllib.error.HTTPError as e:
         err_body = e.read().decode()
         print(f"HTTP Error {e.code}: {e.reason}")
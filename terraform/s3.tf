@@ -24,7 +24,11 @@ resource "aws_s3_bucket_policy" "snapshots" {
         Effect    = "Allow"
         Principal = "*"
         Action    = "s3:GetObject"
-        Resource  = "${aws_s3_bucket.snapshots.arn}/*"
+        # Only live pyramid tiles are public. Snapshots, their pyramids and timelapses are handed out
+        # as presigned URLs, and uploads are only read back by the API with its own credentials.
+        Resource = [
+          "${aws_s3_bucket.snapshots.arn}/pyramids/live*",
+        ]
       }
     ]
   })
@@ -37,9 +41,30 @@ resource "aws_s3_bucket_cors_configuration" "snapshots" { # Necessary for S3 fil
 
   cors_rule {
     allowed_headers = ["*"]
-    allowed_methods = ["GET", "HEAD"]
+    allowed_methods = ["GET", "HEAD", "POST"] # POST for presigned image uploads
     allowed_origins = ["*"]
     expose_headers  = ["ETag"]
     max_age_seconds = 3000
   }
 }
+
+resource "aws_s3_bucket_lifecycle_configuration" "snapshots" {
+  bucket = aws_s3_bucket.snapshots.id
+
+  rule {
+    id     = "expire-uploads" # Uploads that were never applied
+    status = "Enabled"
+
+    filter {
+      prefix = "uploads/"
+    }
+
+    expiration {
+      days = 1
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+}
@@ -27,6 +27,12 @@ variable "canvas_height" {
   default     = 100
 }
 
+variable "canvases" {
+  description = "Canvas ids served at /api/canvases/{id} besides the default canvas"
+  type        = list(string)
+  default     = []
+}
+
 variable "max_snapshots" {
   description = "Maximum number of snapshots to keep"
   type        = number
@@ -40,7 +46,25 @@ variable "heartbeat_interval" {
 }
 
 variable "snapshot_schedule_expression" {
-  description = "CloudWatch Events schedule expression for snapshots"
+  description = "CloudWatch Events schedule expression for the snapshot scheduler; it decides on each run whether a snapshot is due"
   type        = string
-  default     = "rate(1 hour)"
+  default     = "rate(5 minutes)"
+}
+
+variable "min_snapshot_interval" {
+  description = "Shortest time between snapshots in seconds, used while the canvas is busy"
+  type        = number
+  default     = 300
+}
+
+variable "max_snapshot_interval" {
+  description = "Longest time between snapshots in seconds, used while the canvas is idle"
+  type        = number
+  default     = 21600
+}
+
+variable "snapshot_burst_changes" {
+  description = "Number of pixels placed since the last snapshot at which snapshots are taken at the shortest interval"
+  type        = number
+  default     = 1000
 }